@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+# Measure how fast the Twisted VRT protocol can reassemble and parse
+# a stream of 32768-sample IQ packets delivered in TCP segments of
+# different sizes.  No device is required.
+
+import sys
+import time
+
+import numpy as np
+from twisted.test.proto_helpers import StringTransport
+
+from pyrf.connectors.twisted_async import VRTClient
+from pyrf.vrt import generate_data_packet, VRT_IFDATA_I14Q14
+
+SPP = 32768
+PACKETS = 200
+SEGMENT_SIZES = [536, 1448, 4096, 16384, 65536]
+
+if len(sys.argv) > 1:
+    SEGMENT_SIZES = [int(x) for x in sys.argv[1:]]
+
+samples = np.random.randint(-8192, 8192, size=(SPP, 2))
+stream = []
+count = 0
+for i in range(PACKETS):
+    packet, count = generate_data_packet(VRT_IFDATA_I14Q14, samples, count)
+    stream.append(packet)
+stream = b''.join(stream)
+
+for segment_size in SEGMENT_SIZES:
+    segments = [stream[i:i + segment_size]
+        for i in range(0, len(stream), segment_size)]
+    received = []
+    client = VRTClient(received.append)
+    client.makeConnection(StringTransport())
+
+    start = time.time()
+    for segment in segments:
+        client.dataReceived(segment)
+    elapsed = time.time() - start
+
+    assert len(received) == PACKETS
+    print('segment: %6d bytes %8.1f MB/s %8.1f packets/s' % (
+        segment_size,
+        len(stream) / elapsed / 1e6,
+        PACKETS / elapsed))
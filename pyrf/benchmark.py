@@ -0,0 +1,579 @@
+"""
+Benchmarks of the VRT parsing, FFT, sweep and capture code paths and of
+the connectors' receive rates, with results written as JSON so they can
+be compared between pyrf releases::
+
+    python -m pyrf.benchmark --output pyrf-2.10.0.json
+    python -m pyrf.benchmark --compare pyrf-2.9.0.json
+
+No RTSA is needed.  Packets are generated with fixed seeds, sweeps and
+captures are recorded once from a :class:`pyrf.simulator.RTSASimulator`
+and replayed from memory while they are timed, and connector rates are
+measured over loopback connections to a local server.
+
+Each benchmark is run until it takes at least *min_time* seconds, then
+that many iterations are timed *repeat* times and the fastest time is
+kept, which is the least affected by other activity on the machine.
+"""
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from timeit import default_timer
+
+import numpy as np
+
+from pyrf.version import __version__
+from pyrf.vrt import (vrt_packet_reader, vrt_packet_index,
+    generate_data_packet, generate_context_packet, generate_speca_packet,
+    VRT_IFDATA_I14Q14, VRT_IFDATA_I14, VRT_IFDATA_I24, VRT_IFDATA_PSD8,
+    VRTRECEIVER, VRTDIGITIZER, VRTCUSTOM)
+from pyrf.numpy_util import compute_fft
+from pyrf.devices.thinkrf_properties import wsa_properties
+from pyrf.connectors.blocking import PlainSocketConnector
+from pyrf.simulator import DEFAULT_DEVICE_ID
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: the version of the result file format
+RESULTS_VERSION = 1
+
+FFT_SPP = (256, 1024, 4096, 16384, 65504)
+
+#: compute_fft() options of each correction setting benchmarked
+FFT_CORRECTIONS = OrderedDict([
+    ('all', {}),
+    ('none', dict(correct_phase=False, iq_correction_wideband=False,
+        hide_differential_dc_offset=False, apply_spec_inv=False)),
+    ('window_only', dict(correct_phase=False, iq_correction_wideband=False,
+        hide_differential_dc_offset=False, apply_spec_inv=False,
+        convert_to_dbm=False, apply_reference=False)),
+    ])
+
+# the sample stream id of each RFE mode benchmarked
+FFT_MODES = OrderedDict([
+    ('ZIF', VRT_IFDATA_I14Q14),
+    ('SH', VRT_IFDATA_I14),
+    ])
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class _Device(object):
+    """
+    The properties compute_fft() needs from a device
+    """
+    properties = wsa_properties(DEFAULT_DEVICE_ID)
+
+
+def _sync(gen):
+    """
+    Run a @sync_async style generator like a blocking connector does
+    """
+    val = None
+    try:
+        while True:
+            val = gen.send(val)
+    except StopIteration:
+        return val
+
+
+def _time(func, number):
+    start = default_timer()
+    for i in range(number):
+        func()
+    return default_timer() - start
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """
+    Time calls to *func*
+
+    :param func: the function to time, called without arguments
+    :param float min_time: the least number of seconds to time calls for
+    :param int repeat: the number of times to time the calls, the
+                       fastest is kept
+    :returns: (number of calls timed, best seconds per call)
+    """
+    number = 1
+    while True:
+        elapsed = _time(func, number)
+        if elapsed >= min_time:
+            break
+        # aim a little past min_time so the next try is usually enough
+        number = max(number * 2,
+            int(number * min_time * 1.2 / max(elapsed, 1e-9)))
+    times = [elapsed] + [_time(func, number) for i in range(repeat - 1)]
+    return number, min(times) / number
+
+
+def _result(name, params, number, seconds, unit, items=1, nbytes=None):
+    """
+    Return a result dict for a benchmark that processes *items* items
+    (packets, sweeps, ...) and *nbytes* bytes in each call
+    """
+    result = OrderedDict([
+        ('benchmark', name),
+        ('params', params),
+        ('iterations', number),
+        ('seconds', seconds),
+        ('rate', items / seconds),
+        ('unit', unit),
+        ])
+    if nbytes is not None:
+        result['bytes_per_second'] = nbytes / seconds
+    return result
+
+
+def _samples(random, stream_id, spp):
+    if stream_id == VRT_IFDATA_I14Q14:
+        return random.randint(-2 ** 13, 2 ** 13, size=(spp, 2))
+    if stream_id == VRT_IFDATA_I24:
+        return random.randint(-2 ** 23, 2 ** 23, size=spp)
+    if stream_id == VRT_IFDATA_PSD8:
+        return random.randint(-128, 0, size=spp)
+    return random.randint(-2 ** 13, 2 ** 13, size=spp)
+
+
+def _data_packets(stream_id, spp, count, seed=0):
+    random = np.random.RandomState(seed)
+    packets = []
+    for i in range(count):
+        packet, n = generate_data_packet(stream_id,
+            _samples(random, stream_id, spp), i, tsi=i)
+        packets.append(packet)
+    return b''.join(packets)
+
+
+def bench_vrt_parse(min_time, repeat, packets=256, spp=1024):
+    """
+    :func:`pyrf.vrt.vrt_packet_reader` packets/s for each stream id
+    """
+    streams = OrderedDict()
+    for stream_id in (VRT_IFDATA_I14Q14, VRT_IFDATA_I14, VRT_IFDATA_I24,
+            VRT_IFDATA_PSD8):
+        streams['0x%08x' % stream_id] = (spp,
+            _data_packets(stream_id, spp, packets))
+    for stream_id, field, value in [(VRTRECEIVER, 'rffreq', 2450e6),
+            (VRTDIGITIZER, 'reflevel', -10.0), (VRTCUSTOM, 'sweepid', 42)]:
+        streams['0x%08x' % stream_id] = (None, b''.join(
+            generate_context_packet(field, value, i)[0]
+            for i in range(packets)))
+    streams['speca'] = (None, b''.join(generate_speca_packet({
+        'center': 2450e6, 'rbw': 100e3,
+        'device_identifier': DEFAULT_DEVICE_ID}, i)[0]
+        for i in range(packets)))
+
+    for stream, (stream_spp, data) in streams.items():
+        def parse():
+            raw_read = io.BytesIO(data).read
+            for i in range(packets):
+                _sync(vrt_packet_reader(raw_read))
+        number, seconds = measure(parse, min_time, repeat)
+        yield _result('vrt_packet_reader', OrderedDict([
+            ('stream_id', stream), ('spp', stream_spp)]),
+            number, seconds, 'packets/s', packets, len(data))
+
+
+def bench_compute_fft(min_time, repeat):
+    """
+    :func:`pyrf.numpy_util.compute_fft` packets/s for each spp, mode,
+    correction setting and precision
+    """
+    dut = _Device()
+    for mode, stream_id in FFT_MODES.items():
+        context = {'reflevel': -10.0,
+            'bandwidth': dut.properties.FULL_BW[mode]}
+        for spp in FFT_SPP:
+            packet = vrt_packet_index(_data_packets(stream_id, spp, 1))[0]
+            for correction, options in FFT_CORRECTIONS.items():
+                for precision in ('double', 'single'):
+                    def fft():
+                        compute_fft(dut, packet, dict(context),
+                            precision=precision, **options)
+                    number, seconds = measure(fft, min_time, repeat)
+                    yield _result('compute_fft', OrderedDict([
+                        ('mode', mode), ('spp', spp),
+                        ('corrections', correction),
+                        ('precision', precision)]),
+                        number, seconds, 'packets/s')
+
+
+def _record(record, directory, name):
+    """
+    Call *record* with a :class:`pyrf.devices.thinkrf.WSA` connected to
+    a simulator, recording the packets it reads.  Returns the recording's
+    filename.
+    """
+    from pyrf.devices.thinkrf import WSA
+    from pyrf.simulator import RTSASimulator, SimulatorConnector
+
+    dut = WSA(SimulatorConnector(RTSASimulator(
+        tones=[(2450e6, -30.0), (5800e6, -50.0)], noise_level=-100.0)))
+    dut.connect('simulator')
+    filename = os.path.join(directory, name)
+    with open(filename, 'wb') as f:
+        f.write(generate_speca_packet({'device_class': 'thinkrf.WSA',
+            'device_identifier': dut.device_id})[0])
+        dut.set_recording_output(f)
+        record(dut)
+        dut.set_recording_output(None)
+    return filename
+
+
+# (mode, fstart, fstop, rbw) of the sweeps benchmarked
+SWEEPS = [
+    ('SH', 2000e6, 2600e6, 100e3),
+    ('SH', 100e6, 8000e6, 100e3),
+    ('SHN', 100e6, 8000e6, 100e3),
+    ('ZIF', 2000e6, 2600e6, 100e3),
+    ]
+
+def bench_sweep(min_time, repeat, directory):
+    """
+    :class:`pyrf.sweep_device.SweepDevice` time per sweep, including
+    the FFTs, of sweeps recorded from the simulator and replayed with
+    :class:`pyrf.devices.playback.Playback`.  Sweeps are also timed
+    with a worker process per CPU on machines with several CPUs.
+    """
+    from pyrf.sweep_device import SweepDevice
+    from pyrf.devices.playback import Playback
+
+    cpus = multiprocessing.cpu_count()
+    for mode, fstart, fstop, rbw in SWEEPS:
+        def record(dut):
+            SweepDevice(dut).capture_power_spectrum(fstart, fstop, rbw,
+                mode=mode)
+        filename = _record(record, directory, 'sweep.vrt')
+        for workers in (0, cpus) if cpus > 1 else (0,):
+            dut = Playback(filename=filename)
+            sd = SweepDevice(dut, workers=workers)
+            def sweep():
+                dut.rewind()
+                sd.capture_power_spectrum(fstart, fstop, rbw, mode=mode)
+            sweep()
+            data_packets = dut.stats.data_packets
+            number, seconds = measure(sweep, min_time, repeat)
+            yield _result('sweep_device', OrderedDict([
+                ('mode', mode), ('fstart', fstart), ('fstop', fstop),
+                ('rbw', rbw), ('packets', data_packets),
+                ('workers', workers)]),
+                number, seconds, 'sweeps/s')
+            sd.close()
+            dut.close()
+
+
+# (mode, rbw) of the captures benchmarked
+CAPTURES = [
+    ('SH', 100e3),
+    ('SH', 1e3),
+    ('ZIF', 100e3),
+    ('ZIF', 1e3),
+    ]
+
+def bench_capture(min_time, repeat, directory):
+    """
+    :class:`pyrf.capture_device.CaptureDevice` blocks/s assembled from
+    the packets of a capture recorded from the simulator
+    """
+    from pyrf.capture_device import CaptureDevice
+
+    for mode, rbw in CAPTURES:
+        devices = []
+        def record(dut):
+            cd = CaptureDevice(dut)
+            cd.capture_time_domain(mode, 2450e6, rbw)
+            devices.append(cd)
+        filename = _record(record, directory, 'capture.vrt')
+        cd = devices[0]
+        with open(filename, 'rb') as f:
+            index = vrt_packet_index(f.read())
+        # the SPECA state packet isn't part of the capture
+        packets = [index[i] for i in range(1, len(index))]
+        def capture():
+            for packet in packets:
+                cd.read_data(packet)
+        number, seconds = measure(capture, min_time, repeat)
+        yield _result('capture_device', OrderedDict([
+            ('mode', mode), ('rbw', rbw), ('spp', cd.points),
+            ('ppb', cd.packets_per_block)]),
+            number, seconds, 'blocks/s')
+
+
+class _LoopbackServer(object):
+    """
+    Send *data* to every client that connects to :attr:`port` on the
+    loopback interface, then close the connection
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(1)
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, addr = self._listener.accept()
+            except socket.error:
+                return
+            try:
+                sock.sendall(self.data)
+            except socket.error as err:
+                logger.debug('benchmark client lost: %s', err)
+            finally:
+                sock.close()
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 ** 20)
+        return sock
+
+    def close(self):
+        self._listener.close()
+
+
+def _blocking_receive(server, packets, recv_buffer_size=None):
+    connector = PlainSocketConnector(recv_buffer_size)
+    # connect() only uses the RTSA's ports, the loopback server isn't on them
+    connector._sock_vrt = server.connect()
+    try:
+        for i in range(packets):
+            connector.sync_async(vrt_packet_reader(connector.raw_read,
+                connector.stats))
+    finally:
+        connector._sock_vrt.close()
+    if connector.stats.data_packets != packets:
+        raise BenchmarkError("blocking connector received %d of %d packets"
+            % (connector.stats.data_packets, packets))
+
+
+def _asyncio_receive(server, packets):
+    import asyncio
+    from pyrf.connectors.asyncio_async import VRTProtocol
+
+    loop = asyncio.new_event_loop()
+    try:
+        done = loop.create_future()
+        received = []
+        def lost():
+            if not done.done():
+                done.set_result(None)
+        loop.run_until_complete(loop.create_connection(
+            lambda: VRTProtocol(received.append, lost),
+            '127.0.0.1', server.port))
+        loop.run_until_complete(done)
+    finally:
+        loop.close()
+    if len(received) != packets:
+        raise BenchmarkError("asyncio connector received %d of %d packets"
+            % (len(received), packets))
+
+
+def _twisted_receive(server, packets):
+    from twisted.internet import reactor
+    from pyrf.connectors.twisted_async import VRTClientFactory
+
+    received = []
+    def receive(packet):
+        received.append(packet)
+        if len(received) == packets:
+            reactor.stop()
+    reactor.connectTCP('127.0.0.1', server.port, VRTClientFactory(receive))
+    reactor.callLater(60, reactor.stop)
+    start = default_timer()
+    reactor.run()
+    seconds = default_timer() - start
+    if len(received) != packets:
+        raise BenchmarkError("twisted connector received %d of %d packets"
+            % (len(received), packets))
+    return seconds
+
+
+def bench_connectors(min_time, repeat, packets=200, spp=16384):
+    """
+    VRT packets/s received over loopback by the blocking connector, with
+    and without a receive buffer, and by the asyncio and Twisted
+    connectors when they are available.
+
+    The Twisted reactor can only be run once, so its rate comes from a
+    single connection instead of the best of several.
+    """
+    data = _data_packets(VRT_IFDATA_I14Q14, spp, packets)
+    server = _LoopbackServer(data)
+    params = lambda connector: OrderedDict([('connector', connector),
+        ('spp', spp), ('packets', packets)])
+    try:
+        number, seconds = measure(lambda: _blocking_receive(server, packets),
+            min_time, repeat)
+        yield _result('connector', params('blocking'), number, seconds,
+            'packets/s', packets, len(data))
+
+        number, seconds = measure(lambda: _blocking_receive(server, packets,
+            recv_buffer_size=2 ** 22), min_time, repeat)
+        yield _result('connector', params('blocking_recv_buffer'), number,
+            seconds, 'packets/s', packets, len(data))
+
+        try:
+            import asyncio
+        except ImportError:
+            logger.info('asyncio not available, skipping its connector')
+        else:
+            number, seconds = measure(lambda: _asyncio_receive(server,
+                packets), min_time, repeat)
+            yield _result('connector', params('asyncio'), number, seconds,
+                'packets/s', packets, len(data))
+
+        try:
+            import twisted
+        except ImportError:
+            logger.info('twisted not available, skipping its connector')
+        else:
+            seconds = _twisted_receive(server, packets)
+            yield _result('connector', params('twisted'), 1, seconds,
+                'packets/s', packets, len(data))
+    finally:
+        server.close()
+
+
+#: the benchmarks run_benchmarks() can run, by name
+BENCHMARKS = OrderedDict([
+    ('vrt_packet_reader', bench_vrt_parse),
+    ('compute_fft', bench_compute_fft),
+    ('sweep_device', bench_sweep),
+    ('capture_device', bench_capture),
+    ('connector', bench_connectors),
+    ])
+
+_NEED_DIRECTORY = ('sweep_device', 'capture_device')
+
+
+def run_benchmarks(names=None, min_time=0.2, repeat=3, progress=None):
+    """
+    Run benchmarks and return their results as a dict that can be
+    saved with :func:`json.dump`
+
+    :param list names: names from :data:`BENCHMARKS` to run, or None to
+                       run them all
+    :param float min_time: the least number of seconds to time each
+                           benchmark for, see :func:`measure`
+    :param int repeat: the number of times to time each benchmark
+    :param progress: a function to call with each result as it is
+                     measured, or None
+    :returns: a dict with 'pyrf', 'python', 'numpy' and 'platform'
+              versions, the 'time' the benchmarks were started and a
+              list of 'results' dicts with 'benchmark', 'params',
+              'iterations', 'seconds' (per iteration), 'rate' and
+              'unit' keys
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise BenchmarkError("unknown benchmark: %r" % (name,))
+
+    results = []
+    report = OrderedDict([
+        ('version', RESULTS_VERSION),
+        ('pyrf', __version__),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('platform', platform.platform()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('min_time', min_time),
+        ('repeat', repeat),
+        ('results', results),
+        ])
+    directory = tempfile.mkdtemp(prefix='pyrf-benchmark-')
+    try:
+        for name in names:
+            args = (min_time, repeat)
+            if name in _NEED_DIRECTORY:
+                args += (directory,)
+            for result in BENCHMARKS[name](*args):
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    finally:
+        shutil.rmtree(directory)
+    return report
+
+
+def _result_key(result):
+    return (result['benchmark'],
+        json.dumps(result['params'], sort_keys=True))
+
+
+def compare_results(old, new):
+    """
+    Match the results of two :func:`run_benchmarks` reports
+
+    :returns: a list of (result from *new*, rate in *new* / rate in
+              *old*) tuples for the results measured in both
+    """
+    old_rates = dict((_result_key(r), r['rate']) for r in old['results'])
+    return [(r, r['rate'] / old_rates[_result_key(r)])
+        for r in new['results'] if _result_key(r) in old_rates]
+
+
+def _format_result(result):
+    params = ' '.join('%s=%s' % (k, v) for k, v in result['params'].items())
+    return '%-18s %-60s %12.1f %s' % (result['benchmark'], params,
+        result['rate'], result['unit'])
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark pyrf and "
+        "write the results as JSON")
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+        help="benchmarks to run: %s (default all)" % ', '.join(BENCHMARKS))
+    parser.add_argument('-o', '--output',
+        help="file to write the JSON results to (default stdout)")
+    parser.add_argument('--compare', metavar='FILE',
+        help="JSON results of an earlier run to compare with")
+    parser.add_argument('--min-time', type=float, default=0.2,
+        help="least seconds to time each benchmark (default %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+        help="times to time each benchmark (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    def progress(result):
+        sys.stderr.write(_format_result(result) + '\n')
+
+    report = run_benchmarks(args.benchmarks or None, args.min_time,
+        args.repeat, progress)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        sys.stderr.write('\ncompared with pyrf %s:\n' % old['pyrf'])
+        for result, ratio in compare_results(old, report):
+            sys.stderr.write('%s %+6.1f%%\n' % (_format_result(result),
+                (ratio - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
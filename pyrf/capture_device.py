@@ -2,7 +2,7 @@ import math
 
 from pyrf.util import compute_usable_bins, compute_spp_ppb, adjust_usable_fstart_fstop, compute_spp_ppb
 from pyrf.vrt import I_ONLY
-from pyrf.vrt import DataPacket
+from pyrf.vrt import DataPacket, BlockAssembler
 import numpy as np
 
 class CaptureDeviceError(Exception):
@@ -42,6 +42,7 @@ class CaptureDevice(object):
         self.packets_per_block = 1
         self.packets_read = 0
         self.points = 0
+        self._block = BlockAssembler(self.packets_per_block)
 
     def configure_device(self, device_settings, force_change = False):
         """
@@ -96,6 +97,7 @@ class CaptureDevice(object):
         self.points = round(max(min_points, self.points))
 
         self.points, self.packets_per_block = compute_spp_ppb(self.points, prop)
+        self._block = BlockAssembler(self.packets_per_block)
 
         fshift = self._device_set.get('fshift', 0)
         decimation = self._device_set.get('decimation', 1)
@@ -107,7 +109,7 @@ class CaptureDevice(object):
 
             return
 
-        self.real_device.capture(self.points, self._data_packets)
+        self.real_device.capture(self.points, self.packets_per_block)
 
         result = None
         while result is None:
@@ -120,17 +122,12 @@ class CaptureDevice(object):
             return
         self.packets_read += 1
 
-        if self.packets_read == 1:
-            self.data_packet = packet
-        else:
-            # if packet type changes, skip packet with a different size
-            try:
-                self.data_packet.data.np_array = np.concatenate([self.data_packet.data.np_array, packet.data.np_array])
-            except ValueError:
-                x = 1
-        if self.packets_read != self.packets_per_block:
-
+        # copy the packet into the block, packets with a different type
+        # of data are skipped
+        block = self._block.add(packet)
+        if block is None:
             return
+        self.data_packet = block
 
         data= {
             'context_pkt' : self._vrt_context,
@@ -0,0 +1,356 @@
+try:
+    import asyncio
+    Protocol = asyncio.Protocol
+except ImportError:
+    # asyncio is only available on Python 3, allow docstrings to be
+    # visible even when the import fails
+    asyncio = None
+    Protocol = object
+
+from collections import deque
+
+from pyrf.connectors.base import (SCPI_PORT, VRT_PORT, ChunkBuffer,
+    split_scpi_response)
+from pyrf.vrt import vrt_packet_reader
+from pyrf.stats import ConnectionStats
+import logging
+logger = logging.getLogger(__name__)
+
+class AsyncioConnectorError(Exception):
+    pass
+
+class AsyncioConnector(object):
+    """
+    A connector that makes SCPI/VRT connections asynchronously using
+    an asyncio event loop.  Methods of devices using this connector
+    return asyncio Futures that may be awaited.
+
+    :param loop: the asyncio event loop to use, defaults to the current
+                 event loop
+    :param callback vrt_callback: A callback may be assigned to *vrt_callback* that will be called with VRT packets as they arrive.  When *vrt_callback* is None (the default), arriving packets will be ignored.
+    """
+
+    def __init__(self, loop=None, vrt_callback=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self.vrt_callback = vrt_callback
+        self.stats = ConnectionStats()
+        self._streams = []
+
+    def connect(self, host, output_file=None, timeout=8):
+        def _connect():
+            transport, self._scpi = yield asyncio.wait_for(
+                self._loop.create_connection(
+                    lambda: SCPIProtocol(self._loop, timeout),
+                    host, SCPI_PORT),
+                timeout)
+            transport, self._vrt = yield asyncio.wait_for(
+                self._loop.create_connection(
+                    lambda: VRTProtocol(self._vrt_callback,
+                        self._vrt_lost, self.stats),
+                    host, VRT_PORT),
+                timeout)
+        return self.sync_async(_connect())
+
+    def disconnect(self):
+        self._vrt.transport.close()
+        self._scpi.transport.close()
+
+    def scpiset(self, cmd):
+        self._scpi.scpiset("%s\n" % cmd)
+
+    def scpiget(self, cmd):
+        return self._scpi.scpiget("%s\n" % cmd)
+
+    def scpiget_many(self, cmds):
+        return asyncio.gather(
+            *[self._scpi.scpiget("%s\n" % cmd) for cmd in cmds])
+
+    def sync_async(self, gen):
+        """
+        Handler for the @sync_async decorator.  The generator is
+        advanced each time a Future or coroutine it yields completes,
+        and the Future returned resolves to the last value yielded.
+        """
+        result = self._loop.create_future()
+
+        def advance(value):
+            while True:
+                try:
+                    value = gen.send(value)
+                except StopIteration:
+                    result.set_result(value)
+                    return
+                except Exception as e:
+                    result.set_exception(e)
+                    return
+                if asyncio.isfuture(value) or asyncio.iscoroutine(value):
+                    break
+
+            pending = asyncio.ensure_future(value, loop=self._loop)
+            pending.add_done_callback(done)
+
+        def done(pending):
+            if pending.cancelled():
+                result.cancel()
+            elif pending.exception() is not None:
+                result.set_exception(pending.exception())
+            else:
+                advance(pending.result())
+
+        advance(None)
+        return result
+
+    def add_callbacks(self, result, callback, errback):
+        """
+        Call *callback* with the value of the Future *result* once it
+        completes, or *errback* with the exception raised.
+        """
+        def done(result):
+            if result.exception() is not None:
+                errback(result.exception())
+            else:
+                callback(result.result())
+        result.add_done_callback(done)
+
+    def eof(self):
+        return self._vrt.eof
+
+    def raw_read(self, num_bytes):
+        raise AsyncioConnectorError('synchronous read() not supported.')
+
+    def pause_vrt(self):
+        """
+        Stop reading from the VRT connection until :meth:`resume_vrt`
+        is called, so that the RTSA stops sending once the socket
+        buffers are full.
+        """
+        self._vrt.transport.pause_reading()
+
+    def resume_vrt(self):
+        """
+        Resume reading from the VRT connection.
+        """
+        self._vrt.transport.resume_reading()
+
+    def packets(self, maxsize=0):
+        """
+        Return an asynchronous iterator of the VRT packets received
+        from now on, for use with ``async for``.
+
+        :param int maxsize: when non-zero, reading from the VRT
+            connection is paused while this many packets are waiting
+            to be consumed
+        """
+        stream = PacketStream(self, maxsize)
+        self._streams.append(stream)
+        return stream
+
+    def _vrt_callback(self, packet):
+        if self.vrt_callback:
+            self.vrt_callback(packet)
+        for stream in self._streams:
+            stream._put(packet)
+
+    def _vrt_lost(self):
+        for stream in self._streams:
+            stream._finish()
+
+
+class PacketStream(object):
+    """
+    An asynchronous iterator of VRT packets returned by
+    :meth:`AsyncioConnector.packets`.  Iteration stops when the VRT
+    connection is closed.
+    """
+
+    def __init__(self, connector, maxsize):
+        self._connector = connector
+        self._maxsize = maxsize
+        self._packets = deque()
+        self._waiting = None
+        self._paused = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self._connector._loop.create_future()
+        if self._packets:
+            future.set_result(self._packets.popleft())
+            self._resume()
+        elif self._connector.eof():
+            future.set_exception(StopAsyncIteration())
+        else:
+            self._waiting = future
+        return future
+
+    def close(self):
+        """
+        Stop queuing packets for this iterator.
+        """
+        if self in self._connector._streams:
+            self._connector._streams.remove(self)
+        self._packets.clear()
+        self._resume()
+        self._finish()
+
+    def _put(self, packet):
+        if self._waiting is not None and not self._waiting.done():
+            self._waiting.set_result(packet)
+            self._waiting = None
+            return
+        self._packets.append(packet)
+        if self._maxsize and len(self._packets) >= self._maxsize:
+            self._connector._vrt.transport.pause_reading()
+            self._paused = True
+
+    def _resume(self):
+        if self._paused and len(self._packets) < self._maxsize:
+            self._paused = False
+            self._connector._vrt.transport.resume_reading()
+
+    def _finish(self):
+        if self._waiting is not None and not self._waiting.done():
+            self._waiting.set_exception(StopAsyncIteration())
+        self._waiting = None
+
+
+class VRTProtocol(Protocol):
+    """
+    An asyncio protocol for the VRT connection.
+
+    :param receive_callback: a function that will be passed a vrt
+        DataPacket or ContextPacket when it is received
+    :param lost_callback: a function that will be called when the
+        connection is closed
+    :param stats: a :class:`pyrf.stats.ConnectionStats` to record
+        received packets in, or None
+    """
+    transport = None
+    eof = False
+
+    def __init__(self, receive_callback, lost_callback=None, stats=None):
+        self._receive_callback = receive_callback
+        self._lost_callback = lost_callback
+        self._stats = stats
+        self._buf = ChunkBuffer()
+        self._bytes_required = 0
+        self._resetReader()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def _resetReader(self):
+        self._packet_reader = vrt_packet_reader(self._setBytesRequired,
+            self._stats)
+        next(self._packet_reader)
+
+    def _setBytesRequired(self, x):
+        self._bytes_required = x
+
+    def data_received(self, data):
+        self._buf.append(data)
+        while True:
+            data = self._buf.consume(self._bytes_required)
+            if not data:
+                break
+            response = self._packet_reader.send(data)
+            if response:
+                self._receive_callback(response)
+                self._resetReader()
+
+    def connection_lost(self, exc):
+        self.eof = True
+        if self._lost_callback:
+            self._lost_callback()
+
+
+class SCPIProtocol(Protocol):
+    """
+    An asyncio protocol for the SCPI connection.  Responses are matched
+    to queries in the order the queries were sent and returned as bytes,
+    like the other connectors return them.
+
+    :param loop: the asyncio event loop
+    :param float timeout: seconds to wait for each response, when a
+        response takes longer every query waiting fails with an IOError
+        and the connection is closed
+    """
+    transport = None
+    _closed = False
+
+    def __init__(self, loop, timeout):
+        self._loop = loop
+        self.timeout = timeout
+        self._pending = deque()
+        self._buf = b''
+        self._timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def scpiset(self, cmd):
+        logger.debug('scpiset %r', cmd)
+        self.transport.write(cmd.encode('latin-1'))
+
+    def scpiget(self, cmd):
+        logger.debug('scpiget %r', cmd)
+        future = self._loop.create_future()
+        if self._closed:
+            future.set_exception(IOError("scpi connection lost"))
+            return future
+        self._pending.append(future)
+        if self._timer is None:
+            self._start_timer()
+        self.transport.write(cmd.encode('latin-1'))
+        return future
+
+    def _start_timer(self):
+        self._timer = self._loop.call_later(self.timeout, self._timed_out)
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _timed_out(self):
+        # a late response to the query that timed out can't be told apart
+        # from the responses to the queries sent after it, so fail every
+        # query waiting and drop the connection
+        self._timer = None
+        self._closed = True
+        self._fail_queries("scpi timed out")
+        self.transport.close()
+
+    def data_received(self, data):
+        # The firmware sometimes sends an extra query unexpectedly
+        if self._closed or not self._pending:
+            return
+        self._buf += data
+        while self._pending:
+            found = split_scpi_response(self._buf)
+            if found is None:
+                break
+            response, used = found
+            self._buf = self._buf[used:]
+            logger.debug('scpigot %r', response)
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_result(response)
+        self._stop_timer()
+        if self._pending:
+            self._start_timer()
+        else:
+            self._buf = b''
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._stop_timer()
+        self._fail_queries("scpi connection lost")
+
+    def _fail_queries(self, message):
+        self._buf = b''
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(IOError(message))
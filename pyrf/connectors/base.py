@@ -1,3 +1,4 @@
+from collections import deque
 from functools import wraps
 
 SCPI_PORT = 37001
@@ -21,3 +22,104 @@ def sync_async(f):
     return wrapper
 
 
+
+
+class ChunkBuffer(object):
+    """
+    A receive buffer for stream protocols that keeps the chunks of data
+    passed to :meth:`append` as they are.  :meth:`consume` returns a
+    memoryview slice of a single chunk when the bytes requested lie
+    within it and only joins bytes when a read spans chunks, so unread
+    data is never moved or copied as more data arrives.
+
+    Chunks must be immutable (e.g. the bytes objects delivered by
+    Twisted or asyncio) because returned views reference them directly.
+    """
+
+    def __init__(self):
+        self._chunks = deque()
+        self._offset = 0  # read position within self._chunks[0]
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def append(self, data):
+        if data:
+            self._chunks.append(data)
+            self._length += len(data)
+
+    def consume(self, num_bytes):
+        """
+        Remove and return the next *num_bytes* bytes as a memoryview,
+        or return None if not enough bytes are available.
+        """
+        if self._length < num_bytes:
+            return None
+        if not num_bytes:
+            return memoryview(b"")
+        self._length -= num_bytes
+
+        chunk = self._chunks[0]
+        start = self._offset
+        end = start + num_bytes
+        if end <= len(chunk):
+            if end == len(chunk):
+                self._chunks.popleft()
+                self._offset = 0
+            else:
+                self._offset = end
+            return memoryview(chunk)[start:end]
+
+        # read spans chunks, join only the bytes requested
+        parts = [chunk[start:]]
+        self._chunks.popleft()
+        self._offset = 0
+        needed = num_bytes - len(parts[0])
+        while needed:
+            chunk = self._chunks[0]
+            if len(chunk) <= needed:
+                parts.append(chunk)
+                self._chunks.popleft()
+                needed -= len(chunk)
+            else:
+                parts.append(chunk[:needed])
+                self._offset = needed
+                needed = 0
+        return memoryview(b"".join(parts))
+
+
+def split_scpi_response(buf):
+    """
+    Find the first complete SCPI response in *buf*.
+
+    ASCII responses are returned including their trailing newline,
+    '#'-prefixed block responses are returned as the block data only,
+    without the header or trailing newline.
+
+    :param buf: bytes received from the SCPI connection
+    :returns: (response, number of bytes used) or None if *buf* does
+              not yet hold a complete response
+    """
+    if buf[:1] != b'#':
+        end = buf.find(b'\n')
+        if end < 0:
+            return None
+        return buf[:end + 1], end + 1
+
+    if len(buf) < 2:
+        return None
+    numlen = int(buf[1:2])
+    if not numlen:
+        # indefinite length block, terminated by a newline
+        end = buf.find(b'\n', 2)
+        if end < 0:
+            return None
+        return buf[2:end], end + 1
+    if len(buf) < 2 + numlen:
+        return None
+    blocklen = int(buf[2:2 + numlen])
+    end = 2 + numlen + blocklen
+    if len(buf) < end + 1:
+        return None
+    return buf[2 + numlen:end], end + 1
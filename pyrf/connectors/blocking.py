@@ -1,6 +1,8 @@
 import socket
 
-from pyrf.connectors.base import sync_async, SCPI_PORT, VRT_PORT
+from pyrf.connectors.base import (sync_async, SCPI_PORT, VRT_PORT,
+    split_scpi_response)
+from pyrf.stats import ConnectionStats
 
 import logging
 logger = logging.getLogger(__name__)
@@ -8,14 +10,30 @@ logger = logging.getLogger(__name__)
 class PlainSocketConnector(object):
     """
     This connector makes SCPI/VRT socket connections using plain sockets, of blocking type.
+
+    :param int recv_buffer_size: when given, VRT data is received with
+        ``recv_into`` into a reusable buffer of this many bytes and
+        :meth:`raw_read` returns memoryview slices of that buffer instead
+        of new byte strings.  Packet data then remains valid only until
+        the buffer wraps around, so the buffer should be several times
+        larger than the largest packet expected and packets that need
+        to be kept longer must be copied.  Must be larger than the
+        largest packet.
     """
 
-    def __init__(self):
+    def __init__(self, recv_buffer_size=None):
         self._sock_scpi = None
         self._sock_vrt = None
+        self._recv_buf = None
+        self._scpi_buf = b''
+        self.stats = ConnectionStats()
+        if recv_buffer_size:
+            self._recv_buf = memoryview(bytearray(recv_buffer_size))
+            self._recv_pos = 0
 
     def connect(self, host, timeout=8): # if after 8s nothing has happened, throw timeout
         """connect scpi and vrt with a timeout"""
+        self._scpi_buf = b''
         try:
             self._sock_scpi = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self._sock_scpi.settimeout(timeout)
@@ -48,57 +66,55 @@ class PlainSocketConnector(object):
     def scpiset(self, cmd):
         cmd = "%s\n" % cmd
         logger.debug('scpiset %r', cmd)
-        self._sock_scpi.send(cmd)
+        self._sock_scpi.sendall(cmd.encode('latin-1'))
 
     def scpiget(self, cmd):
         """send a query to the device and wait for its response"""
-        cmd = "%s\n" % cmd
+        return self.scpiget_many([cmd])[0]
+
+    def scpiget_many(self, cmds):
+        """
+        Send all the queries in *cmds* at once then wait for their
+        responses, saving a network round trip per query.
+
+        :returns: a list of responses in the same order as *cmds*
+        """
+        cmd = "".join("%s\n" % c for c in cmds)
         logger.debug('scpiget %r', cmd)
         try:
-            self._sock_scpi.send(cmd)
+            self._sock_scpi.sendall(cmd.encode('latin-1'))
         except socket.error as err:
             logger.error('scpiget (send) failed on socket error: %s', err)
             raise
 
-        try:
-            buf = self._sock_scpi.recv(1024)
-        except socket.error as err:
-            logger.error('scpiget (recv) failed on socket error: %s', err)
-            raise
-
-        # test the first character to see if this is ascii or block data
-        if buf[0] != '#':
-            # ascii response, just return it
-            logger.debug('scpigot %r', buf)
-            return buf
-
-        #
-        # first character is '#', so it's block data
-        #
-
-        # parse the number of digits
-        numlen = int(buf[1])
-
-        # now parse the actual block len
-        blocklen = int(buf[2:2 + numlen])
+        responses = []
+        for c in cmds:
+            responses.append(self._scpi_response())
+        return responses
 
-        # figure out how much we have already
-        lenread = len(buf) - 2 - numlen
-
-        # read bytes until we get all of it
-        blockbuf = buf[2 + numlen:]
-        while lenread < blocklen:
+    def _scpi_response(self):
+        """
+        read the next ascii or '#'-prefixed block response, ascii
+        responses are returned with their trailing newline and block
+        responses without the header and trailing newline
+        """
+        while True:
+            found = split_scpi_response(self._scpi_buf)
+            if found is not None:
+                break
             try:
-                buf = self._sock_scpi.recv(1024)
+                buf = self._sock_scpi.recv(4096)
             except socket.error as err:
                 logger.error('scpiget (recv) failed on socket error: %s', err)
                 raise
+            if not buf:
+                raise IOError('scpi connection closed')
+            self._scpi_buf += buf
 
-            blockbuf += buf
-            lenread += len(buf)
-
-        # that's all our bytes, return the byte string for them to deal with, but don't return the trailing \n
-        return blockbuf[:-1]
+        response, used = found
+        self._scpi_buf = self._scpi_buf[used:]
+        logger.debug('scpigot %r', response)
+        return response
 
     def eof(self):
         # FIXME: lies
@@ -109,7 +125,16 @@ class PlainSocketConnector(object):
         return self._vrt.has_data()
 
     def raw_read(self, num):
-        return socketread(self._sock_vrt, num)
+        if self._recv_buf is None or num > len(self._recv_buf):
+            return socketread(self._sock_vrt, num)
+
+        if self._recv_pos + num > len(self._recv_buf):
+            self._recv_pos = 0
+        view = self._recv_buf[self._recv_pos:self._recv_pos + num]
+        if not socketread_into(self._sock_vrt, view, num):
+            return False
+        self._recv_pos += num
+        return view
 
     def sync_async(self, gen):
         """
@@ -140,8 +165,38 @@ def socketread(socket, count, flags = None):
     if datalen == 0:
         return False
 
+    if datalen == count:
+        return data
+
+    chunks = [data]
     while datalen < count:
-        data = data + socket.recv(count - datalen)
-        datalen = len(data)
+        data = socket.recv(count - datalen)
+        if not data:
+            return False
+        chunks.append(data)
+        datalen += len(data)
+
+    return b"".join(chunks)
 
-    return data
+
+def socketread_into(socket, view, count, flags=None):
+    """
+    Retry socket recv_into until *count* amount of data has been
+    written to *view*, without allocating new byte strings.
+
+    :param view: a writable memoryview at least *count* bytes long
+    :param int count: the amount of data to receive
+    :param flags: socket.recv_into() related flags
+    :returns: True when *count* bytes were received, False if the
+              connection was closed
+    """
+    if not flags:
+        flags = 0
+    datalen = 0
+    while datalen < count:
+        received = socket.recv_into(view[datalen:count], count - datalen,
+            flags)
+        if not received:
+            return False
+        datalen += received
+    return True
@@ -13,16 +13,14 @@ except ImportError:
     # imports fail
     Factory = Protocol = StatefulProtocol = object
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+from collections import deque
 
-from pyrf.connectors.base import sync_async, SCPI_PORT, VRT_PORT
+from pyrf.connectors.base import (sync_async, SCPI_PORT, VRT_PORT,
+    ChunkBuffer, split_scpi_response)
 from pyrf.vrt import vrt_packet_reader, generate_speca_packet
+from pyrf.stats import ConnectionStats
 import logging
 import time
-import os
 logger = logging.getLogger(__name__)
 
 class TwistedConnectorError(Exception):
@@ -35,21 +33,26 @@ class TwistedConnector(object):
 
     :param reactor: a twisted reactor, (ex: "from twisted.internet import reactor")
     :param callback vrt_callback: A callback may be assigned to *vrt_callback* that will be called with VRT packets as they arrive.  When *vrt_callback* is None (the default), arriving packets will be ignored.
+    :param bool scpi_pipelining: send SCPI queries without waiting for
+        the responses to earlier queries
     """
 
-    def __init__(self, reactor, vrt_callback=None):
+    def __init__(self, reactor, vrt_callback=None, scpi_pipelining=True):
         self._reactor = reactor
         self.vrt_callback = vrt_callback
+        self.scpi_pipelining = scpi_pipelining
+        self.stats = ConnectionStats()
 
     def connect(self, host, output_file=None, timeout=8):
         point = HostnameEndpoint(self._reactor, host, SCPI_PORT)
-        d = point.connect(SCPIClientFactory(timeout))
+        d = point.connect(SCPIClientFactory(timeout, self.scpi_pipelining))
 
         @d.addCallback
         def connect_vrt(scpi):
             self._scpi = scpi
             point = HostnameEndpoint(self._reactor, host, VRT_PORT)
-            return point.connect(VRTClientFactory(self._vrt_callback))
+            return point.connect(VRTClientFactory(self._vrt_callback,
+                self.stats))
 
         @d.addCallback
         def save_vrt(vrt):
@@ -68,10 +71,14 @@ class TwistedConnector(object):
         self._scpi.transport.loseConnection()
 
     def scpiset(self, cmd):
-        self._scpi.scpiset("%s\n" % cmd)
+        self._scpi.scpiset(("%s\n" % cmd).encode('latin-1'))
 
     def scpiget(self, cmd):
-        return self._scpi.scpiget("%s\n" % cmd)
+        return self._scpi.scpiget(("%s\n" % cmd).encode('latin-1'))
+
+    def scpiget_many(self, cmds):
+        return self._scpi.scpiget_many([("%s\n" % cmd).encode('latin-1')
+            for cmd in cmds])
 
     def sync_async(self, gen):
         def advance(result):
@@ -85,12 +92,33 @@ class TwistedConnector(object):
 
         return advance(None)
 
+    def add_callbacks(self, d, callback, errback):
+        """
+        Call *callback* with the result of the Deferred *d* or *errback*
+        with the exception that caused it to fail.
+        """
+        d.addCallbacks(callback, lambda failure: errback(failure.value))
+
     def eof(self):
         return self._vrt.eof
 
     def raw_read(self, num_bytes):
         raise TwistedConnectorError('synchronous read() not supported.')
 
+    def pause_vrt(self):
+        """
+        Stop reading from the VRT connection until :meth:`resume_vrt`
+        is called, so that the RTSA stops sending once the socket
+        buffers are full.
+        """
+        self._vrt.transport.pauseProducing()
+
+    def resume_vrt(self):
+        """
+        Resume reading from the VRT connection.
+        """
+        self._vrt.transport.resumeProducing()
+
     def _vrt_callback(self, packet):
         if self.vrt_callback:
             self.vrt_callback(packet)
@@ -102,6 +130,8 @@ class VRTClient(Protocol):
 
     :param receive_callback: a function that will be passed a vrt
         DataPacket or ContextPacket when it is received
+    :param stats: a :class:`pyrf.stats.ConnectionStats` to record
+        received packets in, or None
     """
     _buf = None
     eof = False
@@ -110,14 +140,14 @@ class VRTClient(Protocol):
     _inject_recording_state = None
     _at_vrt_boundary = True
 
-    def __init__(self, receive_callback):
+    def __init__(self, receive_callback, stats=None):
         self._receive_callback = receive_callback
+        self._stats = stats
         self._output_data = []
 
     def makeConnection(self, transport):
         Protocol.makeConnection(self, transport)
-        self._buf = StringIO()
-        self._buf_offset = 0
+        self._buf = ChunkBuffer()
         self._resetReader()
         self._processData()
 
@@ -159,7 +189,8 @@ class VRTClient(Protocol):
             self._output_file.write(data)
 
     def _resetReader(self):
-        self._packet_reader = vrt_packet_reader(self._setBytesRequired)
+        self._packet_reader = vrt_packet_reader(self._setBytesRequired,
+            self._stats)
         next(self._packet_reader)
 
     def _setBytesRequired(self, x):
@@ -176,7 +207,7 @@ class VRTClient(Protocol):
                 break
             self._at_vrt_boundary = False
             if self._output_file:
-                self._output_data.append(data)
+                self._output_data.append(data.tobytes())
 
             response = self._packet_reader.send(data)
             if response:
@@ -186,27 +217,14 @@ class VRTClient(Protocol):
                 self._resetReader()
 
     def _bufAppend(self, data):
-        if self._buf_offset:
-            self._buf.seek(self._buf_offset)
-            prefix = self._buf.read()
-            self._buf.seek(0)
-            self._buf.truncate()
-            self._buf.write(prefix)
-            self._buf_offset = 0
-        self._buf.seek(0, 2)
-        self._buf.write(data)
+        self._buf.append(data)
 
     def _bufConsume(self, num_bytes):
         "returns None if not enough bytes available"
-        if self._bufLength() < num_bytes:
-            return None
-        self._buf.seek(self._buf_offset)
-        self._buf_offset += num_bytes
-        return self._buf.read(num_bytes)
+        return self._buf.consume(num_bytes)
 
     def _bufLength(self):
-        self._buf.seek(0, 2)
-        return self._buf.tell() - self._buf_offset
+        return len(self._buf)
 
     def dataReceived(self, data):
         self._bufAppend(data)
@@ -216,14 +234,15 @@ class VRTClient(Protocol):
         self.eof = True
 
 class VRTClientFactory(Factory):
-    def __init__(self, receive_callback):
+    def __init__(self, receive_callback, stats=None):
         self._receive_callback = receive_callback
+        self._stats = stats
 
     def startedConnecting(self, connector):
         pass
 
     def buildProtocol(self, addr):
-        return VRTClient(self._receive_callback)
+        return VRTClient(self._receive_callback, self._stats)
 
     def clientConnectionLost(self, connector, reason):
         pass
@@ -233,18 +252,32 @@ class VRTClientFactory(Factory):
 
 
 class SCPIClient(Protocol, TimeoutMixin):
-    _pending = None
-    _in_block = False
-    _num_len = None
-    _block_len = None
-    _buf_scpi = None
+    """
+    A Twisted protocol for the SCPI connection.
+
+    Queries are written as soon as they are issued and responses,
+    including '#'-prefixed block responses, are matched to them in the
+    order the queries were sent.
+
+    :param timeout: seconds to wait for each response, when a response
+        takes longer every query waiting fails with an IOError and the
+        connection is dropped
+    :param bool pipelining: when False only one query is sent at a time
+        and other commands wait for its response
+    """
+    _buf_scpi = b''
+    _closed = False
 
-    def __init__(self, timeout):
+    def __init__(self, timeout, pipelining=True):
         self.timeout = timeout
+        self.pipelining = pipelining
+        # commands waiting to be sent: (cmd, Deferred or None for scpiset)
+        self._pending = deque()
+        # Deferreds of queries sent, waiting for their response
+        self._sent = deque()
 
     def connectionMade(self):
         self.transport.setTcpNoDelay(True)
-        self._buf_scpi = StringIO()
 
     def scpiset(self, cmd):
         if self._pending:
@@ -255,101 +288,102 @@ class SCPIClient(Protocol, TimeoutMixin):
             self.transport.write(cmd)
 
     def scpiget(self, cmd):
+        if self._closed:
+            return defer.fail(IOError("scpi connection closed"))
         d = defer.Deferred()
-        if self._pending:
-            # command pipelining not supported
+        if self._pending or (self._sent and not self.pipelining):
             self._pending.append((cmd, d))
         else:
-            self._pending = [('', d)]
-            self.setTimeout(self.timeout)
-            self.transport.write(cmd)
-            logger.debug('scpiget %r', cmd)
+            self._send_query(cmd, d)
         return d
 
-    def timeoutConnection(self):
-        if len(self._pending) > 0:
-            cmd, d = self._pending.pop(0)
+    def scpiget_many(self, cmds):
+        """
+        Send all the queries in *cmds* back to back and return a
+        Deferred that fires with the list of their responses.
+        """
+        d = defer.gatherResults([self.scpiget(cmd) for cmd in cmds],
+            consumeErrors=True)
+        # report the original failure, e.g. a timeout, not a FirstError
+        d.addErrback(lambda failure: failure.value.subFailure
+            if failure.check(defer.FirstError) else failure)
+        return d
+
+    def _send_query(self, cmd, d):
+        logger.debug('scpiget %r', cmd)
+        self._sent.append(d)
+        if len(self._sent) == 1:
+            self.setTimeout(self.timeout)
+        self.transport.write(cmd)
+
+    def _send_pending(self):
+        while self._pending:
+            if self._sent and not self.pipelining:
+                break
+            cmd, d = self._pending.popleft()
             if d:
-                self.setTimeout(None)
-                self._buf_scpi.seek(0, os.SEEK_SET)  # move to first position
-                self._buf_scpi.truncate()  # set buffer size of current position aka 0
-                self._block_len = None
-                self._num_len = None
-                self._in_block = False
-                d.errback(IOError("scpi timed out"))
-
-            while self._pending:
-                cmd, d = self._pending[0]
-                logger.debug('scpi(%s) %r', 'get' if d else 'set', cmd)
+                self._send_query(cmd, d)
+            else:
+                logger.debug('scpiset %r', cmd)
                 self.transport.write(cmd)
-                if d:
-                    self.setTimeout(self.timeout)
-                    break
-                self._pending.pop(0)
+
+    def timeoutConnection(self):
+        # a late response to the query that timed out can't be told apart
+        # from the responses to the queries sent after it, so fail every
+        # query waiting and drop the connection
+        self._closed = True
+        self._fail_queries("scpi timed out")
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        self._closed = True
+        self._fail_queries("scpi connection closed")
+
+    def _fail_queries(self, message):
+        self.setTimeout(None)
+        self._buf_scpi = b''
+        failed = list(self._sent)
+        failed.extend(d for cmd, d in self._pending if d)
+        self._sent.clear()
+        self._pending.clear()
+        for d in failed:
+            d.errback(IOError(message))
 
     def dataReceived(self, data):
-        datapos = 0
         self.resetTimeout()
         # The firmware sometimes sends an extra query unexpectedly TODO FIX THIS ISSUE IN FIRMWARE
-        if not len(self._pending) > 0:
+        if self._closed or not self._sent:
             return
 
-        # Peak into the packet
-        if data[0] == '#' and not self._in_block:
-            self._in_block = True
-            datapos += 1  # (1)
-
-        if self._in_block:
-            if self._num_len is None:
-                self._num_len = int(data[datapos])
-                datapos += 1  # (2)
-
-            if self._block_len is None:
-                self._block_len = int(data[datapos:datapos + self._num_len])
-                datapos += self._num_len  # (2+self.num_len)
-
-            self._buf_scpi.seek(0, os.SEEK_END)  # move to the last position
-            self._buf_scpi.write(data)
-
-            if self._buf_scpi.tell() < self._block_len + self._num_len + 2 + 1:
-                return
-            else:
-                self._buf_scpi.seek(2+self._num_len)
-                data = self._buf_scpi.read(self._block_len)
-                self._buf_scpi.seek(0, os.SEEK_SET)  # move to first position
-                self._buf_scpi.truncate()  # set buffer size of current position aka 0
-                self._block_len = None
-                self._num_len = None
-                self._in_block = False
-
-        if len(self._pending) > 0:
-            cmd, d = self._pending.pop(0)
+        self._buf_scpi += data
+        while self._sent:
+            found = split_scpi_response(self._buf_scpi)
+            if found is None:
+                break
+            response, used = found
+            self._buf_scpi = self._buf_scpi[used:]
+            d = self._sent.popleft()
             # Profile for timming this should help
             if logger.isEnabledFor(logging.DEBUG):
-                logger.debug('scpigot %r', data)
-            if d:
+                logger.debug('scpigot %r', response)
+            if not self._sent:
                 self.setTimeout(None)
-                d.callback(data)
+                self._buf_scpi = b''
+            d.callback(response)
 
-            while self._pending:
-                cmd, d = self._pending[0]
-                logger.debug('scpi(%s) %r', 'get' if d else 'set', cmd)
-                self.transport.write(cmd)
-                if d:
-                    self.setTimeout(self.timeout)
-                    break
-                self._pending.pop(0)
+        self._send_pending()
 
 
 class SCPIClientFactory(Factory):
-    def __init__(self, timeout):
+    def __init__(self, timeout, pipelining=True):
         self._timeout = timeout
+        self._pipelining = pipelining
 
     def startedConnecting(self, connector):
         pass
 
     def buildProtocol(self, addr):
-        return SCPIClient(self._timeout)
+        return SCPIClient(self._timeout, self._pipelining)
 
     def clientConnectionLost(self, connector, reason):
         pass
@@ -0,0 +1,123 @@
+import numpy as np
+
+#: trace detector modes of :class:`TraceDetector`
+AVERAGE = 'average'
+EXPONENTIAL = 'exponential'
+MAX_HOLD = 'max_hold'
+MIN_HOLD = 'min_hold'
+DETECTOR_MODES = (AVERAGE, EXPONENTIAL, MAX_HOLD, MIN_HOLD)
+
+
+class TraceDetectorError(Exception):
+    pass
+
+
+class TraceDetector(object):
+    """
+    Combine successive spectra of the same size into one trace, updated
+    in place as each spectrum is added.
+
+    ``'average'``
+        the average power of all the spectra added since the last
+        :meth:`reset`
+    ``'exponential'``
+        an average of the spectra added that weighs the last *count*
+        spectra most, like the video bandwidth filter of a swept
+        analyzer.  The first *count* spectra are averaged as with
+        ``'average'``, then each new spectrum contributes 1 / *count*
+        of the trace.
+    ``'max_hold'``
+        the highest level of each bin
+    ``'min_hold'``
+        the lowest level of each bin
+
+    Spectra are in dB (e.g. dBm), and they are averaged as powers, not
+    dB values, so the average of a noise floor is its actual power.
+    The trace and the working arrays are allocated when the first
+    spectrum is added and reused after that, so adding spectra doesn't
+    allocate memory.  They are allocated again when a spectrum of a
+    different size is added, which resets the trace.
+
+    :param str mode: one of the modes above
+    :param int count: the number of spectra averaged by the
+                      ``'exponential'`` mode
+    :param dtype: the numpy dtype of the trace, or None to use the dtype
+                  of the first spectrum added
+
+    .. attribute:: trace
+
+       the trace, a numpy array in dB, or None before a spectrum is
+       added.  It is updated in place by :meth:`add`, copy it to keep
+       its value.
+
+    .. attribute:: traces
+
+       the number of spectra added since the last :meth:`reset`
+    """
+
+    def __init__(self, mode=AVERAGE, count=10, dtype=None):
+        if mode not in DETECTOR_MODES:
+            raise TraceDetectorError("unknown detector mode %r" % (mode,))
+        if mode == EXPONENTIAL and count < 1:
+            raise TraceDetectorError("count must be at least 1")
+        self.mode = mode
+        self.count = count
+        self.dtype = dtype
+        self.trace = None
+        self._power = None
+        self._scratch = None
+        self.traces = 0
+
+    def reset(self):
+        """
+        Start a new trace with the next spectrum added
+        """
+        self.traces = 0
+
+    def add(self, pow_data):
+        """
+        Add a spectrum to the trace
+
+        :param pow_data: the spectrum in dB, a numpy array
+        :returns: :attr:`trace`
+        """
+        if self.trace is None or len(self.trace) != len(pow_data):
+            dtype = self.dtype or pow_data.dtype
+            self.trace = np.empty(len(pow_data), dtype=dtype)
+            if self.mode in (AVERAGE, EXPONENTIAL):
+                self._power = np.empty_like(self.trace)
+                self._scratch = np.empty_like(self.trace)
+            self.traces = 0
+        self.traces += 1
+
+        if self.mode == MAX_HOLD:
+            if self.traces == 1:
+                self.trace[:] = pow_data
+            else:
+                np.maximum(self.trace, pow_data, out=self.trace)
+            return self.trace
+        if self.mode == MIN_HOLD:
+            if self.traces == 1:
+                self.trace[:] = pow_data
+            else:
+                np.minimum(self.trace, pow_data, out=self.trace)
+            return self.trace
+
+        # convert to linear power
+        power = self._scratch
+        np.multiply(pow_data, 0.1, out=power)
+        np.power(10, power, out=power)
+        if self.traces == 1:
+            self._power[:] = power
+        else:
+            n = self.traces
+            if self.mode == EXPONENTIAL:
+                n = min(n, self.count)
+            # average += (power - average) / n
+            np.subtract(power, self._power, out=power)
+            power *= 1.0 / n
+            self._power += power
+
+        np.log10(self._power, out=self.trace)
+        self.trace *= 10
+        return self.trace
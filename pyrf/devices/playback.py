@@ -1,14 +1,257 @@
+import mmap
+import time
+from contextlib import contextmanager
+
 from pyrf.devices.thinkrf_properties import wsa_properties
+from pyrf.vrt import vrt_packet_index, VRTCUSTOMCONTEXT, VRTDATA, VRTSPECA
+from pyrf.stats import ConnectionStats
+
+
+class PlaybackError(Exception):
+    pass
+
+
+class PlaybackConnector(object):
+    """
+    The connector of a :class:`Playback` device.  It never connects to
+    anything, packets come from the recording instead.
+    """
+
+    def __init__(self):
+        self.stats = ConnectionStats()
+
+    def sync_async(self, gen):
+        """
+        Handler for the @sync_async decorator, see
+        :meth:`pyrf.connectors.blocking.PlainSocketConnector.sync_async`
+        """
+        val = None
+        try:
+            while True:
+                val = gen.send(val)
+        except StopIteration:
+            return val
+
 
 class Playback(object):
-    def __init__(self, device_class, device_identifier):
+    """
+    Device that replays a VRT recording made with
+    :meth:`pyrf.devices.thinkrf.WSA.set_recording_output`, so that
+    archived captures can be processed by
+    :class:`pyrf.sweep_device.SweepDevice`,
+    :class:`pyrf.capture_device.CaptureDevice` and other virtual devices
+    as if they came from the RTSA.
+
+    The recording is memory-mapped and indexed with
+    :func:`pyrf.vrt.vrt_packet_index` when it is opened, and the data
+    packets returned by :meth:`read` reference their samples in the
+    mapping without copying them.  Commands that would configure the
+    RTSA are ignored: the recording is replayed as it was captured, so
+    it must be processed with the settings it was captured with.
+
+    SPECA state packets written with
+    :meth:`pyrf.devices.thinkrf.WSA.inject_recording_state` are not
+    returned by :meth:`read`, the latest state read is kept in
+    :attr:`state` instead.
+
+    :param str device_class: the class of device that made the recording,
+                             only 'thinkrf.WSA' is supported.  Taken from
+                             the recording's first state when None.
+    :param str device_identifier: the ``*IDN?`` response of the device,
+                                  used for its properties.  Taken from the
+                                  recording's first state when None.
+    :param str filename: the recording to replay, or None for a device
+                         that only provides properties
+    :param bool realtime: pace data packets by their timestamps instead of
+                          returning them as fast as they are read
+
+    .. attribute:: state
+
+       the last SPECA state dict read from the recording, or None
+    """
+
+    def __init__(self, device_class=None, device_identifier=None,
+            filename=None, realtime=False):
+        self.connector = PlaybackConnector()
+        self.realtime = realtime
+        self.state = None
+        self._file = None
+        self._index = None
+        self._position = 0
+        self._sweep_id = None
+        self._clock = None
+
+        if filename is not None:
+            self.open(filename)
+            state = self.first_state() or {}
+            device_class = device_class or state.get('device_class')
+            device_identifier = (device_identifier
+                or state.get('device_identifier'))
+        if device_identifier is None:
+            raise PlaybackError("device identifier required")
+
         # XXX this is all we support for now
         assert device_class == 'thinkrf.WSA'
         self.properties = wsa_properties(device_identifier)
         self.device_id = device_identifier
 
+    def open(self, filename):
+        """
+        Map and index the recording *filename* and rewind to its first
+        packet.  A partial packet at the end of the file is ignored.
+        """
+        self.close()
+        self._file = open(filename, 'rb')
+        try:
+            buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            buf = b''
+        self._index = vrt_packet_index(buf)
+        self.rewind()
+
+    def close(self):
+        """
+        Close the recording.  The mapping is released once no packets
+        read from it are left.
+        """
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._index = None
+
+    disconnect = close
+
+    def rewind(self):
+        """
+        Replay the recording from its first packet.
+        """
+        self._position = 0
+        self._clock = None
+        self.state = None
+
+    def first_state(self):
+        """
+        Return the first SPECA state dict in the recording, or None
+        """
+        for n in self._speca_packets():
+            return self._index[n].fields.get('speca')
+
+    def _speca_packets(self):
+        packets = self._index.packets
+        return ((packets['ptype'] == VRTCUSTOMCONTEXT)
+            & (packets['stream_id'] == VRTSPECA)).nonzero()[0]
+
+    def __len__(self):
+        return len(self._index) if self._index is not None else 0
+
+    def eof(self):
+        """
+        Return True when every packet of the recording has been read
+        """
+        return self._position >= len(self)
+
+    def read(self):
+        """
+        Return the next packet of the recording.
+
+        Context packets with a sweep id carry the id passed to the last
+        :meth:`sweep_start` call, so a recorded sweep is received as the
+        sweep just started.
+
+        :raises PlaybackError: at the end of the recording
+        """
+        while True:
+            if self.eof():
+                raise PlaybackError("end of recording")
+            record = self._index.packets[self._position]
+            packet = self._index[self._position]
+            self._position += 1
+
+            if packet.is_context_packet():
+                if packet.stream_id == VRTSPECA:
+                    self.state = packet.fields.get('speca')
+                    continue
+                if 'sweepid' in packet.fields and self._sweep_id is not None:
+                    packet.fields['sweepid'] = self._sweep_id
+                    packet.fields['startid'] = "0x%08x" % self._sweep_id
+            elif self.realtime:
+                self._wait(packet.tsi + packet.tsf * 1e-12)
+
+            self.connector.stats.record_packet(packet, int(record['size']) * 4)
+            return packet
+
+    def _wait(self, timestamp):
+        now = time.time()
+        if self._clock is None:
+            self._clock = now - timestamp
+        delay = self._clock + timestamp - now
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def stats(self):
+        """
+        The :class:`pyrf.stats.ConnectionStats` of the packets read
+        """
+        return self.connector.stats
+
     def async_connector(self):
         return False
 
-    def disconnect(self):
+    def set_async_callback(self, callback):
+        if callback is not None:
+            raise PlaybackError("playback only supports blocking reads")
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+    def request_read_perm(self):
+        pass
+
+    def have_read_perm(self):
+        return True
+
+    def sweep_start(self, start_id=None):
+        self._sweep_id = start_id
+
+    def sweep_stop(self):
+        self._sweep_id = None
+
+    def sweep_clear(self):
+        pass
+
+    def sweep_add(self, entry):
+        pass
+
+    def sweep_iterations(self, count=None):
+        pass
+
+    def sweep_list_generation(self):
+        return 0
+
+    def correction_size(self, data_type=None):
+        # recordings don't include correction vectors
+        return 0
+
+    def apply_device_settings(self, settings, force_change=False):
+        pass
+
+    def capture(self, spp, ppb):
+        pass
+
+    def stream_start(self, stream_id=None):
+        pass
+
+    def stream_stop(self):
+        pass
+
+    def abort(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def reset(self):
         pass
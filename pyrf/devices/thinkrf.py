@@ -5,6 +5,7 @@ from pyrf.vrt import vrt_packet_reader
 from pyrf.devices.thinkrf_properties import wsa_properties
 from pyrf.util import capture_spectrum, read_data_and_context
 from pyrf.numpy_util import compute_fft
+from contextlib import contextmanager
 import struct
 import socket
 import select
@@ -34,16 +35,24 @@ class WSA(object):
        or if you passed a
        :class:`TwistedConnector <pyrf.connectors.twisted_async.TwistedConnector>`
        instance to the constructor, they will immediately return a
-       Twisted Deferred object.
+       Twisted Deferred object.  With an
+       :class:`AsyncioConnector <pyrf.connectors.asyncio_async.AsyncioConnector>`
+       they return an asyncio Future that may be awaited.
     """
 
     properties = None
+    _batch_depth = 0
+
+    #: incremented every time the sweep list or its iteration count may
+    #: have changed, see :meth:`sweep_list_generation`
+    _sweep_list_generation = 0
 
     def __init__(self, connector=None):
         if not connector:
             connector = PlainSocketConnector()
         self.connector = connector
         self._output_file = None
+        self._batch = []
 
     def async_connector(self):
         """
@@ -51,6 +60,15 @@ class WSA(object):
         """
         return hasattr(self.connector, 'vrt_callback')
 
+    @property
+    def stats(self):
+        """
+        The :class:`pyrf.stats.ConnectionStats` of the connector, counting
+        the packets received and lost and the time spent decoding them and
+        computing FFTs, or None if the connector doesn't keep statistics
+        """
+        return getattr(self.connector, 'stats', None)
+
     def set_async_callback(self, callback):
         """
         Set the asynchronous callback for a function when the device receives a VRT packet.
@@ -91,6 +109,7 @@ class WSA(object):
 
         self.fw_version = self.device_id.split(',')[-1]
         self.device_state = {}
+        self._sweep_list_generation += 1
 
     def disconnect(self):
         """
@@ -110,6 +129,9 @@ class WSA(object):
         :param cmd: the command to send
         :type cmd: str
         """
+        if self._batch_depth:
+            self._batch.append(cmd)
+            return
         self.connector.scpiset(cmd)
 
     def scpiget(self, cmd):
@@ -122,8 +144,65 @@ class WSA(object):
         :param str cmd: the SCPI command to send
         :return: the response output from the box if any
         """
+        self.flush_batch()
         return self.connector.scpiget(cmd)
 
+    def scpiget_many(self, cmds):
+        """
+        Send a list of SCPI *query* commands without waiting for each
+        response in turn, then collect all of the responses.
+
+        This saves a network round trip per query when many values
+        are needed at once.
+
+        :param list cmds: the SCPI commands to send
+        :return: a list of responses in the same order as *cmds*
+        """
+        self.flush_batch()
+        return self.connector.scpiget_many(cmds)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that holds back :meth:`scpiset` commands and
+        sends them together in a single write when the block exits,
+        instead of one network packet per command::
+
+            with dut.batch():
+                dut.sweep_clear()
+                dut.sweep_add(entry)
+
+        Queries and VRT reads made inside the block first flush the
+        commands held so far, so commands still reach the RTSA in the
+        order they were issued.  Nested blocks are sent when the
+        outermost block exits.
+
+        When a block exits with an exception the commands held are
+        discarded instead of sent, so a half-programmed sweep list isn't
+        sent to the RTSA.  Commands already flushed by a query have
+        been sent.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            self._batch = []
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self.flush_batch()
+
+    def flush_batch(self):
+        """
+        Send any :meth:`scpiset` commands held back by :meth:`batch`.
+        """
+        if self._batch:
+            cmds = self._batch
+            self._batch = []
+            # connectors terminate the command with a newline
+            self.connector.scpiset("\n".join(cmds))
+
     @sync_async
     def id(self):
         """
@@ -140,7 +219,7 @@ class WSA(object):
 
         :param int n: determine the number of peaks to return
         :param int rbw: rbw of spectral capture (Hz) (will round to nearest native RBW) or None
-        :param int average: number of capture iterations
+        :param int average: number of captures, their power is averaged
         :returns: [(peak_freq1, peak_power1),
                    (peak_freq2, peak_power2)
                    , ...,
@@ -166,7 +245,7 @@ class WSA(object):
         Returns a power level that represents the top edge of the noisefloor
 
         :param int rbw: rbw of spectral capture (Hz) (will round to nearest native RBW) or None
-        :param int average: number of capture iterations
+        :param int average: number of captures, their power is averaged
         :return: noise_power
         """
         iq_path = self.iq_output_path()
@@ -254,6 +333,41 @@ class WSA(object):
         data = buf
         yield data
 
+    @sync_async
+    def correction_data_many(self, data_type=None, size=0, transfer_size=16*1024):
+        """
+        Read *size* bytes of correction data with all of the chunk
+        queries sent at once using :meth:`scpiget_many`.
+
+        The data returned stops early if the RTSA returns less than
+        was requested for any chunk.
+
+        :param str data_type: 'NOISE' or 'SIGNAL'
+        :param int size: number of bytes to read, see :meth:`correction_size`
+        :param int transfer_size: maximum number of bytes per query
+        :returns: the correction data read
+        """
+        data_type = data_type.upper()
+        assert data_type in ('NOISE', 'SIGNAL')
+        lengths = []
+        cmds = []
+        for offset in range(0, size, transfer_size):
+            length = min(transfer_size, size - offset)
+            lengths.append(length)
+            cmds.append(":DATA:CORRECTION:%s:READ? %d,%d"
+                % (data_type, offset, length))
+        if not cmds:
+            yield b""
+            return
+
+        bufs = yield self.scpiget_many(cmds)
+        chunks = []
+        for buf, length in zip(bufs, lengths):
+            chunks.append(buf[:length])
+            if len(buf) < length:
+                break
+        yield b"".join(chunks)
+
     @sync_async
     def correction_size(self, data_type=None):
         """
@@ -412,6 +526,7 @@ class WSA(object):
         the registers or queues associated with the IEEE mandated commands.
         """
         self.scpiset(":*rst")
+        self._sweep_list_generation += 1
 
     def abort(self):
         """
@@ -594,7 +709,9 @@ class WSA(object):
         """
         Read and return a single **parsed** VRT packet from the RTSA, either context or data.
         """
-        return vrt_packet_reader(self.connector.raw_read)
+        self.flush_batch()
+        return vrt_packet_reader(self.connector.raw_read,
+            getattr(self.connector, 'stats', None))
 
     def raw_read(self, num):
         """
@@ -603,6 +720,7 @@ class WSA(object):
         :param int num: the number of bytes to read
         :returns: bytes
         """
+        self.flush_batch()
         return self.connector.raw_read(num)
 
     def sweep_add(self, entry):
@@ -613,6 +731,8 @@ class WSA(object):
         :type entry: pyrf.sweepDevice.sweepSettings
         """
 
+        self._sweep_list_generation += 1
+
         # create a new entry
         self.scpiset(":sweep:entry:new")
 
@@ -694,14 +814,28 @@ class WSA(object):
             number = yield self.scpiget(":sweep:list:iterations?")
             yield int(number)
         else:
+            self._sweep_list_generation += 1
             self.scpiset(":sweep:list:iterations %d" % (count,))
 
     def sweep_clear(self):
         """
         Remove all entries from the sweep list.
         """
+        self._sweep_list_generation += 1
         self.scpiset(":sweep:entry:delete all")
 
+    def sweep_list_generation(self):
+        """
+        Return a number that changes whenever :meth:`sweep_clear`,
+        :meth:`sweep_add`, :meth:`sweep_iterations`, :meth:`reset` or
+        :meth:`connect` may have changed the RTSA's sweep list.  If the
+        number is the same as when a sweep list was programmed, that sweep
+        list is still on the RTSA and may be started again without being
+        reprogrammed.  Sweep list commands sent directly with
+        :meth:`scpiset` are not tracked.
+        """
+        return self._sweep_list_generation
+
 
     def sweep_start(self, start_id = None):
         """
@@ -851,7 +985,7 @@ class WSA(object):
             'trigger': self.trigger,
             }
 
-        for k, v in settings.iteritems():
+        for k, v in settings.items():
             if force_change:
                 self.device_state[k] = v
                 device_setting[k](v)
@@ -945,10 +1079,10 @@ def cli_chooser():
         index = 1
         for wsa in wsalist:
             modelstring = "%s v%s" % (wsa["MODEL"], wsa["FIRMWARE"])
-            print fmt % (index, wsa["HOST"], modelstring, wsa["SERIAL"])
+            print(fmt % (index, wsa["HOST"], modelstring, wsa["SERIAL"]))
             index += 1
-        print "r) Refresh"
-        print "q) Abort"
+        print("r) Refresh")
+        print("q) Abort")
 
         # get user input
         choice = raw_input("> ")
@@ -964,7 +1098,7 @@ def cli_chooser():
             return wsalist[index]["HOST"]
 
         else:
-            print "error: invalid selection: '%s'" % choice
+            print("error: invalid selection: '%s'" % choice)
 
 
 # for backwards compatibility
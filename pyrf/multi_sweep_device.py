@@ -0,0 +1,214 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from pyrf.sweep_device import (SweepDevice, SweepDeviceError,
+    copy_bin_slices)
+
+#: the part of a sweep captured by one device: its index in the
+#: *real_devices* passed to :class:`MultiSweepDevice`, the actual start
+#: and stop frequencies of its spectrum, and the device timestamps in
+#: seconds of its first and last packets
+SweepPart = namedtuple('SweepPart', 'device fstart fstop start_time stop_time')
+
+
+def partition_sweep(dev_properties, fstart, fstop, mode, min_span=0):
+    """
+    Split the *fstart* to *fstop* range between devices, balancing the
+    span each one sweeps within the limits of each device.  Devices that
+    can't tune as high as the others sweep the lower parts of the range.
+
+    :param dev_properties: a list of the device properties of each device
+    :param float fstart: sweep starting frequency in Hz
+    :param float fstop: sweep ending frequency in Hz
+    :param str mode: sweep mode, 'ZIF', 'SH', or 'SHN'
+    :param float min_span: the smallest span given to a device, fewer
+                           devices are used for narrow ranges
+
+    :returns: a list of (device index, fstart, fstop) ordered by frequency
+    :raises SweepDeviceError: if *fstop* is beyond every device's
+                              MAX_TUNABLE frequency for *mode*
+    """
+    order = sorted(range(len(dev_properties)),
+        key=lambda i: dev_properties[i].MAX_TUNABLE[mode])
+    if min_span > 0:
+        count = int(math.ceil(float(fstop - fstart) / min_span))
+        # keep the devices that can tune the highest
+        order = order[max(len(order) - count, 0):]
+
+    parts = []
+    start = fstart
+    for n, i in enumerate(order):
+        if start >= fstop:
+            break
+        span = float(fstop - start) / (len(order) - n)
+        stop = min(start + span, dev_properties[i].MAX_TUNABLE[mode], fstop)
+        if stop <= start:
+            continue
+        parts.append((i, start, stop))
+        start = stop
+
+    if start < fstop:
+        raise SweepDeviceError(
+            "no device can sweep %s mode up to %d Hz" % (mode, fstop))
+    return parts
+
+
+class MultiSweepDevice(object):
+    """
+    Virtual device that generates a power spectrum from a frequency
+    range by splitting it between several RF devices, sweeping each
+    part with a :class:`pyrf.sweep_device.SweepDevice` and piecing the
+    parts together.  The range is split with :func:`partition_sweep`
+    using each device's properties.
+
+    With async connectors all of the devices sweep at the same time.
+    With blocking connectors each device's sweep is started and read in
+    turn.  When a part of a sweep fails the parts still running are
+    stopped, so the error doesn't prevent or spoil the next sweep.
+
+    :param real_devices: the RF devices that will be used for capturing
+                         data, typically :class:`pyrf.devices.thinkrf.WSA`
+                         instances all using async or all using blocking
+                         connectors
+    :param async_callback: a callback to use for async operation, called
+                           with fstart, fstop, power_data and a list of
+                           :class:`SweepPart`
+    :param str precision: 'double' or 'single' floating point precision,
+                          see :class:`pyrf.sweep_device.SweepDevice`
+    :param str correction_cache: a directory in which to keep the
+                                 correction vectors of each device, see
+                                 :class:`pyrf.sweep_device.SweepDevice`
+
+    Each part is swept at the same RBW and placed in the result bin for
+    bin, so the devices should be models with the same bandwidths.
+    """
+
+    def __init__(self, real_devices, async_callback=None,
+            precision='double', correction_cache=None):
+        if not real_devices:
+            raise SweepDeviceError("at least one device is required")
+
+        self.real_devices = list(real_devices)
+        self.async_callback = async_callback
+        self.sweep_devices = []
+        for i, dev in enumerate(self.real_devices):
+            if dev.async_connector() != self.real_devices[0].async_connector():
+                raise SweepDeviceError(
+                    "devices must all use async or all use blocking connectors")
+            callback = None
+            if async_callback:
+                callback = (lambda fstart, fstop, data, i=i:
+                    self._part_received(i, fstart, fstop, data))
+            self.sweep_devices.append(SweepDevice(dev, callback, precision,
+                correction_cache))
+        # the packet callbacks of each device, catching errors in its part
+        self._receive_callbacks = [
+            (lambda packet, i=i: self._part_receive(i, packet))
+            for i in range(len(self.real_devices))]
+
+        self._parts = None
+
+    def capture_power_spectrum(self, fstart, fstop, rbw, device_settings=None,
+            mode='SH'):
+        """
+        Sweep *fstart* to *fstop* once with all of the devices, and
+        return the power spectral density data along with the **actual**
+        sweep start and stop frequencies, like
+        :meth:`pyrf.sweep_device.SweepDevice.capture_power_spectrum`.
+
+        :param int fstart: sweep starting frequency in Hz
+        :param int fstop: sweep ending frequency in Hz
+        :param float rbw: the resolution bandwidth (RBW) in Hz of the data to be captured (output RBW may be smaller than requested)
+        :param device_settings: attenuation and other device settings
+        :type device_settings: dict
+        :param str mode: sweep mode, 'ZIF', 'SH', or 'SHN'
+
+        :returns: fstart, fstop, power_data, parts where parts is a list
+                  of :class:`SweepPart` ordered by frequency, or None
+                  with an async connector
+        """
+        if self._parts is not None:
+            raise SweepDeviceError(
+                "previous sweep must have finished before starting a new one")
+
+        # split the range on whole bins of the RBW the devices will use
+        first = self.sweep_devices[0]
+        self._rbw = first._sweep_planner.plan_sweep(fstart, fstop, rbw, mode,
+            device_settings or {}).rbw
+        props = [dev.properties for dev in self.real_devices]
+        usable_bw = min(p.USABLE_BW[mode] for p in props)
+        partition = []
+        for i, start, stop in partition_sweep(props, fstart, fstop, mode,
+                usable_bw):
+            if start != fstart:
+                start = fstart + round((start - fstart) / self._rbw) * self._rbw
+            if stop != fstop:
+                stop = fstart + round((stop - fstart) / self._rbw) * self._rbw
+            partition.append((i, start, stop))
+
+        self._parts = dict((i, None) for i, start, stop in partition)
+        self._order = [i for i, start, stop in partition]
+        try:
+            for i, start, stop in partition:
+                result = self.sweep_devices[i].capture_power_spectrum(start,
+                    stop, rbw, device_settings, mode)
+                if self.async_callback:
+                    self.real_devices[i].set_async_callback(
+                        self._receive_callbacks[i])
+                else:
+                    self._part_received(i, *result)
+        except Exception:
+            self._abort()
+            raise
+        if not self.async_callback:
+            return self._emit_data()
+
+    def _part_receive(self, i, packet):
+        try:
+            self.sweep_devices[i]._vrt_receive(packet)
+        except Exception:
+            self._abort()
+            raise
+
+    def _abort(self):
+        """
+        Forget the sweep in progress after one of its parts failed,
+        stopping the parts still running so their packets are ignored
+        and the next sweep can start
+        """
+        if self._parts is None:
+            return
+        parts, self._parts = self._parts, None
+        for i in parts:
+            self.sweep_devices[i].stop()
+
+    def _part_received(self, i, fstart, fstop, data):
+        self._parts[i] = (fstart, fstop, data)
+        if self.async_callback and all(
+                part is not None for part in self._parts.values()):
+            self._emit_data()
+
+    def _emit_data(self):
+        parts = [self._parts[i] + self.sweep_devices[i].sweep_time
+            for i in self._order]
+        self._parts = None
+
+        # piece the parts together
+        fstart = parts[0][0]
+        fstop = parts[-1][1]
+        spectral_data = np.zeros(int(round((fstop - fstart) / self._rbw)),
+            dtype=parts[0][2].dtype)
+        for start, stop, data, start_time, stop_time in parts:
+            src, dst = copy_bin_slices(start, stop, len(data), fstart, fstop,
+                len(spectral_data))
+            spectral_data[dst] = data[src]
+
+        sweep_parts = [SweepPart(i, start, stop, start_time, stop_time)
+            for i, (start, stop, data, start_time, stop_time)
+            in zip(self._order, parts)]
+        if self.async_callback:
+            self.async_callback(fstart, fstop, spectral_data, sweep_parts)
+            return
+        return fstart, fstop, spectral_data, sweep_parts
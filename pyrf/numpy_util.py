@@ -1,10 +1,106 @@
 import numpy as np
 import random
+from collections import OrderedDict
+from timeit import default_timer
 pi = np.pi
 
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+    import pyfftw.interfaces.numpy_fft as pyfftw_fft
+except ImportError:
+    pyfftw = pyfftw_fft = None
+
 from pyrf.vrt import (I_ONLY, VRT_IFDATA_I14Q14, VRT_IFDATA_I14,
                       VRT_IFDATA_I24, VRT_IFDATA_PSD8)
 
+#: maximum number of windows kept by :func:`get_window`
+WINDOW_CACHE_SIZE = 32
+_window_cache = OrderedDict()
+
+#: sample dtype used for each *precision* of :func:`compute_fft`
+PRECISION_DTYPES = {
+    'double': np.float64,
+    'single': np.float32,
+    }
+
+FFT_BACKENDS = ('numpy', 'scipy', 'pyfftw')
+_fft_backend = 'numpy'
+_fft = np.fft.fft
+_ifft = np.fft.ifft
+_rfft = np.fft.rfft
+
+def get_window(length, dtype=float):
+    """
+    Return a Hanning window of *length* points, reusing the windows of
+    recently used lengths instead of computing a new one each time.
+
+    :param int length: number of points in the window
+    :param dtype: numpy dtype of the window
+    :returns: a read-only numpy array
+    """
+    key = (length, np.dtype(dtype))
+    try:
+        window = _window_cache.pop(key)
+    except KeyError:
+        window = np.hanning(length).astype(dtype)
+        window.flags.writeable = False
+        if len(_window_cache) >= WINDOW_CACHE_SIZE:
+            _window_cache.popitem(last=False)
+    _window_cache[key] = window
+    return window
+
+def set_fft_backend(backend='numpy'):
+    """
+    Select the library used to compute FFTs.
+
+    'scipy' uses scipy.fft and 'pyfftw' uses pyFFTW with its plans
+    cached per array size, both must be installed to be selected.
+
+    :param str backend: one of 'numpy', 'scipy' or 'pyfftw'
+    :raises ValueError: if *backend* is unknown or not installed
+    """
+    global _fft_backend, _fft, _ifft, _rfft
+
+    if backend == 'numpy':
+        module = np.fft
+    elif backend == 'scipy' and scipy_fft is not None:
+        module = scipy_fft
+    elif backend == 'pyfftw' and pyfftw is not None:
+        # keep FFTW plans around between calls of the same size
+        pyfftw.interfaces.cache.enable()
+        module = pyfftw_fft
+    elif backend in FFT_BACKENDS:
+        raise ValueError("FFT backend %r is not installed" % backend)
+    else:
+        raise ValueError("unknown FFT backend %r" % backend)
+
+    _fft_backend = backend
+    _fft = module.fft
+    _ifft = module.ifft
+    _rfft = module.rfft
+
+def _precision_dtype(precision):
+    try:
+        return PRECISION_DTYPES[precision]
+    except KeyError:
+        raise ValueError("unknown precision %r" % (precision,))
+
+def _complex_dtype(dtype):
+    # complex64 for float32 data, complex128 for float64
+    return np.result_type(dtype, np.complex64)
+
+def get_fft_backend():
+    """
+    Return the name of the FFT backend selected with
+    :func:`set_fft_backend`.
+    """
+    return _fft_backend
+
 def calculate_channel_power(power_spectrum):
     """
     Return a dBm value representing the channel power of the input
@@ -24,36 +120,40 @@ def calculate_channel_power(power_spectrum):
 
     return channel_power
 
-def _decode_data_pkts(data_pkt):
+def _decode_data_pkts(data_pkt, dtype=float):
     stream_id = data_pkt.stream_id
     spec_inv = data_pkt.spec_inv
     i_data = None
     q_data = None
 
     if stream_id == VRT_IFDATA_I14Q14:
-        i_data = np.array(data_pkt.data.numpy_array()[:, 0], dtype=float) / 2 ** 13
-        q_data = np.array(data_pkt.data.numpy_array()[:, 1], dtype=float) / 2 ** 13
+        i_data = np.array(data_pkt.data.numpy_array()[:, 0], dtype=dtype) / 2 ** 13
+        q_data = np.array(data_pkt.data.numpy_array()[:, 1], dtype=dtype) / 2 ** 13
 
     if stream_id == VRT_IFDATA_I14:
-        i_data = (np.array(data_pkt.data.numpy_array(), dtype=float) / 2 ** 13)
+        i_data = (np.array(data_pkt.data.numpy_array(), dtype=dtype) / 2 ** 13)
 
     if stream_id == VRT_IFDATA_I24:
-        i_data = np.array(data_pkt.data.numpy_array(), dtype=float) / 2 ** 23
+        i_data = np.array(data_pkt.data.numpy_array(), dtype=dtype) / 2 ** 23
 
     return i_data, q_data, stream_id, spec_inv
 
 def _compute_fft_i_only(i_data, convert_to_dbm, apply_window):
+    # i_data may be a 2-D array of packets, transform the last axis
+    Nsamp = i_data.shape[-1]
     if apply_window:
-        i_data = i_data * np.hanning(len(i_data))
+        i_data = i_data * get_window(Nsamp, i_data.dtype)
 
-    power_spectrum = np.abs(np.fft.rfft(i_data))/len(i_data)
+    spectrum = _rfft(i_data).astype(_complex_dtype(i_data.dtype), copy=False)
+    power_spectrum = np.abs(spectrum)/Nsamp
     if convert_to_dbm:
         power_spectrum = 20 * np.log10(power_spectrum)
     return power_spectrum
 
 def compute_fft(dut, data_pkt, context, correct_phase=True, iq_correction_wideband=True,
         hide_differential_dc_offset=True, convert_to_dbm=True, apply_window=True,
-        apply_spec_inv=True, apply_reference=True, ref=None, decimation=1):
+        apply_spec_inv=True, apply_reference=True, ref=None, decimation=1,
+        precision='double'):
     """
     Return an array of dBm values by computing the FFT of
     the passed data and reference level.
@@ -75,11 +175,17 @@ def compute_fft(dut, data_pkt, context, correct_phase=True, iq_correction_wideba
     :param bool apply_reference: apply reference level correction or not
     :param float ref: a reference value to apply to the noise level
     :param int decimation: the decimation value (1, 4 - 1024)
+    :param str precision: 'double' to compute with float64/complex128
+                          values or 'single' to keep all the steps in
+                          float32/complex64, which is faster and precise
+                          enough for most spectrum measurements
 
     :returns: numpy array of spectral data in dBm, as floats
     """
+    start = default_timer()
 
-    i_data, q_data, stream_id, spec_inv = _decode_data_pkts(data_pkt)
+    i_data, q_data, stream_id, spec_inv = _decode_data_pkts(data_pkt,
+        _precision_dtype(precision))
     if not 'bandwidth' in context:
         context['bandwidth'] = 1e9
     if 'reflevel' in context:
@@ -113,60 +219,174 @@ def compute_fft(dut, data_pkt, context, correct_phase=True, iq_correction_wideba
 
     if apply_reference:
         noiselevel_offset = reference_level + prop.REFLEVEL_ERROR
-        return power_spectrum + noiselevel_offset
+        power_spectrum = power_spectrum + noiselevel_offset
+    _record_fft_time(dut, start)
     return power_spectrum
 
+def compute_fft_batch(dut, data_pkts, context, correct_phase=True,
+        iq_correction_wideband=True, hide_differential_dc_offset=True,
+        convert_to_dbm=True, apply_window=True, apply_spec_inv=True,
+        apply_reference=True, ref=None, decimation=1, precision='double'):
+    """
+    Return a 2-D array of dBm values, one row per packet, by computing
+    the FFTs of several data packets together.
+
+    The packets are stacked into one array so the decoding, windowing,
+    FFT and dB conversion are done for all of them at once.  The results are the same as
+    calling :func:`compute_fft` on each packet in turn.
+
+    :param dut: WSA device
+    :type dut: pyrf.devices.thinkrf.WSA
+    :param list data_pkts: :class:`pyrf.vrt.DataPacket` objects with the
+                           same stream id and number of samples, captured
+                           with the same *context*
+
+    The remaining parameters are the same as for :func:`compute_fft`.
+
+    :returns: numpy array of spectral data in dBm with shape
+              (len(data_pkts), bins)
+    :raises ValueError: if the packets differ in stream id or size
+    """
+    fft_args = dict(correct_phase=correct_phase,
+        iq_correction_wideband=iq_correction_wideband,
+        hide_differential_dc_offset=hide_differential_dc_offset,
+        convert_to_dbm=convert_to_dbm, apply_window=apply_window,
+        apply_spec_inv=apply_spec_inv, apply_reference=apply_reference,
+        ref=ref, decimation=decimation, precision=precision)
+
+    stream_id = data_pkts[0].stream_id
+    size = len(data_pkts[0].data)
+    if any(pkt.stream_id != stream_id or len(pkt.data) != size
+            for pkt in data_pkts):
+        raise ValueError("packets must have the same stream id and size")
+    if stream_id not in (VRT_IFDATA_I14Q14, VRT_IFDATA_I14, VRT_IFDATA_I24):
+        # nothing to stack, compute packets one at a time
+        return np.array([compute_fft(dut, pkt, context, **fft_args)
+            for pkt in data_pkts])
+
+    start = default_timer()
+    if not 'bandwidth' in context:
+        context['bandwidth'] = 1e9
+    if 'reflevel' in context:
+        reference_level = context['reflevel']
+    else:
+        reference_level = ref
+    prop = dut.properties
+
+    dtype = _precision_dtype(precision)
+    samples = np.array([pkt.data.numpy_array() for pkt in data_pkts])
+    if stream_id == VRT_IFDATA_I14Q14:
+        i_data = np.array(samples[:, :, 0], dtype=dtype) / 2 ** 13
+        q_data = np.array(samples[:, :, 1], dtype=dtype) / 2 ** 13
+        if 'iqswap' in context:
+            iq_swap = context['iqswap']
+        else:
+            iq_swap = 0
+        power_spectrum = _compute_fft(i_data, q_data, correct_phase, iq_correction_wideband,
+            hide_differential_dc_offset, convert_to_dbm, apply_window, decimation, iq_swap, context['bandwidth'])
+    else:
+        if stream_id == VRT_IFDATA_I14:
+            i_data = np.array(samples, dtype=dtype) / 2 ** 13
+        else:
+            i_data = np.array(samples, dtype=dtype) / 2 ** 23
+        power_spectrum = _compute_fft_i_only(i_data, convert_to_dbm, apply_window)
+
+    if apply_spec_inv:
+        spec_inv = np.array([bool(pkt.spec_inv) for pkt in data_pkts])
+        if spec_inv.any():  # handle inverted spectrum
+            power_spectrum[spec_inv] = power_spectrum[spec_inv, ::-1]
+
+    if apply_reference:
+        noiselevel_offset = reference_level + prop.REFLEVEL_ERROR
+        power_spectrum = power_spectrum + noiselevel_offset
+    _record_fft_time(dut, start, len(data_pkts))
+    return power_spectrum
+
+def _record_fft_time(dut, start, count=1):
+    """
+    Add the time since *start* to the FFT times of *dut*'s connection
+    statistics, split evenly between *count* FFTs
+    """
+    stats = getattr(dut, 'stats', None)
+    if stats is None:
+        return
+    elapsed = (default_timer() - start) / count
+    for i in range(count):
+        stats.fft_time.record(elapsed)
+
 def _compute_fft(i_data, q_data, correct_phase, iq_correction_wideband,
         hide_differential_dc_offset, convert_to_dbm, apply_window, decimation, iqswapedbit, Rx_Bw):
 
-    Nsamp = len(i_data)
+    # i_data and q_data may be 2-D arrays of packets, transform the
+    # last axis
+    Nsamp = i_data.shape[-1]
     rbw = Rx_Bw/Nsamp
+    dtype = i_data.dtype
 
     if hide_differential_dc_offset:
-        i_data = i_data - np.mean(i_data)
-        q_data = q_data - np.mean(q_data)
+        i_data = i_data - np.mean(i_data, axis=-1, keepdims=True)
+        q_data = q_data - np.mean(q_data, axis=-1, keepdims=True)
 
     if apply_window:
-        i_data = i_data * np.hanning(len(i_data))
-        q_data = q_data * np.hanning(len(q_data))
+        window = get_window(Nsamp, dtype)
+        i_data = i_data * window
+        q_data = q_data * window
 
     if correct_phase:
-        phi2_deg = 52   # phase error after which the T.D algorithm is skipped to avoid noise floor jumping
-        # Measuring phase error
-        phi_rad, Phi_deg = measurePhaseError(i_data, q_data)
-        if decimation == 1: # F.D + T.D corrections
-            if abs(Phi_deg) < phi2_deg:
-                # T.D correction
-                i_cal, q_cal = _calibrate_i_q_tarek1(i_data, q_data, phi_rad)
-                # F.D correction
-                i_data, q_data = imageAttenuation(i_cal, q_cal, Phi_deg, iqswapedbit, iq_correction_wideband, Rx_Bw, rbw)
-            else:
-                # F.D correction only at the edges
-                q_data = q_data * np.sqrt(sum(i_data ** 2)/sum(q_data ** 2))
-                i_data, q_data = imageAttenuation(i_data, q_data, Phi_deg, iqswapedbit, iq_correction_wideband, Rx_Bw, rbw)
+        if i_data.ndim == 1:
+            i_data, q_data = _correct_phase(i_data, q_data, decimation,
+                iqswapedbit, iq_correction_wideband, Rx_Bw, rbw)
         else:
-            # Only T.D correction at the decimation level > 1
-            i_data, q_data = _calibrate_i_q_tarek1(i_data, q_data, phi_rad)
-        i_data = i_data - np.mean(i_data)
-        q_data = q_data - np.mean(q_data)
+            # the corrections depend on each packet's content
+            rows = [_correct_phase(i_row, q_row, decimation, iqswapedbit,
+                    iq_correction_wideband, Rx_Bw, rbw)
+                for i_row, q_row in zip(i_data, q_data)]
+            i_data = np.array([i_row for i_row, q_row in rows])
+            q_data = np.array([q_row for i_row, q_row in rows])
+        # the corrections may return double precision values
+        i_data = i_data.astype(dtype, copy=False)
+        q_data = q_data.astype(dtype, copy=False)
 
     iq = i_data + 1j * q_data
 
     if apply_window:
-        iq = iq * np.hanning(len(i_data))
+        iq = iq * get_window(Nsamp, dtype)
 
-    power_spectrum = np.abs(np.fft.fftshift(np.fft.fft(iq)))/len(i_data)
+    spectrum = _fft(iq).astype(_complex_dtype(dtype), copy=False)
+    power_spectrum = np.abs(np.fft.fftshift(spectrum, axes=-1))/Nsamp
 
     if convert_to_dbm:
         power_spectrum = 20 * np.log10(power_spectrum)
 
     if hide_differential_dc_offset:
-        median_index = len(power_spectrum) // 2
-        power_spectrum[median_index] = (power_spectrum[median_index - 1]
-            + power_spectrum[median_index + 1]) / 2
+        median_index = Nsamp // 2
+        power_spectrum[..., median_index] = (power_spectrum[..., median_index - 1]
+            + power_spectrum[..., median_index + 1]) / 2
 
     return power_spectrum
 
+def _correct_phase(i_data, q_data, decimation, iqswapedbit,
+        iq_correction_wideband, Rx_Bw, rbw):
+    phi2_deg = 52   # phase error after which the T.D algorithm is skipped to avoid noise floor jumping
+    # Measuring phase error
+    phi_rad, Phi_deg = measurePhaseError(i_data, q_data)
+    if decimation == 1: # F.D + T.D corrections
+        if abs(Phi_deg) < phi2_deg:
+            # T.D correction
+            i_cal, q_cal = _calibrate_i_q_tarek1(i_data, q_data, phi_rad)
+            # F.D correction
+            i_data, q_data = imageAttenuation(i_cal, q_cal, Phi_deg, iqswapedbit, iq_correction_wideband, Rx_Bw, rbw)
+        else:
+            # F.D correction only at the edges
+            q_data = q_data * np.sqrt(sum(i_data ** 2)/sum(q_data ** 2))
+            i_data, q_data = imageAttenuation(i_data, q_data, Phi_deg, iqswapedbit, iq_correction_wideband, Rx_Bw, rbw)
+    else:
+        # Only T.D correction at the decimation level > 1
+        i_data, q_data = _calibrate_i_q_tarek1(i_data, q_data, phi_rad)
+    i_data = i_data - np.mean(i_data)
+    q_data = q_data - np.mean(q_data)
+    return i_data, q_data
+
 def _calibrate_i_q_tarek1(i_data, q_data, phi_rad):
 
     Nsamp = len(i_data)
@@ -196,99 +416,95 @@ def imageAttenuation(i_in, q_in, Phi_deg, iqswapedbit, iq_correction_wideband, R
     BWmin_ndx = int(np.rint(300e3/rbw))		    # min BW indices to attenuate
     BW_ht_ndx = int(np.rint(100e3/rbw))		    # head and tail indices of BW to attenuate
     Nstep = max(1, np.rint(300e3/rbw))
+    center = Nsamp // 2
 
     iq = i_in + 1j * q_in
-    iq = iq * np.hanning(len(i_in))
-    ampl_spectrum = np.fft.fftshift(np.fft.fft(iq))/Nsamp
+    iq = iq * get_window(Nsamp, i_in.dtype)
+    ampl_spectrum = np.fft.fftshift(_fft(iq))/Nsamp
 
     ampl_spectrum_mag = np.abs(ampl_spectrum)
 
     p, x = np.histogram(ampl_spectrum_mag, bins=int(len(ampl_spectrum_mag)/Nstep))
     x = x[:-1] + (x[1] - x[0])/2
-    N_ndx = max(enumerate(p),key=lambda x: x[1])[0]
-    N = x[N_ndx]
+    N = x[np.argmax(p)]
 
-    ToNoise_thresh = 5 * N;  			        # Relative-to-Noise threshold
+    ToNoise_thresh = 5 * N  			        # Relative-to-Noise threshold
     if abs(Phi_deg) > 30.0:				        # Relative-to-Signal threshold
-        ToMax_thresh = 0.005 * np.max(ampl_spectrum_mag);
+        ToMax_thresh = 0.005 * np.max(ampl_spectrum_mag)
     else:
         ToMax_thresh = 0.05 * np.max(ampl_spectrum_mag)
 
+    i_data = i_in; q_data = q_in
     if np.max(ampl_spectrum_mag) > 10 * N:  # To ensure signal presence (3.16=>10dB, 5.6=>15dB, 10=>20dB, 20=>26dB)
         maxNdx = np.argmax(ampl_spectrum_mag)
-        ind = [i for i,v in enumerate(ampl_spectrum_mag) if v > ToNoise_thresh and v > ToMax_thresh and maxNdx-BWmax_ndx < i < maxNdx+BWmax_ndx]
-
-
-        #Removing values beyond channel spacing
-        j1 = 0; j2 = len(ind)-1
-        for i in range(np.argmax(ampl_spectrum_mag[ind]), 0, -1):
-            if abs(ind[i] - ind[i-1]) < chSpacing:  j1 = i
-            else:   break
-        for i in range(np.argmax(ampl_spectrum_mag[ind]), len(ind)-1):
-            if abs(ind[i] - ind[i+1]) < chSpacing:  j2 = i
-            else:   break
+        bins = np.arange(Nsamp)
+        ind = np.flatnonzero((ampl_spectrum_mag > ToNoise_thresh)
+            & (ampl_spectrum_mag > ToMax_thresh)
+            & (bins > maxNdx - BWmax_ndx) & (bins < maxNdx + BWmax_ndx))
+
+        # Removing values beyond channel spacing: keep the run of
+        # indices around the peak that are closer than chSpacing
+        peak = np.argmax(ampl_spectrum_mag[ind])
+        close = np.diff(ind) < chSpacing
+        left = _count_leading(close[:peak][::-1])
+        right = _count_leading(close[peak:])
+        j1 = peak - left + 1 if left else 0
+        j2 = peak + right - 1 if right else len(ind) - 1
         ind = ind[j1-1:j2]
 
-
-        if ind != []:
+        if len(ind):
             head = min(ind) - max(3, BW_ht_ndx)
             tail = max(ind) + max(3, BW_ht_ndx)
-            ind = filter(lambda x: 0 <= x <= Nsamp, range(head, tail+1))
-            midNdx = ind[len(ind)/2]
-
-            if Nsamp/2 in ind:
-                if Nsamp/2 in range(midNdx - max(5, BWmin_ndx), midNdx + max(5, BWmin_ndx)):
-                    ind = []; att_ind = []
+            ind = np.arange(max(head, 0), min(tail, Nsamp) + 1)
+            midNdx = ind[len(ind) // 2]
+
+            if ind[0] <= center <= ind[-1]:
+                if midNdx - max(5, BWmin_ndx) <= center < midNdx + max(5, BWmin_ndx):
+                    ind = ind[:0]
+                elif midNdx > center:
+                    ind_mirror = np.arange(Nsamp-1-ind[-1], ind[0])
                 else:
-                    if midNdx > Nsamp/2:
-                        ind_mirror = range(Nsamp-1-max(ind), min(ind))
-                    else:
-                        ind_mirror = range(min(Nsamp-1,max(ind)), Nsamp-1-min(ind))
-                    # ind_mirror = filter(lambda x: x not in ind, ind_mirror)   # Too slow
+                    ind_mirror = np.arange(min(Nsamp-1, ind[-1]), Nsamp-1-ind[0])
             else:
-                ind_mirror = np.subtract(Nsamp-1,ind)
-            if ind != []:
-                allIndices = np.concatenate([ind,ind_mirror])
+                ind_mirror = Nsamp - 1 - ind
+
+            if len(ind):
+                allIndices = np.concatenate([ind, ind_mirror])
                 if abs(Phi_deg) > 10:   # added as the zero degree doesn't fall exactly on the center frequency
-                    if iqswapedbit == 0:
-                        if Phi_deg > 0:
-                            att_ind = filter(lambda x: x < Nsamp/2, allIndices)
-                        else:
-                            att_ind = filter(lambda x: x > Nsamp/2, allIndices)
-                    if iqswapedbit == 1:
-                        if Phi_deg < 0:
-                            att_ind = filter(lambda x: x < Nsamp/2, allIndices)
-                        else:
-                            att_ind = filter(lambda x: x > Nsamp/2, allIndices)
+                    if (Phi_deg > 0) == (iqswapedbit == 0):
+                        att_ind = allIndices[allIndices < center]
+                    else:
+                        att_ind = allIndices[allIndices > center]
                 else:
                     att_ind = ind_mirror
 
-                if att_ind != []:
-                    if np.max(att_ind) > Nsamp-1 or np.min(att_ind) <  0:   # the if statement can be removed if it'll be faster
-                        att_ind = range(max(0, min(att_ind)), min(max(att_ind), Nsamp))
+                if len(att_ind):
+                    if np.max(att_ind) > Nsamp-1 or np.min(att_ind) <  0:
+                        att_ind = np.arange(max(0, np.min(att_ind)), min(np.max(att_ind), Nsamp))
 
-                    tmparray = np.delete(ampl_spectrum_mag, allIndices)
+                    # indices outside the spectrum are ignored
+                    tmparray = np.delete(ampl_spectrum_mag, allIndices[
+                        (allIndices >= 0) & (allIndices < Nsamp)])
                     p, x = np.histogram(tmparray, bins=int(len(tmparray)/Nstep))
-                    N_ndx = max(enumerate(p),key=lambda x: x[1])[0]
-                    N = np.sqrt(2) * x[N_ndx]
+                    N = np.sqrt(2) * x[np.argmax(p)]
 
                     Natt = np.random.normal(0, N, len(att_ind)) + 1j * np.random.normal(0, N, len(att_ind))
                     ampl_spectrum[att_ind] = (ampl_spectrum[att_ind]/np.abs(ampl_spectrum[att_ind])) * Natt
-                    iq = np.fft.ifft(np.fft.fftshift(ampl_spectrum*Nsamp))
+                    iq = _ifft(np.fft.fftshift(ampl_spectrum*Nsamp))
                     i_data = np.real(iq); q_data = np.imag(iq)
-                else:
-                    i_data = i_in; q_data = q_in
-            else:
-                i_data = i_in; q_data = q_in
-        else:
-            i_data = i_in; q_data = q_in
-    else:
-        i_data = i_in; q_data = q_in
     i_data = i_data - np.mean(i_data)
     q_data = q_data - np.mean(q_data)
 
     return i_data, q_data
 
+def _count_leading(flags):
+    """
+    Return the number of True values at the start of boolean array *flags*
+    """
+    if flags.all():
+        return len(flags)
+    return int(np.argmin(flags))
+
 def calculate_occupied_bw(pow_data, span, occupied_perc):
     """
     Return the occupied bandwidth of a given spectrum, in Hz
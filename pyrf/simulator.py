@@ -0,0 +1,710 @@
+"""
+A simulated RTSA that speaks the SCPI and VRT protocols of ThinkRF
+devices on the local machine, for benchmarking and testing without
+hardware::
+
+    python -m pyrf.simulator --tone 2450e6,-30 --noise -110
+
+then connect to it with sockets as to any other RTSA, which
+:class:`pyrf.devices.thinkrf.WSA` supports with Python 2::
+
+    dut = WSA()
+    dut.connect('127.0.0.1')
+
+or use it in the same process, without sockets, through
+:class:`SimulatorConnector`, with Python 2 or 3::
+
+    dut = WSA(SimulatorConnector(RTSASimulator()))
+    dut.connect('simulator')
+"""
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from pyrf.connectors.base import SCPI_PORT, VRT_PORT
+from pyrf.devices.thinkrf_properties import wsa_properties
+from pyrf.numpy_util import get_window
+from pyrf.stats import ConnectionStats
+from pyrf.util import adjust_usable_fstart_fstop
+from pyrf.vrt import (I_ONLY, VRT_IFDATA_I14Q14, VRT_IFDATA_I14,
+    generate_data_packet, generate_context_packet)
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE_ID = 'ThinkRF,R5500-408 v1.0,SIM00001,1.0.0'
+
+# number of encoded data packets kept for reuse
+PACKET_CACHE_SIZE = 256
+
+# trailer indicators: valid data and reference lock, and spectral inversion
+TRAILER_VALID = (1 << 30) | (1 << 29) | (1 << 18) | (1 << 17)
+TRAILER_SPEC_INV = (1 << 26) | (1 << 14)
+
+_DATA_HEADER = struct.Struct('>I')
+_DATA_TIMESTAMP = struct.Struct('>IQ')
+
+
+class SimulatorError(Exception):
+    pass
+
+
+def _scpi_key(header):
+    """
+    Return the command *header* with every keyword cut to its first
+    three letters, so the short and long forms of a command match
+    """
+    header = header.strip().strip(':').upper()
+    query = header.endswith('?')
+    key = ':'.join(word[:3] for word in header.rstrip('?').split(':'))
+    return key + '?' if query else key
+
+
+class SweepEntry(object):
+    """
+    A sweep list entry as built with the ``:SWEEP:ENTRY`` commands
+    """
+    def __init__(self, mode='SH', spp=1024, fstart=2400000000,
+            fstop=2400000000, fstep=0, attenuation=0):
+        self.mode = mode
+        self.spp = spp
+        self.fstart = fstart
+        self.fstop = fstop
+        self.fstep = fstep
+        self.attenuation = attenuation
+
+    def copy(self):
+        return SweepEntry(self.mode, self.spp, self.fstart, self.fstop,
+            self.fstep, self.attenuation)
+
+    def frequencies(self):
+        """
+        Return the center frequencies captured for this entry
+        """
+        if self.mode == 'DD':
+            return [0]
+        if self.fstep <= 0 or self.fstop <= self.fstart:
+            return [self.fstart]
+        count = (self.fstop - self.fstart) // self.fstep + 1
+        return [self.fstart + i * self.fstep for i in range(count)]
+
+
+class RTSASimulator(object):
+    """
+    A local RTSA simulator.  SCPI commands are accepted on *scpi_port*
+    and VRT packets are sent on *vrt_port*, one client at a time.
+
+    It answers ``*IDN?`` and the queries
+    :class:`pyrf.devices.thinkrf.WSA` needs, runs sweep lists, block
+    captures and stream captures, and sends data packets of synthetic
+    samples with context packets like an RTSA would.  Samples are IQ or
+    I only depending on the RFE mode, as the device properties of
+    *device_id* define.  Each data packet holds a sum of the *tones* in
+    its band plus gaussian noise, scaled so that
+    :func:`pyrf.numpy_util.compute_fft` reports the tone and noise
+    levels given.  Settings that don't change the data are stored and
+    returned by queries without any effect.
+
+    Packets are encoded once for each frequency and size and resent
+    with a new count and timestamp, so the simulator can send much
+    faster than a client can process them unless *packet_rate* is set.
+
+    :param str device_id: the ``*IDN?`` response, which selects the
+                          device properties to simulate
+    :param tones: a list of (frequency in Hz, level in dBm) tuples
+    :param float noise_level: the noise level of each FFT bin in dBm
+    :param bool spec_inv: report spectral inversion for data packets
+                          other than DD mode and invert their spectrum
+    :param float packet_rate: the most data packets to send per
+                              second, or None to send as fast as possible
+    :param int spp: the initial samples per packet of captures and
+                    streams, changed with ``:TRACE:SPP``
+    :param str host: the address to listen on
+    :param int scpi_port: the SCPI port to listen on, or 0 for any port
+    :param int vrt_port: the VRT port to listen on, or 0 for any port
+    :param int seed: seed for the noise
+    """
+
+    def __init__(self, device_id=DEFAULT_DEVICE_ID, tones=(),
+            noise_level=-110.0, spec_inv=False, packet_rate=None, spp=1024,
+            host='127.0.0.1', scpi_port=SCPI_PORT, vrt_port=VRT_PORT,
+            seed=0):
+        self.device_id = device_id
+        self.properties = wsa_properties(device_id)
+        self.tones = list(tones)
+        self.noise_level = noise_level
+        self.spec_inv = spec_inv
+        self.packet_rate = packet_rate
+        self.default_spp = spp
+        self.host = host
+        self.scpi_port = scpi_port
+        self.vrt_port = vrt_port
+        self._random = np.random.RandomState(seed)
+        self._packets = OrderedDict()
+
+        self._listeners = []
+        self._thread = None
+        self._running = False
+        self._vrt_sock = None
+        self._cond = threading.Condition()
+        self._source = None
+        self.reset()
+
+    def reset(self):
+        """
+        Return to the power on state, as ``*RST`` does
+        """
+        with self._cond:
+            self._source = None
+        self.freq = 2400000000
+        self.mode = 'SH'
+        self.decimation = 1
+        self.spp = self.default_spp
+        self.ppb = 1
+        self.iterations = 1
+        self.entries = []
+        self.entry = SweepEntry(spp=self.spp)
+        self.settings = {}
+        self.errors = []
+        self.streaming = False
+        self._counts = {}
+        self._next_time = None
+
+    def start(self):
+        """
+        Start listening for a client in a background thread
+        """
+        try:
+            for port in (self.scpi_port, self.vrt_port):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((self.host, port))
+                sock.listen(1)
+                sock.settimeout(0.2)
+                self._listeners.append(sock)
+        except socket.error as err:
+            self._close_listeners()
+            raise SimulatorError("unable to listen on %s: %s"
+                % (self.host, err))
+        # the ports chosen by the system when 0 was given
+        self.scpi_port, self.vrt_port = (sock.getsockname()[1]
+            for sock in self._listeners)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Disconnect any client and stop listening
+        """
+        self._running = False
+        self._stop_sending()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close_listeners()
+
+    def _close_listeners(self):
+        for sock in self._listeners:
+            sock.close()
+        self._listeners = []
+
+    def _accept(self, listener):
+        while self._running:
+            try:
+                sock, addr = listener.accept()
+            except socket.timeout:
+                continue
+            sock.settimeout(None)
+            return sock
+
+    def _serve(self):
+        scpi_listener, vrt_listener = self._listeners
+        while self._running:
+            scpi = self._accept(scpi_listener)
+            vrt = self._accept(vrt_listener)
+            if vrt is None:
+                if scpi is not None:
+                    scpi.close()
+                break
+            vrt.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+            self.reset()
+            self._vrt_sock = vrt
+            sender = threading.Thread(target=self._send_vrt, args=(vrt,))
+            sender.daemon = True
+            sender.start()
+            try:
+                self._serve_scpi(scpi)
+            except socket.error as err:
+                logger.debug('scpi connection lost: %s', err)
+            finally:
+                self._stop_sending()
+                sender.join()
+                scpi.close()
+                vrt.close()
+
+    def _stop_sending(self):
+        with self._cond:
+            self._source = None
+            vrt = self._vrt_sock
+            self._vrt_sock = None
+            self._cond.notify_all()
+        if vrt is not None:
+            try:
+                # interrupts a send blocked on a client not reading
+                vrt.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _serve_scpi(self, sock):
+        sock.settimeout(0.2)
+        buf = b''
+        while self._running:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                return
+            buf += data
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            responses = []
+            for line in lines:
+                response = self.scpi(line.decode('latin-1'))
+                if response is not None:
+                    responses.append(('%s\n' % response).encode('latin-1'))
+            if responses:
+                sock.sendall(b''.join(responses))
+
+    def scpi(self, cmd):
+        """
+        Handle one SCPI command and return its response, or None for
+        commands that don't respond
+        """
+        cmd = cmd.strip()
+        if not cmd:
+            return None
+        parts = cmd.split(None, 1)
+        key = _scpi_key(parts[0])
+        args = [a.strip() for a in parts[1].split(',')] if len(parts) > 1 else []
+        logger.debug('scpi %r', cmd)
+
+        handler = self._COMMANDS.get(key)
+        if handler is not None:
+            try:
+                return handler(self, *args)
+            except (ValueError, TypeError, KeyError):
+                self.errors.append((-224, "Illegal parameter value"))
+                return '0' if key.endswith('?') else None
+        if key.endswith('?'):
+            return self.settings.get((key[:-1],) + tuple(args), '0')
+        self.settings[(key,) + tuple(args[:-1])] = args[-1] if args else ''
+
+    def _idn(self):
+        return self.device_id
+
+    def _set_freq(self, freq=None):
+        if freq is None:
+            return str(self.freq)
+        self.freq = int(float(freq))
+
+    def _set_mode(self, mode=None):
+        if mode is None:
+            return self.mode
+        self.mode = mode.upper()
+
+    def _set_decimation(self, value=None):
+        if value is None:
+            return str(self.decimation)
+        self.decimation = max(int(value), 1)
+
+    def _set_spp(self, spp=None):
+        if spp is None:
+            return str(self.spp)
+        self.spp = int(spp)
+
+    def _set_ppb(self, ppb=None):
+        if ppb is None:
+            return str(self.ppb)
+        self.ppb = int(ppb)
+
+    def _abort(self):
+        with self._cond:
+            self._source = None
+        self.streaming = False
+
+    def _start_source(self, source):
+        with self._cond:
+            self._source = source
+            self._cond.notify_all()
+
+    def _block_capture(self):
+        self._start_source(self._capture_packets(self.ppb, self.mode,
+            self.freq, self.spp, self.decimation))
+
+    def _stream_start(self, stream_id=None):
+        self.streaming = True
+        self._start_source(self._capture_packets(None, self.mode, self.freq,
+            self.spp, self.decimation,
+            None if stream_id is None else int(stream_id)))
+
+    def _stream_status(self):
+        return 'RUNNING' if self.streaming else 'STOPPED'
+
+    def _entry_new(self):
+        self.entry = SweepEntry(self.mode, self.spp, self.freq, self.freq)
+
+    def _entry_mode(self, mode):
+        self.entry.mode = mode.upper()
+
+    def _entry_spp(self, spp):
+        self.entry.spp = int(spp)
+
+    def _entry_freq_center(self, fstart, fstop=None):
+        self.entry.fstart = int(float(fstart))
+        self.entry.fstop = int(float(fstop if fstop is not None else fstart))
+
+    def _entry_freq_step(self, fstep):
+        self.entry.fstep = int(float(fstep))
+
+    def _entry_attenuation(self, value):
+        self.entry.attenuation = float(value)
+
+    def _entry_save(self):
+        self.entries.append(self.entry.copy())
+
+    def _entry_delete(self, which=None):
+        self.entries = []
+
+    def _iterations(self, count=None):
+        if count is None:
+            return str(self.iterations)
+        self.iterations = int(count)
+
+    def _sweep_start(self, sweep_id=None):
+        self._start_source(self._sweep_packets(list(self.entries),
+            self.iterations, int(sweep_id) if sweep_id is not None else 0))
+
+    def _one(self, *args):
+        return '1'
+
+    def _zero(self, *args):
+        return '0'
+
+    def _error(self):
+        if not self.errors:
+            return '0,"No error"'
+        return '%d,"%s"' % self.errors.pop(0)
+
+    def _capture_mode(self):
+        if self.streaming:
+            return 'STREAMING'
+        return 'BLOCK'
+
+    _COMMANDS = {
+        '*ID?': _idn,
+        '*RS': reset,
+        'SYS:ABO': _abort,
+        'SYS:FLU': _abort,
+        'SYS:LOC:REQ?': _one,
+        'SYS:LOC:HAV?': _one,
+        'SYS:ERR?': _error,
+        'SYS:CAP:MOD?': _capture_mode,
+        'SEN:LOC:RF?': _one,
+        'SEN:LOC:REF?': _one,
+        'DAT:COR:SIG:SIZ?': _zero,
+        'DAT:COR:NOI:SIZ?': _zero,
+        'FRE:CEN': _set_freq,
+        'FRE:CEN?': _set_freq,
+        'INP:MOD': _set_mode,
+        'INP:MOD?': _set_mode,
+        'SEN:DEC': _set_decimation,
+        'SEN:DEC?': _set_decimation,
+        'TRA:SPP': _set_spp,
+        'TRA:SPP?': _set_spp,
+        'TRA:BLO:PAC': _set_ppb,
+        'TRA:BLO:PAC?': _set_ppb,
+        'TRA:BLO:DAT?': _block_capture,
+        'TRA:STR:STA': _stream_start,
+        'TRA:STR:STO': _abort,
+        'TRA:STR:STA?': _stream_status,
+        'SWE:ENT:NEW': _entry_new,
+        'SWE:ENT:MOD': _entry_mode,
+        'SWE:ENT:SPP': _entry_spp,
+        'SWE:ENT:FRE:CEN': _entry_freq_center,
+        'SWE:ENT:FRE:STE': _entry_freq_step,
+        'SWE:ENT:ATT': _entry_attenuation,
+        'SWE:ENT:ATT:VAR': _entry_attenuation,
+        'SWE:ENT:SAV': _entry_save,
+        'SWE:ENT:DEL': _entry_delete,
+        'SWE:LIS:ITE': _iterations,
+        'SWE:LIS:ITE?': _iterations,
+        'SWE:LIS:STA': _sweep_start,
+        'SWE:LIS:STO': _abort,
+        }
+
+    def _send_vrt(self, sock):
+        while True:
+            with self._cond:
+                while self._source is None and self._vrt_sock is sock:
+                    self._cond.wait(0.2)
+                if self._vrt_sock is not sock:
+                    return
+                source = self._source
+            try:
+                data = next(source)
+            except StopIteration:
+                with self._cond:
+                    if self._source is source:
+                        self._source = None
+                continue
+            try:
+                sock.sendall(data)
+            except socket.error as err:
+                logger.debug('vrt connection lost: %s', err)
+                return
+
+    def _sweep_packets(self, entries, iterations, sweep_id):
+        n = 0
+        while not iterations or n < iterations:
+            n += 1
+            yield self._context('sweepid', sweep_id)
+            for entry in entries:
+                yield self._context('reflevel', 0)
+                yield self._context('bandwidth', self._full_bw(entry.mode, 1))
+                for freq in entry.frequencies():
+                    yield self._context('rffreq', freq)
+                    yield self._data(entry.mode, freq, entry.spp, 1)
+
+    def _capture_packets(self, count, mode, freq, spp, decimation,
+            stream_id=None):
+        if stream_id is not None:
+            yield self._context('streamid', stream_id)
+        yield self._context('rffreq', freq)
+        yield self._context('reflevel', 0)
+        yield self._context('bandwidth', self._full_bw(mode, decimation))
+        n = 0
+        while count is None or n < count:
+            n += 1
+            yield self._data(mode, freq, spp, decimation)
+
+    def _timestamp(self):
+        now = time.time()
+        tsi = int(now)
+        return tsi, int((now - tsi) * 1e12)
+
+    def _next_count(self, stream_id):
+        count = self._counts.get(stream_id, 0)
+        self._counts[stream_id] = (count + 1) & 0x0f
+        return count
+
+    def _context(self, field, value):
+        tsi, tsf = self._timestamp()
+        data, count = generate_context_packet(field, value,
+            self._next_count(field), tsi, tsf)
+        return data
+
+    def _data(self, mode, freq, spp, decimation):
+        if self.packet_rate:
+            now = time.time()
+            if self._next_time is None or self._next_time < now - 1:
+                self._next_time = now
+            elif self._next_time > now:
+                time.sleep(self._next_time - now)
+            self._next_time += 1.0 / self.packet_rate
+
+        key = (mode, freq, spp, decimation)
+        packet = self._packets.pop(key, None)
+        if packet is None:
+            packet = self._encode_data(mode, freq, spp, decimation)
+            if len(self._packets) >= PACKET_CACHE_SIZE:
+                self._packets.popitem(last=False)
+        self._packets[key] = packet
+
+        # resend the same samples with the next count and a new timestamp
+        stream_id = packet[1]
+        packet = bytearray(packet[0])
+        (word,) = _DATA_HEADER.unpack_from(packet, 0)
+        word = (word & ~0x000f0000) | (self._next_count(stream_id) << 16)
+        _DATA_HEADER.pack_into(packet, 0, word)
+        _DATA_TIMESTAMP.pack_into(packet, 8, *self._timestamp())
+        return bytes(packet)
+
+    def _full_bw(self, mode, decimation):
+        if mode in ('SH', 'SHN') and decimation > 1:
+            return self.properties.FULL_BW['DEC_' + mode] / decimation
+        return self.properties.FULL_BW[mode] / decimation
+
+    def _encode_data(self, mode, freq, spp, decimation):
+        """
+        Return (packet bytes, stream id) of a data packet with *spp*
+        samples of the simulated signal as captured at *freq*
+        """
+        props = self.properties
+        spec_inv = self.spec_inv and mode != 'DD'
+        iq = (mode != 'DD' and props.DEFAULT_SAMPLE_TYPE.get(mode) != I_ONLY)
+        if mode == 'DD':
+            fstart, full_bw = 0, props.FULL_BW['DD']
+        else:
+            usable, fstart, fstop = adjust_usable_fstart_fstop(props, mode,
+                spp, decimation, freq, spec_inv, [(0, 1)])
+            full_bw = fstop - fstart
+
+        # compute_fft levels are relative to the reference level
+        offset = -props.REFLEVEL_ERROR
+        window = get_window(spp)
+        t = np.arange(spp)
+        signal = np.zeros(spp, dtype=complex if iq else float)
+        for tone, level in self.tones:
+            position = (tone - fstart) / float(full_bw)
+            if not 0 <= position < 1:
+                continue
+            if spec_inv:
+                position = 1 - position
+            amplitude = 10 ** ((level + offset) / 20.0)
+            if iq:
+                # the IQ spectrum is windowed twice and fftshift'ed
+                amplitude /= np.mean(window ** 2)
+                signal += amplitude * np.exp(2j * np.pi * (position - 0.5) * t)
+            else:
+                # the real FFT covers half of the sample rate
+                amplitude *= 2 / np.mean(window)
+                signal += amplitude * np.cos(np.pi * position * t)
+
+        noise_power = 10 ** ((self.noise_level + offset) / 10.0) * spp ** 2
+        if iq:
+            sigma = np.sqrt(noise_power / (2 * np.sum(window ** 4)))
+            signal += sigma * (self._random.randn(spp)
+                + 1j * self._random.randn(spp))
+            samples = np.column_stack((signal.real, signal.imag))
+            stream_id = VRT_IFDATA_I14Q14
+        else:
+            sigma = np.sqrt(noise_power / np.sum(window ** 2))
+            samples = signal + sigma * self._random.randn(spp)
+            stream_id = VRT_IFDATA_I14
+
+        samples = np.clip(np.round(samples * 2 ** 13), -2 ** 13, 2 ** 13 - 1)
+        trailer = TRAILER_VALID | (TRAILER_SPEC_INV if spec_inv else 0)
+        data, count = generate_data_packet(stream_id, samples, trailer=trailer)
+        return data, stream_id
+
+
+class SimulatorConnector(object):
+    """
+    A blocking connector that runs an :class:`RTSASimulator` in this
+    process instead of connecting to it over the network, so a
+    :class:`pyrf.devices.thinkrf.WSA` can use the simulator without
+    sockets or threads::
+
+        dut = WSA(SimulatorConnector(RTSASimulator()))
+        dut.connect('simulator')
+
+    :param simulator: the :class:`RTSASimulator` to control, it should
+                      not be started
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.stats = ConnectionStats()
+        self._buf = b''
+        self._output_file = None
+
+    def connect(self, host, timeout=8):
+        self.simulator.reset()
+        self._buf = b''
+
+    def disconnect(self):
+        self.simulator.reset()
+
+    def set_recording_output(self, output_file=None):
+        """
+        Write the VRT data read to *output_file* as it is read, or stop
+        recording when None
+        """
+        self._output_file = output_file
+
+    def scpiset(self, cmd):
+        # batched commands are joined with newlines
+        for line in cmd.split('\n'):
+            self.simulator.scpi(line)
+
+    def scpiget(self, cmd):
+        return self.scpiget_many([cmd])[0]
+
+    def scpiget_many(self, cmds):
+        return ['%s\n' % self.simulator.scpi(cmd) for cmd in cmds]
+
+    def eof(self):
+        return False
+
+    def raw_read(self, num):
+        while len(self._buf) < num:
+            source = self.simulator._source
+            data = next(source, None) if source is not None else None
+            if data is None:
+                raise SimulatorError("no VRT data to read")
+            self._buf += data
+        data = self._buf[:num]
+        self._buf = self._buf[num:]
+        if self._output_file is not None:
+            self._output_file.write(data)
+        return data
+
+    def sync_async(self, gen):
+        """
+        Handler for the @sync_async decorator, see
+        :meth:`pyrf.connectors.blocking.PlainSocketConnector.sync_async`
+        """
+        val = None
+        try:
+            while True:
+                val = gen.send(val)
+        except StopIteration:
+            return val
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulate an RTSA "
+        "on this machine, listening on the SCPI and VRT ports")
+    parser.add_argument('--host', default='127.0.0.1',
+        help="address to listen on (default %(default)s)")
+    parser.add_argument('--device-id', default=DEFAULT_DEVICE_ID,
+        help="*IDN? response (default %(default)s)")
+    parser.add_argument('--tone', action='append', default=[],
+        metavar='FREQ,DBM', help="add a tone, e.g. 2450e6,-30")
+    parser.add_argument('--noise', type=float, default=-110.0,
+        help="noise level in dBm per bin (default %(default)s)")
+    parser.add_argument('--spec-inv', action='store_true',
+        help="send spectrally inverted data")
+    parser.add_argument('--rate', type=float, default=None,
+        help="most data packets per second (default unlimited)")
+    parser.add_argument('--spp', type=int, default=1024,
+        help="initial samples per packet (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    tones = []
+    for tone in args.tone:
+        freq, level = tone.split(',')
+        tones.append((float(freq), float(level)))
+    sim = RTSASimulator(args.device_id, tones, args.noise, args.spec_inv,
+        args.rate, args.spp, args.host)
+    sim.start()
+    print("simulating %s on %s" % (args.device_id, args.host))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import time
+
+import numpy as np
+
+#: ways :class:`Spectrogram` reduces several bins to one column
+RESAMPLE_MAX = 'max'
+RESAMPLE_MEAN = 'mean'
+RESAMPLE_METHODS = (RESAMPLE_MAX, RESAMPLE_MEAN)
+
+
+class SpectrogramError(Exception):
+    pass
+
+
+class Spectrogram(object):
+    """
+    A waterfall of the last *depth* spectra, e.g. the
+    ``(fstart, fstop, power_data)`` results of
+    :meth:`pyrf.sweep_device.SweepDevice.capture_power_spectrum`, kept
+    in memory allocated once so long running monitors use a constant
+    amount of memory.  Time domain captures from
+    :class:`pyrf.capture_device.CaptureDevice` are added once their
+    spectrum is computed with :func:`pyrf.numpy_util.compute_fft`.
+
+    Each spectrum is resampled to *width* columns evenly covering
+    *fstart* to *fstop*.  When several bins fall in a column they are
+    reduced to their maximum, so narrow peaks stay visible, or to their
+    mean with *resample* set to ``'mean'``.  Columns between bins are
+    linearly interpolated and columns outside the spectrum are set to
+    *fill*.
+
+    Rows are stored twice in a buffer of ``2 * depth`` rows, so the last
+    rows are always contiguous and :meth:`rows` returns them without
+    copying.  The views returned are overwritten as more spectra are
+    added, copy them to keep them longer than *depth* spectra.
+
+    :param int depth: the number of spectra kept
+    :param int width: the number of frequency columns, or None to use
+                      the number of bins of the first spectrum added
+    :param float fstart: the frequency in Hz of the start of the first
+                         column, or None to use the first spectrum's
+    :param float fstop: the frequency in Hz of the end of the last
+                        column, or None to use the first spectrum's
+    :param str resample: ``'max'`` or ``'mean'``
+    :param dtype: the numpy dtype of the values stored
+    :param float fill: the value of columns a spectrum doesn't cover
+
+    .. attribute:: count
+
+       the number of spectra added since the spectrogram was created
+       or cleared, including the ones no longer kept
+    """
+
+    def __init__(self, depth, width=None, fstart=None, fstop=None,
+            resample=RESAMPLE_MAX, dtype=np.float32, fill=np.nan):
+        if depth < 1:
+            raise SpectrogramError("depth must be at least 1")
+        if resample not in RESAMPLE_METHODS:
+            raise SpectrogramError("unknown resample method %r"
+                % (resample,))
+        self.depth = depth
+        self.width = width
+        self.fstart = fstart
+        self.fstop = fstop
+        self.resample = resample
+        self.dtype = np.dtype(dtype)
+        self.fill = fill
+        self._buf = None
+        self._times = np.zeros(2 * depth)
+        self._plan_key = None
+        self._plan = None
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all the spectra
+        """
+        self.count = 0
+        self._pos = 0
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+    def frequencies(self):
+        """
+        Return the center frequencies in Hz of the columns
+        """
+        if self._buf is None:
+            raise SpectrogramError("no spectrum added yet")
+        step = (self.fstop - self.fstart) / float(self.width)
+        return self.fstart + (np.arange(self.width) + 0.5) * step
+
+    def add(self, fstart, fstop, power_data, timestamp=None):
+        """
+        Add a spectrum as the newest row, replacing the oldest row once
+        *depth* spectra have been added
+
+        :param float fstart: the frequency in Hz of the start of the
+                             first bin of *power_data*
+        :param float fstop: the frequency in Hz of the end of the last bin
+        :param power_data: the spectrum, a 1-D array
+        :param float timestamp: the time of the spectrum in seconds, e.g.
+                                the first of
+                                :attr:`pyrf.sweep_device.SweepDevice.sweep_time`,
+                                or None for the current time
+        """
+        if self._buf is None:
+            self._allocate(fstart, fstop, len(power_data))
+
+        row = self._buf[self._pos]
+        plan = self._resample_plan(fstart, fstop, len(power_data))
+        row.fill(self.fill)
+        if plan[0] == 'reduce':
+            kind, b0, b1, starts, c0, c1 = plan
+            if self.resample == RESAMPLE_MAX:
+                row[c0:c1] = np.maximum.reduceat(power_data[b0:b1], starts)
+            else:
+                counts = np.diff(np.append(starts, b1 - b0))
+                row[c0:c1] = (np.add.reduceat(power_data[b0:b1], starts)
+                    / counts)
+        elif plan[0] == 'interp':
+            kind, c0, c1, columns, bins = plan
+            row[c0:c1] = np.interp(columns, bins, power_data)
+
+        self._buf[self._pos + self.depth] = row
+        if timestamp is None:
+            timestamp = time.time()
+        self._times[self._pos] = self._times[self._pos + self.depth] = timestamp
+        self._pos = (self._pos + 1) % self.depth
+        self.count += 1
+
+    def rows(self, n=None):
+        """
+        Return a view of the last *n* rows, oldest first
+
+        :param int n: the number of rows, at most the number of spectra
+                      kept, or None for all of them
+        :returns: a numpy array with shape (n, width)
+        """
+        start, stop = self._last(n)
+        if self._buf is None:
+            return np.zeros((0, self.width or 0), dtype=self.dtype)
+        return self._buf[start:stop]
+
+    def timestamps(self, n=None):
+        """
+        Return a view of the timestamps of the last *n* rows, oldest first
+        """
+        start, stop = self._last(n)
+        return self._times[start:stop]
+
+    def _last(self, n):
+        if n is None:
+            n = len(self)
+        if not 0 <= n <= len(self):
+            raise SpectrogramError("only %d rows available" % len(self))
+        # the newest row is just before _pos in the second copy
+        stop = self._pos + self.depth
+        return stop - n, stop
+
+    def _allocate(self, fstart, fstop, bins):
+        if self.fstart is None:
+            self.fstart = fstart
+        if self.fstop is None:
+            self.fstop = fstop
+        if self.width is None:
+            self.width = bins
+        if not self.fstop > self.fstart:
+            raise SpectrogramError("fstop must be greater than fstart")
+        self._buf = np.empty((2 * self.depth, self.width), dtype=self.dtype)
+
+    def _resample_plan(self, fstart, fstop, bins):
+        """
+        Return how to place a spectrum of *bins* bins from *fstart* to
+        *fstop* in a row.  The plan is kept for the next spectrum, which
+        usually covers the same frequencies.
+        """
+        key = (fstart, fstop, bins)
+        if key == self._plan_key:
+            return self._plan
+
+        step = (self.fstop - self.fstart) / float(self.width)
+        bin_step = (fstop - fstart) / float(bins)
+        centers = fstart + (np.arange(bins) + 0.5) * bin_step
+        columns = np.floor((centers - self.fstart) / step).astype(int)
+        inside = np.flatnonzero((columns >= 0) & (columns < self.width))
+
+        if not len(inside):
+            plan = ('none',)
+        else:
+            b0, b1 = inside[0], inside[-1] + 1
+            columns = columns[b0:b1]
+            starts = np.flatnonzero(np.diff(columns)) + 1
+            starts = np.append(0, starts)
+            c0, c1 = columns[0], columns[-1] + 1
+            if len(starts) == c1 - c0:
+                # every column has at least one bin
+                plan = ('reduce', b0, b1, starts, c0, c1)
+            else:
+                # fewer bins than columns, interpolate the columns whose
+                # center is within the spectrum
+                col_centers = self.fstart + (np.arange(self.width) + 0.5
+                    ) * step
+                within = np.flatnonzero((col_centers >= fstart)
+                    & (col_centers < fstop))
+                if not len(within):
+                    plan = ('none',)
+                else:
+                    c0, c1 = within[0], within[-1] + 1
+                    plan = ('interp', c0, c1, col_centers[c0:c1], centers)
+
+        self._plan_key = key
+        self._plan = plan
+        return plan
@@ -0,0 +1,200 @@
+import math
+from timeit import default_timer
+
+from pyrf.vrt import VRT_COUNT_MODULO
+
+
+class TimeHistogram(object):
+    """
+    A histogram of durations in power of two buckets, from 1 us up to
+    about 8 s, cheap enough to update for every packet.
+
+    .. attribute:: buckets
+
+       a list of counts, bucket *n* holds durations of less than
+       2 ** *n* microseconds, and the last bucket holds everything longer
+    """
+    BUCKETS = 24
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def record(self, seconds):
+        """
+        Add a duration of *seconds* to the histogram
+        """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        # frexp returns the exponent of the next power of two
+        exponent = math.frexp(seconds * 1e6)[1] if seconds > 1e-6 else 0
+        self.buckets[min(exponent, self.BUCKETS - 1)] += 1
+
+    def mean(self):
+        """
+        Return the mean duration in seconds, 0 if nothing was recorded
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Return the upper bound in seconds of the bucket containing the
+        *percent* percentile, or None if nothing was recorded
+        """
+        if not self.count:
+            return None
+        needed = self.count * percent / 100.0
+        seen = 0
+        for n, count in enumerate(self.buckets):
+            seen += count
+            if seen >= needed:
+                break
+        return 2 ** n * 1e-6
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': list(self.buckets),
+            }
+
+
+class ConnectionStats(object):
+    """
+    VRT statistics of a connection, updated by the connectors as packets
+    are read and by :func:`pyrf.numpy_util.compute_fft` for FFT times.
+    Every connector has one as its ``stats`` attribute, also available
+    as :attr:`pyrf.devices.thinkrf.WSA.stats`.
+
+    .. attribute:: packets
+
+       the number of VRT packets received
+
+    .. attribute:: bytes
+
+       the number of VRT bytes received
+
+    .. attribute:: lost_packets
+
+       the number of data packets missing from the packet count sequence
+       of their stream, the count wraps at 16 so longer gaps are missed
+
+    .. attribute:: sample_loss
+
+       the number of data packets with the sample loss indicator set
+
+    .. attribute:: over_range
+
+       the number of data packets with the over range indicator set
+
+    .. attribute:: invalid_data
+
+       the number of data packets with the valid data indicator enabled
+       and clear
+
+    .. attribute:: reference_unlocked
+
+       the number of data packets with the reference lock indicator
+       enabled and clear
+
+    .. attribute:: parse_time
+
+       a :class:`TimeHistogram` of the time spent decoding each packet
+
+    .. attribute:: fft_time
+
+       a :class:`TimeHistogram` of the time spent computing each FFT
+    """
+
+    def __init__(self):
+        self.parse_time = TimeHistogram()
+        self.fft_time = TimeHistogram()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all of the counters and histograms
+        """
+        self.packets = 0
+        self.data_packets = 0
+        self.context_packets = 0
+        self.bytes = 0
+        self.lost_packets = 0
+        self.sample_loss = 0
+        self.over_range = 0
+        self.invalid_data = 0
+        self.reference_unlocked = 0
+        self._counts = {}
+        self.parse_time.reset()
+        self.fft_time.reset()
+        self._start = default_timer()
+        self._last = (self._start, 0, 0)
+
+    def record_packet(self, packet, size):
+        """
+        Count a received packet
+
+        :param packet: a :class:`pyrf.vrt.DataPacket` or
+                       :class:`pyrf.vrt.ContextPacket`
+        :param int size: the packet size in bytes
+        """
+        self.packets += 1
+        self.bytes += size
+        if not packet.is_data_packet():
+            self.context_packets += 1
+            return
+
+        self.data_packets += 1
+        last = self._counts.get(packet.stream_id)
+        self._counts[packet.stream_id] = packet.count
+        if last is not None:
+            self.lost_packets += (packet.count - last - 1) % VRT_COUNT_MODULO
+        if packet.sample_loss:
+            self.sample_loss += 1
+        if packet.over_range:
+            self.over_range += 1
+        # only indicators the RTSA enabled in the trailer are counted
+        trailer = packet.trailer
+        if trailer & (1 << 30) and not packet.valid_data:
+            self.invalid_data += 1
+        if trailer & (1 << 29) and not packet.reference_lock:
+            self.reference_unlocked += 1
+
+    def snapshot(self):
+        """
+        Return a dict of the counters, the packets and bytes per second
+        since the last snapshot (or since the counters were reset) and
+        the time histograms as dicts.
+        """
+        now = default_timer()
+        last_time, last_packets, last_bytes = self._last
+        self._last = (now, self.packets, self.bytes)
+        elapsed = now - last_time
+        return {
+            'elapsed': now - self._start,
+            'packets': self.packets,
+            'data_packets': self.data_packets,
+            'context_packets': self.context_packets,
+            'bytes': self.bytes,
+            'packets_per_second':
+                (self.packets - last_packets) / elapsed if elapsed else 0.0,
+            'bytes_per_second':
+                (self.bytes - last_bytes) / elapsed if elapsed else 0.0,
+            'lost_packets': self.lost_packets,
+            'sample_loss': self.sample_loss,
+            'over_range': self.over_range,
+            'invalid_data': self.invalid_data,
+            'reference_unlocked': self.reference_unlocked,
+            'parse_time': self.parse_time.as_dict(),
+            'fft_time': self.fft_time.as_dict(),
+            }
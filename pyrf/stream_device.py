@@ -0,0 +1,247 @@
+from collections import namedtuple, deque
+
+import numpy as np
+
+from pyrf.vrt import VRT_COUNT_MODULO
+try:
+    import asyncio
+except ImportError:
+    # only needed for async iteration with an AsyncioConnector
+    asyncio = None
+
+#: overflow policies of :class:`StreamDevice`
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+#: a block of samples from one data packet: *data* is a numpy array of
+#: (I, Q) rows for I14Q14 data or of the samples of I-only data, *tsi*
+#: and *tsf* are the packet's integer and fractional (picosecond)
+#: timestamp, *context* is a dict of the context fields received before
+#: the packet, *lost* is the number of packets lost just before this one
+#: and *sample_loss* is the packet's sample loss indicator
+StreamBlock = namedtuple('StreamBlock',
+    'data tsi tsf stream_id context lost sample_loss')
+
+
+class StreamDeviceError(Exception):
+    pass
+
+
+class StreamDevice(object):
+    """
+    Virtual device that turns a :meth:`pyrf.devices.thinkrf.WSA.stream_start`
+    capture into :class:`StreamBlock` objects kept in a bounded queue.
+
+    The queue's sample buffer is allocated when the first data packet
+    arrives, for *capacity* packets of that size, and every packet's
+    samples are copied into it.  Packets that are a different size than
+    the first are dropped.
+
+    With a blocking connector iterate over the device to read blocks,
+    packets are only read when the queue is empty.  With an async
+    connector packets are queued as they arrive and taken with
+    :meth:`get_nowait`, or with ``async for`` when using an
+    :class:`pyrf.connectors.asyncio_async.AsyncioConnector`.
+
+    When the queue is full *overflow* decides what happens to an
+    arriving packet:
+
+    ``'drop_oldest'``
+        the oldest block is discarded to make room
+    ``'drop_newest'``
+        the arriving packet is discarded
+    ``'block'``
+        reading from the VRT connection is paused until a block is
+        taken, so the RTSA stops sending instead of losing data
+
+    Lost packets are detected from gaps in the VRT packet count and
+    reported, along with packets dropped by the overflow policy, in the
+    next block's *lost* field.  The packet count wraps at 16, so longer
+    gaps can't be detected.
+
+    :param real_device: the RF device that will stream data, typically
+                        a :class:`pyrf.devices.thinkrf.WSA` instance
+    :param int capacity: the number of blocks the queue holds
+    :param str overflow: 'drop_oldest', 'drop_newest' or 'block'
+    """
+
+    def __init__(self, real_device, capacity=64, overflow=DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise StreamDeviceError("unknown overflow policy %r" % (overflow,))
+        if capacity < 1:
+            raise StreamDeviceError("capacity must be at least 1")
+
+        self.real_device = real_device
+        self.capacity = capacity
+        self.overflow = overflow
+        if real_device.async_connector():
+            # disable receiving data until we are expecting it
+            real_device.set_async_callback(None)
+
+        self._data = None
+        self._blocks = [None] * capacity
+        self._head = 0
+        self._size = 0
+        # packets that arrived after the VRT connection was paused
+        self._backlog = deque()
+        self._paused = False
+        self._waiting = None
+        self._context = {}
+        self._counts = {}
+        self._lost = 0
+        self.streaming = False
+
+        #: packets lost by the RTSA, from gaps in the packet count
+        self.lost_packets = 0
+        #: packets discarded by the overflow policy or for their size
+        self.dropped_packets = 0
+
+    def start(self, stream_id=None):
+        """
+        Start streaming.
+
+        :param int stream_id: optional unsigned 32-bit stream identifier
+        """
+        self.streaming = True
+        if self.real_device.async_connector():
+            self.real_device.set_async_callback(self._vrt_receive)
+        self.real_device.stream_start(stream_id)
+
+    def stop(self):
+        """
+        Stop streaming.  Blocks already queued may still be taken.
+        """
+        self.streaming = False
+        self.real_device.stream_stop()
+        if self.real_device.async_connector():
+            self.real_device.set_async_callback(None)
+        self._resume()
+        if self._waiting is not None:
+            self._waiting.set_exception(StopAsyncIteration())
+            self._waiting = None
+
+    def __len__(self):
+        return self._size + len(self._backlog)
+
+    def get_nowait(self):
+        """
+        Return the oldest queued :class:`StreamBlock`, or None if the
+        queue is empty.
+        """
+        if not self._size:
+            return None
+        block = self._blocks[self._head]
+        data = self._data[self._head].copy()
+        self._blocks[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+
+        while self._backlog and self._size < self.capacity:
+            self._queue(self._backlog.popleft())
+        self._resume()
+        return block._replace(data=data)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.real_device.async_connector():
+            raise StreamDeviceError(
+                "use get_nowait() or async for with an async connector")
+        while not self._size:
+            if not self.streaming:
+                raise StopIteration
+            self._vrt_receive(self.real_device.read())
+        return self.get_nowait()
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = asyncio.get_event_loop().create_future()
+        if self._size:
+            future.set_result(self.get_nowait())
+        elif not self.streaming:
+            future.set_exception(StopAsyncIteration())
+        else:
+            self._waiting = future
+        return future
+
+    def _vrt_receive(self, packet):
+        if packet.is_context_packet():
+            # share one dict between the blocks it applies to
+            self._context = dict(self._context, **packet.fields)
+            return
+
+        # count the packets lost since the last one of this stream
+        last = self._counts.get(packet.stream_id)
+        self._counts[packet.stream_id] = packet.count
+        if last is not None:
+            lost = (packet.count - last - 1) % VRT_COUNT_MODULO
+            self.lost_packets += lost
+            self._lost += lost
+
+        data = packet.data.numpy_array()
+        if self._data is None:
+            self._data = np.empty((self.capacity,) + data.shape,
+                dtype=data.dtype.newbyteorder('='))
+        elif data.shape != self._data.shape[1:]:
+            self._drop()
+            return
+
+        block = StreamBlock(data, packet.tsi, packet.tsf, packet.stream_id,
+            self._context, 0, packet.sample_loss)
+        if self._waiting is not None and not self._size:
+            self._waiting.set_result(block._replace(data=data.astype(
+                self._data.dtype), lost=self._take_lost()))
+            self._waiting = None
+            return
+
+        if self._size < self.capacity:
+            self._queue(block)
+        elif self.overflow == DROP_NEWEST:
+            self._drop()
+        elif self.overflow == DROP_OLDEST:
+            head = self._blocks[self._head]
+            self._blocks[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._size -= 1
+            self.dropped_packets += 1
+            self._queue(block)
+            # the new oldest block follows the dropped one
+            oldest = self._blocks[self._head]
+            self._blocks[self._head] = oldest._replace(
+                lost=oldest.lost + head.lost + 1)
+        else:
+            # keep the packet until there is room, the VRT connection is
+            # paused so only packets already received arrive
+            self._backlog.append(block._replace(data=data.copy(),
+                lost=self._take_lost()))
+            if not self._paused:
+                self._paused = True
+                self.real_device.connector.pause_vrt()
+
+    def _queue(self, block):
+        i = (self._head + self._size) % self.capacity
+        self._data[i] = block.data
+        self._blocks[i] = block._replace(data=None,
+            lost=block.lost + self._take_lost())
+        self._size += 1
+
+    def _take_lost(self):
+        lost = self._lost
+        self._lost = 0
+        return lost
+
+    def _drop(self):
+        self.dropped_packets += 1
+        self._lost += 1
+
+    def _resume(self):
+        if self._paused and not self._backlog:
+            self._paused = False
+            self.real_device.connector.resume_vrt()
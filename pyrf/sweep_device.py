@@ -1,109 +1,49 @@
+import os
+import re
 import sys
 import math
 import random
-from collections import namedtuple
+import zipfile
+import multiprocessing
+from collections import namedtuple, OrderedDict, deque
 import time
+from timeit import default_timer
 from pyrf.util import (compute_usable_bins, adjust_usable_fstart_fstop,
-    trim_to_usable_fstart_fstop, find_saturation)
+    find_saturation)
 
 import numpy as np
-from twisted.internet import defer
 
-from pyrf.numpy_util import compute_fft
+from pyrf.numpy_util import compute_fft, PRECISION_DTYPES
+from pyrf.vrt import I_ONLY
 import struct
 MAXIMUM_SPP = 32768
-
-class correction_vector_acquire(object):
-    data_buffer = ""
-    v_type = "SIGNAL"
-    dut = None
-    complete_buffer = False
-    d = None
-    offset = 0
-    size = 0
-    transfer_size = 16*1024
-
-    def get_vector_loop(self, data):
-        self.data_buffer = b"".join([self.data_buffer, data])
-        self.offset += len(data)
-        if self.offset >= self.size:
-            # we have gotten all out data, return this object
-            if self.d is not None:
-                self.d.callback(self)
-        else:
-            # more data, grab another set of data
-            data1 = self.dut.correction_data(self.v_type, self.offset,
-                                             self.transfer_size)
-            # and add this function to the call back
-            data1.addCallback(self.get_vector_loop)
-
-    def get_vector_data(self, size):
-        # We got out size
-        if size is None:
-            # size is return None threw our created deffered in get_vector
-            if self.d is not None:
-                self.d.callback(None)
-            return
-
-        self.size = int(size)
-        if self.size == 0:
-            if self.d is not None:
-                self.d.callback(None)
-            return
-
-        if self.size < self.transfer_size:
-            self.transfer_size = self.size
-        # Grab our first set of data (deffered)
-        data = self.dut.correction_data(self.v_type, self.offset,
-                                        self.transfer_size)
-        # add the self.get_vector_loop call back
-        data.addCallback(self.get_vector_loop)
-        # what happens to error back here?
-
-    def error_b(self, failure):
-        if self.d is not None:
-            self.d.callback(None)
-        return None
-
-    def get_vector(self, v_type=None):
-        #
-        self.v_type = v_type
-        self.offset = 0
-        self.data_buffer = ""
-        # Create a defered
-        d = defer.Deferred()
-        self.d = d
-
-        # get our size (deffered)
-        size = self.dut.correction_size(self.v_type)
-        size.addCallback(self.get_vector_data)
-        size.addErrback(self.error_b)
-        # return our deferred
-        return d
-
+# number of sweep plans kept by each SweepDevice
+PLAN_CACHE_SIZE = 16
+# number of resampled vectors kept by each correction_vector
+RESAMPLE_CACHE_SIZE = 64
+# format of the files written to a SweepDevice correction_cache
+CORRECTION_CACHE_VERSION = 1
 
 class correction_vector(object):
+    """
+    Correction vectors read from the RTSA, in dB.
+
+    :param dtype: the numpy dtype of the vectors returned by
+                  :meth:`get_correction_vector`
+    """
     correction_vectors = None
     frequency_index = None
     digest = None
 
-    def __init__(self):
+    def __init__(self, dtype=float):
         self.frequency_index = []
         self.dy = np.dtype(np.int32)
         self.dy = self.dy.newbyteorder('>')
+        self.dtype = dtype
         self.correction_vectors = {}
-
-    def _binary_search(self, freq):
-        # Simple binary search, modified to work the object's datastructure
-        lo = 0
-        hi = len(self.frequency_index)
-        while lo < hi:
-            mid = (lo + hi) // 2
-            if self.frequency_index[mid][0] * 1e3 < freq:
-                lo = mid + 1
-            else:
-                hi = mid
-        return lo
+        self._frequencies = np.zeros(0)
+        self._vector_indexes = []
+        self._resampled = OrderedDict()
 
     def _interp(self, in_array, number_of_points):
         # array index of our orignal from 0 to size of vector - 1
@@ -114,19 +54,71 @@ class correction_vector(object):
         out_array = np.interp(z, x, in_array)
         return out_array
 
+    def _index_frequencies(self):
+        # frequencies in Hz for searching, the list is sorted in kHz
+        self._frequencies = np.array(
+            [freq for freq, index in self.frequency_index]) * 1e3
+        self._vector_indexes = [index for freq, index in self.frequency_index]
+        self._resampled.clear()
+
+    def get_arrays(self):
+        """
+        Return the frequency index and vectors as a dict of numpy arrays
+        that :meth:`set_arrays` accepts, e.g. for saving with
+        :func:`numpy.savez`.
+        """
+        indexes = sorted(self.correction_vectors)
+        return {
+            'frequency_index': np.array(self.frequency_index,
+                dtype=np.int64).reshape(-1, 2),
+            'indexes': np.array(indexes, dtype=np.int64),
+            'vectors': np.array([self.correction_vectors[i]
+                for i in indexes]).reshape(len(indexes), self.vector_size),
+            }
+
+    def set_arrays(self, arrays):
+        """
+        Load the frequency index and vectors from a dict of arrays
+        returned by :meth:`get_arrays`.
+
+        :raises ValueError: if the arrays are not consistent
+        """
+        frequency_index = np.asarray(arrays['frequency_index'])
+        indexes = np.asarray(arrays['indexes'])
+        vectors = np.asarray(arrays['vectors'], dtype=float)
+        if (frequency_index.ndim != 2 or frequency_index.shape[1] != 2
+                or vectors.ndim != 2 or len(vectors) != len(indexes)
+                or not set(frequency_index[:, 1]) <= set(indexes)):
+            raise ValueError("inconsistent correction vector arrays")
+
+        self.vector_size = vectors.shape[1]
+        self.frequency_index = [[int(freq), int(index)]
+            for freq, index in frequency_index]
+        self.correction_vectors = dict(zip((int(i) for i in indexes),
+            vectors))
+        self._index_frequencies()
+
     def get_correction_vector(self, freq, number_of_points):
-        # binary search, retunrs our index
-        index = self._binary_search(freq)
-        # get the case where we go off the end
-        if index == len(self.frequency_index):
-            index = index - 1
-
-        # get our vector
-        vector = self.correction_vectors[self.frequency_index[index][1]]
-        # convert from micro db to db
-        vector = vector / 1000000.0
-        # interpolate our vector to the wanted size
-        resampled_vector = self._interp(vector, number_of_points)
+        """
+        Return the correction vector for *freq* resampled to
+        *number_of_points*.  The returned array is shared with later
+        calls and must not be modified.
+        """
+        # the first vector at or above freq, or the last one
+        index = np.searchsorted(self._frequencies, freq)
+        index = min(index, len(self._frequencies) - 1)
+
+        key = (self._vector_indexes[index], number_of_points)
+        resampled_vector = self._resampled.pop(key, None)
+        if resampled_vector is None:
+            # interpolate our vector to the wanted size
+            resampled_vector = self._interp(
+                self.correction_vectors[key[0]], number_of_points)
+            resampled_vector = resampled_vector.astype(self.dtype)
+            resampled_vector.setflags(write=False)
+            if len(self._resampled) >= RESAMPLE_CACHE_SIZE:
+                self._resampled.popitem(last=False)
+        self._resampled[key] = resampled_vector
         return resampled_vector
 
     def buffer_to_vector(self, buffer_in):
@@ -157,6 +149,7 @@ class correction_vector(object):
         for i in range(freq_num):
             freq, index = struct.unpack("!LH", input_buffer[i*6:i*6+6])
             self.frequency_index.append([freq, index])
+        self._index_frequencies()
 
         # grab our correction vectors
         for i in range(vector_num):
@@ -172,10 +165,44 @@ class correction_vector(object):
             input_buffer = buffer_in[offset:offset + size]
             micro_db = np.frombuffer(input_buffer, dtype=self.dy,
                                      count=self.vector_size)
-            self.correction_vectors[index] = micro_db
+            # convert from micro db to db
+            self.correction_vectors[index] = micro_db / 1000000.0
             offset += size
 
 
+# the device compute_fft() is passed in SweepDevice worker processes and
+# the precision to compute with, set by _init_fft_worker()
+_worker_device = None
+_worker_precision = None
+
+
+class _WorkerDevice(object):
+    """
+    Stands in for the real device in worker processes, compute_fft()
+    only needs its properties
+    """
+    def __init__(self, properties):
+        self.properties = properties
+
+
+def _init_fft_worker(properties, precision):
+    global _worker_device, _worker_precision
+    _worker_device = _WorkerDevice(properties)
+    _worker_precision = precision
+
+
+def _fft_worker(packet, context):
+    """
+    Compute the spectrum of *packet* in a worker process, returns
+    (pow_data, seconds taken)
+    """
+    start = default_timer()
+    # spectral inversion is undone when the data is placed
+    pow_data = compute_fft(_worker_device, packet, context,
+        apply_spec_inv=False, precision=_worker_precision)
+    return pow_data, default_timer() - start
+
+
 class SweepDeviceError(Exception):
     """
     Exception for the sweep device to state an error() has occured
@@ -360,6 +387,169 @@ class SweepPlanner(object):
         return sweep_settings
 
 
+# where one packet's power spectrum goes in the sweep's spectral data:
+# spectral_data[dst] = pow_data[src], reversed first if flip is set
+BinPlacement = namedtuple('BinPlacement', 'src dst flip')
+
+
+def copy_bin_slices(src_fstart, src_fstop, srclen, dst_fstart, dst_fstop,
+        dstlen):
+    """
+    Return the (src, dst) slices that copy the bins of a *srclen* bin
+    spectrum covering *src_fstart* to *src_fstop* into the matching bins
+    of a *dstlen* bin spectrum covering *dst_fstart* to *dst_fstop*,
+    trimming whatever is outside of the destination.  Both slices are
+    empty if nothing overlaps.  The bins are copied one to one, so both
+    spectra should have the same RBW.
+    """
+    srcrbw = float(src_fstop - src_fstart) / srclen
+    dstrbw = float(dst_fstop - dst_fstart) / dstlen
+
+    if src_fstart < dst_fstart:
+        src_start_bin = int(float(dst_fstart - src_fstart) / srcrbw)
+        dst_start_bin = 0
+    else:
+        src_start_bin = 0
+        dst_start_bin = int(round(float(src_fstart - dst_fstart) / dstrbw))
+    if src_fstop > dst_fstop:
+        src_stop_bin = srclen - int(float(src_fstop - dst_fstop) / srcrbw)
+    else:
+        src_stop_bin = srclen
+
+    dst_stop_bin = min(dst_start_bin + src_stop_bin - src_start_bin, dstlen)
+    src_stop_bin = src_start_bin + dst_stop_bin - dst_start_bin
+    if dst_stop_bin <= dst_start_bin or src_stop_bin <= src_start_bin:
+        return slice(0, 0), slice(0, 0)
+    return (slice(src_start_bin, src_stop_bin),
+        slice(dst_start_bin, dst_stop_bin))
+
+
+def plan_bin_placement(dev_properties, sweep_settings, freq, spec_inv,
+        nbins, dd=False):
+    """
+    Return the :class:`BinPlacement` for the power spectrum of one packet
+    of a sweep.  The power spectrum is the one returned by
+    :func:`pyrf.numpy_util.compute_fft` with *apply_spec_inv* off, so
+    spectrally inverted packets are placed reversed.
+
+    :param dev_properties: the sweep device properties
+    :param sweep_settings: the sweep's plan
+    :type sweep_settings: SweepSettings
+    :param float freq: the packet's center frequency (rffreq) in Hz
+    :param bool spec_inv: the packet's spectral inversion flag
+    :param int nbins: the number of bins in the power spectrum
+    :param bool dd: the packet is the sweep's DD mode entry
+    """
+    flip = bool(spec_inv)
+    if dd:
+        # the whole DD spectrum covers 0 Hz to the DD bandwidth
+        left, right = 0, nbins
+        src_fstart = 0
+        src_fstop = dev_properties.FULL_BW['DD']
+    else:
+        mode = sweep_settings.rfe_mode
+        usable_bins = compute_usable_bins(dev_properties, mode,
+            sweep_settings.spp, 1, 0)
+        usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
+            dev_properties, mode, nbins * 2, 1, freq, spec_inv, usable_bins)
+
+        # the usable range, as trim_to_usable_fstart_fstop computes it
+        left = int(usable_bins[0][0])
+        right = int(usable_bins[-1][0] + usable_bins[-1][1])
+        span = fstop - fstart
+        src_fstart = float(span) * left / nbins + fstart
+        src_fstop = float(span) * right / nbins + fstart
+        right = min(right, nbins)
+
+    src, dst = copy_bin_slices(src_fstart, src_fstop, right - left,
+        sweep_settings.bandstart, sweep_settings.bandstop,
+        sweep_settings.spectral_points)
+    if src.stop == src.start:
+        return BinPlacement(src, dst, flip)
+
+    # bin indices of the power spectrum before it is reversed
+    src_start_bin = src.start + left
+    src_stop_bin = src.stop + left
+    if flip:
+        src_start_bin, src_stop_bin = (nbins - src_stop_bin,
+            nbins - src_start_bin)
+    return BinPlacement(slice(src_start_bin, src_stop_bin),
+        dst, flip)
+
+
+def plan_sweep_placements(dev_properties, sweep_settings):
+    """
+    Return a dict of the :class:`BinPlacement` of every packet expected
+    from a sweep, keyed on (rffreq, spec_inv, nbins), with a rffreq of
+    *None* for the DD mode entry.  Both spectral inversions are included
+    because the plan doesn't know which one the RTSA will report.
+
+    :param dev_properties: the sweep device properties
+    :param sweep_settings: the sweep's plan
+    :type sweep_settings: SweepSettings
+    """
+    mode = sweep_settings.rfe_mode
+    spp = sweep_settings.spp
+    packets = []
+    if sweep_settings.dd_mode:
+        # DD captures are I only, with twice the samples in ZIF mode
+        if mode == 'ZIF':
+            spp = spp * 2
+        packets.append((None, spp // 2 + 1))
+    if sweep_settings.beyond_dd:
+        # the frequencies as sent to the RTSA by WSA.sweep_add, and the
+        # length of the real FFT of I only captures
+        if dev_properties.DEFAULT_SAMPLE_TYPE.get(mode) == I_ONLY:
+            nbins = sweep_settings.spp // 2 + 1
+        else:
+            nbins = sweep_settings.spp
+        fstep = int(sweep_settings.fstep)
+        steps = int(sweep_settings.step_count) - len(packets)
+        if sweep_settings.make_end_entry:
+            steps -= 1
+            end_freq = (sweep_settings.end_entry_freq
+                + round(sweep_settings.fstep / 2))
+            packets.append((int(end_freq), nbins))
+        packets.extend((int(sweep_settings.fstart) + i * fstep, nbins)
+            for i in range(steps))
+
+    placements = {}
+    for freq, nbins in packets:
+        for spec_inv in (False, True):
+            placements[freq, spec_inv, nbins] = plan_bin_placement(
+                dev_properties, sweep_settings, freq, spec_inv, nbins,
+                dd=freq is None)
+    return placements
+
+
+def _freeze(value):
+    """
+    Return a hashable copy of *value*, with dicts, lists and sets turned
+    into tuples and frozensets
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def _sweep_plan_key(fstart, fstop, rbw, mode, device_settings):
+    """
+    Return the key :class:`SweepDevice` keeps the plan of a sweep under,
+    or None if the device settings can't be hashed, in which case the
+    plan isn't kept.
+    """
+    try:
+        key = (fstart, fstop, rbw, mode, _freeze(device_settings or {}))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
 class SweepDevice(object):
     """
     Virtual device that generates power spectrum from a given frequency range
@@ -369,6 +559,30 @@ class SweepDevice(object):
                         typically a :class:`pyrf.devices.thinkrf.WSA` instance.
     :param async_callback: a callback to use for async operation (not used if
                      *real_device* is using a blocking :class:`PlainSocketConnector`)
+    :param str precision: 'double' or 'single' floating point precision
+                          for the FFTs and spectral data, see
+                          :func:`pyrf.numpy_util.compute_fft`
+    :param str correction_cache: a directory in which to keep the
+                                 correction vectors of each device, or
+                                 *None* to download them every time
+    :param int workers: the number of worker processes to compute FFTs
+                        in, or 0 to compute them as packets are received
+
+    With *correction_cache* set the correction vectors are saved to a
+    ``.npz`` file named after the device's :attr:`device_id` (model,
+    serial number and firmware version).  When the same device is used
+    again only the size of each vector is queried, and the vectors are
+    downloaded again if a size, the device id or the file format has
+    changed or the file can't be read.
+
+    With *workers* set, packets are sent to a pool of that many
+    processes as they are received, so the FFTs of a sweep are computed
+    on several cores while the next packets are read.  The spectra are
+    flattened and placed in the result in the order their packets were
+    received, so the results are the same as without workers.  Sending
+    each packet to a worker has a cost, so workers help most with large
+    packets, i.e. small RBWs.  Call :meth:`close` to stop the workers
+    when the device is no longer needed.
     """
     # keep track of the mode
     rfe_mode = None
@@ -402,7 +616,25 @@ class SweepDevice(object):
     nf_corr_obj = None
     _flattening_enabled = True
 
-    def __init__(self, real_device, async_callback=None):
+    #: the :class:`pyrf.detector.TraceDetector` set with
+    #: :meth:`set_detector`, or None
+    detector = None
+
+    #: the device timestamps in seconds of the first and last packets of
+    #: the last sweep returned, (None, None) before the first sweep
+    sweep_time = (None, None)
+
+    # the sweep id of a stopped continuous sweep whose packets may still
+    # be arriving
+    _stale_sweep_id = None
+    _last_sweep = None
+
+    # the plan key, iteration count and real_device.sweep_list_generation()
+    # of the sweep list last programmed on the device
+    _sweep_list_state = None
+
+    def __init__(self, real_device, async_callback=None, precision='double',
+            correction_cache=None, workers=0):
 
         # init log string
         self.logstr = ''
@@ -421,8 +653,9 @@ class SweepDevice(object):
         self._geo_callback_func = None
         self._geo_callback_data = None
 
-        # initialize the sweep planner
+        # initialize the sweep planner and the plans it has made
         self._sweep_planner = SweepPlanner(self.dev_properties)
+        self._plan_cache = OrderedDict()
 
         # make sure user passes async callback if the device has async connector
         if real_device.async_connector():
@@ -433,111 +666,207 @@ class SweepDevice(object):
             # disable receiving data until we are expecting it
             real_device.set_async_callback(None)
 
-            # Function to be called when async data is done capturing
-            def _save_correction_vector(data_buffer):
-                if data_buffer is None:
-                    return None
-                try:
-                    if data_buffer.v_type == "SIGNAL":
-                        self.sp_corr_obj = correction_vector()
-                        self.sp_corr_obj.buffer_to_vector(data_buffer.data_buffer)
-                    elif data_buffer.v_type == "NOISE":
-                        self.nf_corr_obj = correction_vector()
-                        self.nf_corr_obj.buffer_to_vector(data_buffer.data_buffer)
-                except AttributeError:
-                    if data_buffer.v_type == "SIGNAL":
-                        self.sp_corr_obj = None
-                    elif data_buffer.v_type == "NOISE":
-                        self.nf_corr_obj = None
+        else:
 
-            # function to catch the errback of the async code. Used to handle
-            # the case when we can get the correction vectors.
-            def _catch_timeout(failure):
-                failure.trap(IOError)
-                return None
+            # make sure user doesnt pass async callback if the connector uses blocking sockets
+            if async_callback:
+                raise SweepDeviceError(
+                    "async_callback not applicable for sync operation")
 
-            vector_obj = correction_vector_acquire()
-            vector_obj.dut = real_device
+        if precision not in PRECISION_DTYPES:
+            raise SweepDeviceError("unknown precision %r" % (precision,))
+        self.precision = precision
 
-            vector_obj1 = correction_vector_acquire()
-            vector_obj1.dut = real_device
+        # the worker processes FFTs are computed in and the results
+        # still to be placed, oldest first
+        self._pool = None
+        self._pending = deque()
+        if workers:
+            self._pool = multiprocessing.Pool(workers, _init_fft_worker,
+                (self.dev_properties, precision))
 
-            d1 = vector_obj.get_vector("NOISE")
-            d1.addCallback(_save_correction_vector)
-            d1.addErrback(_catch_timeout)
+        self.correction_cache = correction_cache
+        self._load_correction_vectors()
 
-            d2 = vector_obj1.get_vector("SIGNAL")
-            d2.addCallback(_save_correction_vector)
-            d2.addErrback(_catch_timeout)
+        self.async_callback = async_callback
+        self.continuous = False
 
-        else:
+        # init the sweep id
+        self._next_sweep_id = 0
 
-            # make sure user doesnt pass async callback if the connector uses blocking sockets
-            if async_callback:
-                raise SweepDeviceError(
-                    "async_callback not applicable for sync operation")
+        # init last finished (technically, it hasn't finished, but for our purposes, it has)
+        self._last_finished = True
 
-            def _get_correction(dut, v_type=None):
-                if v_type.upper() == "SIGNAL" or v_type.upper() == "NOISE":
-                    v_type = v_type.upper()
-                else:
-                    raise ValueError
+    def _load_correction_vectors(self):
+        """
+        Download the SIGNAL and NOISE correction vectors from the device,
+        or load them from the correction cache, works with blocking and
+        asynchronous connectors alike.
+        """
+        connector = self.real_device.connector
+        cached = self._read_correction_cache()
+        self._cache_results = {}
 
-                max_buf_size = 16*1024
-                offset = 0
-                bin_data = ""
+        for v_type in ("SIGNAL", "NOISE"):
+            gen = self._read_correction_data(v_type, cached.get(v_type))
+            if not self.real_device.async_connector():
                 try:
-                    signal_size = dut.correction_size(v_type)
+                    data = connector.sync_async(gen)
                 except (IOError, OSError):  # this will handle socket.error's
-                    raise ValueError
+                    data = None
+                self._save_correction_vector(v_type, data)
+                continue
+
+            # function to catch the errback of the async code. Used to handle
+            # the case when we can't get the correction vectors.
+            def _catch_timeout(err, v_type=v_type):
+                if not isinstance(err, IOError):
+                    raise err
+                self._save_correction_vector(v_type, None)
+
+            connector.add_callbacks(connector.sync_async(gen),
+                lambda data, v_type=v_type:
+                    self._save_correction_vector(v_type, data),
+                _catch_timeout)
+
+    def _read_correction_data(self, v_type, cached=None):
+        """
+        Generator for the connector's sync_async handler that reads
+        the raw correction vector data of *v_type* with pipelined chunk
+        queries.  Yields (size, data) where data is None when the device
+        has no correction data, or the *cached* (size, correction_vector)
+        if its size matches the device's.
+        """
+        max_buf_size = 16*1024
+        signal_size = yield self.real_device.correction_size(v_type)
 
-                # We have nothing to transfer
-                if signal_size == 0:
-                    return None
+        # We have nothing to transfer
+        if not signal_size:
+            yield (0, None)
+            return
 
-                # check to see if tere is more data than can be transfer in one
-                # go
-                if signal_size > max_buf_size:
-                    # if so transfer our max buffer size
-                    transfer_size = max_buf_size
-                else:
-                    # if not grab only what we need
-                    transfer_size = signal_size
-
-                # While we still have data remaining
-                while offset < signal_size:
-                    # get the data
-                    data_buffer = dut.correction_data(v_type, offset,
-                                                      transfer_size)
-                    # figure out how many bytes were transfered
-                    transfered = len(data_buffer)
-                    # append the data to the buffer of what we have allready
-                    # got
-                    bin_data = b"".join([bin_data, data_buffer])
-                    # increase the offset
-                    offset = offset + transfered
-                return bin_data
-
-            self.sp_corr_obj = correction_vector()
-            try:
-                self.sp_corr_obj.buffer_to_vector(_get_correction(self.real_device, "SIGNAL"))
-            except ValueError:
-                self.sp_corr_obj = None
+        if cached is not None and cached[0] == signal_size:
+            yield cached
+            return
 
-            self.nf_corr_obj = correction_vector()
+        # transfer at most our max buffer size at a time
+        transfer_size = min(signal_size, max_buf_size)
+
+        data_buffer = yield self.real_device.correction_data_many(v_type,
+            signal_size, transfer_size)
+        chunks = [data_buffer]
+        offset = len(data_buffer)
+        # read any data remaining one chunk at a time
+        while offset < signal_size:
+            data_buffer = yield self.real_device.correction_data(v_type,
+                offset, transfer_size)
+            if not data_buffer:
+                break
+            chunks.append(data_buffer)
+            offset += len(data_buffer)
+        yield (signal_size, b"".join(chunks))
+
+    def _save_correction_vector(self, v_type, data):
+        size, data_buffer = data if data is not None else (None, None)
+        if isinstance(data_buffer, correction_vector):
+            vector = data_buffer
+        else:
+            vector = correction_vector(PRECISION_DTYPES[self.precision])
             try:
-                self.nf_corr_obj.buffer_to_vector(_get_correction(self.real_device, "NOISE"))
+                vector.buffer_to_vector(data_buffer)
             except ValueError:
-                self.nf_corr_obj = None
+                vector = None
 
-        self.async_callback = async_callback
-        self.continuous = False
+        if v_type == "SIGNAL":
+            self.sp_corr_obj = vector
+        else:
+            self.nf_corr_obj = vector
 
-        # init the sweep id
-        self._next_sweep_id = 0
+        downloaded = data_buffer is not None and vector is not data_buffer
+        self._cache_results[v_type] = (size, vector, downloaded)
+        if len(self._cache_results) == 2:
+            self._write_correction_cache()
 
-        # init last finished (technically, it hasn't finished, but for our purposes, it has)
-        self._last_finished = True
+    def _correction_cache_file(self):
+        device_id = getattr(self.real_device, 'device_id', None)
+        if self.correction_cache is None or not device_id:
+            return None
+        name = re.sub(r'[^A-Za-z0-9.-]+', '_', device_id.strip())
+        return os.path.join(self.correction_cache, name + '.npz')
+
+    def _read_correction_cache(self):
+        """
+        Return a dict of the cached (size, correction_vector) for each
+        vector type, empty if there is no valid cache file.
+        """
+        filename = self._correction_cache_file()
+        if filename is None or not os.path.exists(filename):
+            return {}
+
+        cached = {}
+        try:
+            with np.load(filename) as arrays:
+                if (int(arrays['version']) != CORRECTION_CACHE_VERSION
+                        or str(arrays['device_id'])
+                        != self.real_device.device_id):
+                    raise ValueError("stale correction cache")
+                for v_type in ("SIGNAL", "NOISE"):
+                    size = int(arrays[v_type + '_size'])
+                    if not size:
+                        continue
+                    vector = correction_vector(
+                        PRECISION_DTYPES[self.precision])
+                    vector.set_arrays(dict((name,
+                        arrays[v_type + '_' + name]) for name in
+                        ('frequency_index', 'indexes', 'vectors')))
+                    cached[v_type] = (size, vector)
+        except (IOError, OSError, EOFError, KeyError, ValueError,
+                zipfile.BadZipfile):
+            self.log("ignoring correction cache %s" % filename)
+            return {}
+        return cached
+
+    def _write_correction_cache(self):
+        """
+        Save the vectors if any were downloaded and none failed.
+        """
+        filename = self._correction_cache_file()
+        results = self._cache_results
+        if (filename is None
+                or not any(downloaded for size, vector, downloaded
+                    in results.values())
+                or any(size is None or (size and vector is None)
+                    for size, vector, downloaded in results.values())):
+            return
+
+        arrays = {
+            'version': CORRECTION_CACHE_VERSION,
+            'device_id': np.array(self.real_device.device_id),
+            }
+        for v_type, (size, vector, downloaded) in results.items():
+            arrays[v_type + '_size'] = size
+            if vector is not None:
+                for name, value in vector.get_arrays().items():
+                    arrays[v_type + '_' + name] = value
+
+        # write a temporary file first so other processes never load
+        # a partial cache file
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.correction_cache):
+                os.makedirs(self.correction_cache)
+            with open(tmp_filename, 'wb') as f:
+                np.savez(f, **arrays)
+            try:
+                os.rename(tmp_filename, filename)
+            except OSError:
+                # windows won't rename over an existing file
+                os.remove(filename)
+                os.rename(tmp_filename, filename)
+        except (IOError, OSError):
+            self.log("unable to write correction cache %s" % filename)
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
 
     # Private function
     def log(self, firstmsg, *msgs):
@@ -564,6 +893,21 @@ class SweepDevice(object):
         else:
             self._flattening_enabled = enable
 
+    def set_detector(self, detector=None):
+        """
+        Combine the spectra of successive sweeps with *detector*, e.g. to
+        average or max-hold continuous sweeps.  The sweeps returned are
+        then the detector's trace, which is updated in place by the next
+        sweep.  The detector is reset when a sweep with different
+        arguments is started.
+
+        :param detector: a :class:`pyrf.detector.TraceDetector`, or None
+                         to return each sweep's spectrum
+        """
+        self.detector = detector
+        if detector is not None:
+            detector.reset()
+
     def set_geolocation_callback(self, func, data = None):
         """
         set a callback that will get called whenever the geolocation information
@@ -605,7 +949,20 @@ class SweepDevice(object):
         along with the **actual** sweep start and stop frequencies set (which
         might not be exactly the same as the requested *fstart* and *fstop*).
 
-        .. note:: This function does not pipeline, and if the last sweep isn't received before starting a new one, it will generate a failure.
+        .. note:: A single sweep does not pipeline, and if the last sweep isn't received before starting a new one, it will generate a failure.
+
+        With *continuous* set the sweep list is programmed once and the
+        RTSA repeats it without stopping.  With an async connector
+        *async_callback* is then called after every sweep.  With a
+        blocking connector the first spectrum is returned, and calling
+        this method again with the same arguments returns the next
+        sweep's spectrum without reprogramming or restarting the sweep.
+        Different arguments, a single sweep or :meth:`stop` end the
+        continuous sweep.
+
+        Continuous sweeps alternate between two spectral data arrays, so
+        a spectrum is overwritten while the sweep after the next one is
+        received; copy it to keep it longer than that.
 
         :param int fstart: sweep starting frequency in Hz
         :param int fstop: sweep ending frequency in Hz
@@ -620,9 +977,22 @@ class SweepDevice(object):
 
         self.log("- capture_power_spectrum", fstart, fstop, rbw, device_settings, mode, continuous)
 
-        if continuous and not self.async_callback:
-            raise SweepDeviceError(
-                "continuous mode only applies to async operation")
+        plan_key = _sweep_plan_key(fstart, fstop, rbw, mode, device_settings)
+        sweep = None
+        if plan_key is not None:
+            sweep = plan_key + (continuous,)
+        if self.continuous:
+            if sweep is not None and sweep == self._last_sweep:
+                # the sweep is already running
+                if self.async_callback:
+                    return
+                return self._read_sweep()
+            self.stop()
+
+        # a new trace for different sweeps
+        if self.detector is not None and (plan_key is None
+                or plan_key != (self._last_sweep or ())[:-1]):
+            self.detector.reset()
 
         # see if the last sweep has finished
         if not self._last_finished:
@@ -639,20 +1009,43 @@ class SweepDevice(object):
         # keep track if this is a continuous sweep
         self.continuous = continuous
 
-        # plan the sweep
-        self._sweep_planner = SweepPlanner(self.dev_properties)
-        self._sweep_settings = self._sweep_planner.plan_sweep(fstart, fstop, rbw, mode, device_settings)
+        # plan the sweep and its bin placements, or reuse the plan made
+        # for the same arguments
+        plan = None
+        if plan_key is not None:
+            plan = self._plan_cache.pop(plan_key, None)
+        if plan is None:
+            sweep_settings = self._sweep_planner.plan_sweep(
+                fstart, fstop, rbw, mode, device_settings or {})
+            plan = (sweep_settings,
+                plan_sweep_placements(self.dev_properties, sweep_settings))
+            if (plan_key is not None
+                    and len(self._plan_cache) >= PLAN_CACHE_SIZE):
+                self._plan_cache.popitem(last=False)
+        if plan_key is not None:
+            self._plan_cache[plan_key] = plan
+        self._sweep_settings, self._placements = plan
         self.log("self._sweep_settings = %s" % self._sweep_settings)
 
         # remember our last sweep for optimization purposes
-        self._last_sweep = (fstart, fstop, rbw, mode, device_settings, continuous)
-
-        # configure the device with the sweep_settings
-        self.real_device.sweep_clear()
-        self.real_device.sweep_add(self._sweep_settings)
-
-        # configure the iteration
-        self.real_device.sweep_iterations(1)
+        self._last_sweep = sweep
+
+        # configure the device with the sweep_settings, sending all of
+        # the sweep list commands in one write.  Skip whatever is
+        # already programmed on the device.
+        iterations = 0 if continuous else 1  # 0 repeats the sweep forever
+        state = self._sweep_list_state
+        if (state is None or plan_key is None or state[0] != plan_key
+                or state[2] != self.real_device.sweep_list_generation()):
+            state = None
+        with self.real_device.batch():
+            if state is None:
+                self.real_device.sweep_clear()
+                self.real_device.sweep_add(self._sweep_settings)
+            if state is None or state[1] != iterations:
+                self.real_device.sweep_iterations(iterations)
+        self._sweep_list_state = (plan_key, iterations,
+            self.real_device.sweep_list_generation())
 
         # capture the sweep data
         return self._perform_full_sweep()
@@ -671,6 +1064,9 @@ class SweepDevice(object):
 
         # perform sweep using blocking sockets
         self._start_sweep()
+        return self._read_sweep()
+
+    def _read_sweep(self):
         result = None
         while result is None:
             result = self._vrt_receive(self.real_device.read())
@@ -682,13 +1078,46 @@ class SweepDevice(object):
         self._vrt_context = {}
 
         # initialize the array we'll use to hold results
-        self.spectral_data = np.zeros(self._sweep_settings.spectral_points)
+        self.spectral_data = np.zeros(self._sweep_settings.spectral_points,
+            dtype=PRECISION_DTYPES[self.precision])
+        if self.continuous:
+            # the next sweep fills one array while the last is being used
+            self._spectral_buffers = [self.spectral_data,
+                np.zeros_like(self.spectral_data)]
 
         # keep track of packets recieved
         self.packet_count = 0
+        self._pending.clear()
 
         self.real_device.sweep_start(self._next_sweep_id)
 
+    def stop(self):
+        """
+        Stop a continuous sweep started with :meth:`capture_power_spectrum`,
+        or abandon a single sweep that hasn't finished, e.g. after an
+        error.  Packets of the stopped sweep that are still arriving are
+        ignored.
+        """
+        if self._last_finished and not self.continuous:
+            return
+        self.real_device.sweep_stop()
+        self._stale_sweep_id = self._next_sweep_id
+        self.continuous = False
+        self._last_finished = True
+        self._pending.clear()
+
+    def close(self):
+        """
+        Stop the worker processes, if any.  The device can still be
+        used afterwards, computing FFTs as packets are received.
+        """
+        if self._pool is None:
+            return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        self._pending.clear()
+
     def _vrt_receive(self, packet):
 
         # context packet just update our context dictionary
@@ -705,6 +1134,13 @@ class SweepDevice(object):
 
             self._vrt_context.update(packet.fields)
             self.log(packet)
+
+            # each pass through a continuous sweep list starts with the
+            # sweep id, start over after an incomplete pass
+            if self.continuous and 'sweepid' in packet.fields:
+                if self.packet_count:
+                    self.log("incomplete sweep, %d packets" % self.packet_count)
+                self.packet_count = 0
             return
 
         # check to see if we recieved our sweep ID
@@ -713,19 +1149,71 @@ class SweepDevice(object):
 
         # make sure we are receiving packets for the right sweep
         if not (self._vrt_context['sweepid'] == self._next_sweep_id):
+            if self._vrt_context['sweepid'] == self._stale_sweep_id:
+                return
             raise SweepDeviceError("data packets received before start of sweep received!  cur = %d, next = %d" % (self._vrt_context['sweepid'], self._next_sweep_id))
 
         # increment the packet count
         self.packet_count += 1
         self.log("#%d of %d - %s" % (self.packet_count, self._sweep_settings.step_count, packet))
 
-        # retrieve the frequency and usable BW of the packet
+        # keep the device time of the first and last packets
+        timestamp = packet.tsi + packet.tsf * 1e-12
+        if self.packet_count == 1:
+            self._sweep_start_time = timestamp
+        self._sweep_stop_time = timestamp
+
+        # retrieve the frequency of the packet
         packet_freq = self._vrt_context['rffreq']
-        usable_bw = self.dev_properties.USABLE_BW[self._sweep_settings.rfe_mode]
 
-        # compute the fft
-        pow_data = compute_fft(self.real_device, packet, self._vrt_context)
+        # DD mode is the first entry
+        dd = self.packet_count == 1 and self._sweep_settings.dd_mode
+        last = self.packet_count == self._sweep_settings.step_count
+
+        if self._pool is None:
+            # compute the fft
+            # spectral inversion is undone when the data is placed
+            pow_data = compute_fft(self.real_device, packet,
+                self._vrt_context, apply_spec_inv=False,
+                precision=self.precision)
+            self._place_data(pow_data, packet_freq, packet.spec_inv, dd)
+        else:
+            # compute the fft in a worker process, the results are placed
+            # in the order their packets were received
+            result = self._pool.apply_async(_fft_worker,
+                (packet, dict(self._vrt_context)))
+            self._pending.append((result, packet_freq, packet.spec_inv, dd))
+            self._place_pending(wait=last)
+
+        # if there's no more packets, emit result
+        if last:
+            return self._emit_data()
+
+        # all done
+        return
 
+    def _place_pending(self, wait=False):
+        """
+        Place the results of the worker processes that are ready, in the
+        order their packets were received, or all of them when *wait*
+        is set
+        """
+        stats = getattr(self.real_device, 'stats', None)
+        while self._pending:
+            result, packet_freq, spec_inv, dd = self._pending[0]
+            if not wait and not result.ready():
+                return
+            self._pending.popleft()
+            pow_data, elapsed = result.get()
+            if stats is not None:
+                stats.fft_time.record(elapsed)
+            self._place_data(pow_data, packet_freq, spec_inv, dd)
+
+    def _place_data(self, pow_data, packet_freq, spec_inv, dd):
+        """
+        Flatten the spectrum *pow_data* of a packet and place it in the
+        result array
+        """
         # calc rbw for this packet
         rbw = float(self.dev_properties.FULL_BW[self._sweep_settings.rfe_mode]) / len(pow_data)
         self.log("rbw = %f, %f" % (rbw, self._sweep_settings.rbw))
@@ -741,7 +1229,7 @@ class SweepDevice(object):
                                                                    number_of_points)
                 else:
                     # if no set it to 0
-                    nf_cal = np.zeros(number_of_points)
+                    nf_cal = np.zeros(number_of_points, dtype=pow_data.dtype)
 
                 # check if we have corrrection vectors (Spectrum)
                 if self.sp_corr_obj is not None:
@@ -751,13 +1239,10 @@ class SweepDevice(object):
                                                                    number_of_points)
                 else:
                     # if not set it to 0
-                    sp_cal = np.zeros(number_of_points)
-
-                # if the data is spectraly inverted, invert the vectors
-                if packet.spec_inv:
-                    nf_cal = np.flipud(nf_cal)
-                    sp_cal = np.flipud(sp_cal)
+                    sp_cal = np.zeros(number_of_points, dtype=pow_data.dtype)
 
+                # the data is not reversed yet when spectrally inverted,
+                # and neither are the vectors
                 # calculate the correction threshold
                 correction_thresh = (-135.0 + ((10.0 * packet_freq / 1e6)
                                                / 27000.0) + 10.0
@@ -766,134 +1251,53 @@ class SweepDevice(object):
                 # creat the spectrum. per bin, if the ampltitude is above
                 # correction threshold do pow_data - sp_cal else do pow_data -
                 # nf_cal
+                nf_cal = nf_cal.astype(pow_data.dtype, copy=False)
+                sp_cal = sp_cal.astype(pow_data.dtype, copy=False)
                 pow_data = np.where(pow_data < correction_thresh,
                                     pow_data - nf_cal, pow_data - sp_cal)
 
-        # check if DD mode was used in this sweep
-        if self.packet_count == 1 and self._sweep_settings.dd_mode:
-            # copy the data into the result array
-            self._copy_data(0, self.dev_properties.FULL_BW['DD'], pow_data, self._sweep_settings.bandstart, self._sweep_settings.bandstop, self.spectral_data);
-
-            if self._sweep_settings.beyond_dd:
-                return
-            else:
-                return self._emit_data()
-
-
-        # determine the usable bins in this config
-        self.log("===> compute_usable_bins()", self._sweep_settings.rfe_mode, self._sweep_settings.spp, 1, 0)
-        usable_bins = compute_usable_bins(self.dev_properties,
-                                          self._sweep_settings.rfe_mode,
-                                          self._sweep_settings.spp,
-                                          1,
-                                          0)
-        self.log("<--- usable_bins", usable_bins)
-
-        # adjust the usable range based on spectral inversion
-        self.log("===> adjust_usable_fstart_fstop()", "self.dev_properties", self._sweep_settings.rfe_mode, len(pow_data) * 2, 1, packet_freq, packet.spec_inv, usable_bins)
-        usable_bins, packet_start, packet_stop = adjust_usable_fstart_fstop(self.dev_properties,
-                                                              self._sweep_settings.rfe_mode,
-                                                              len(pow_data) * 2,
-                                                              1,
-                                                              packet_freq,
-                                                              packet.spec_inv,
-                                                              usable_bins)
-        self.log("<--- adjust_usable_fstart_fstop", packet_start, packet_stop, usable_bins)
-        #
-        # WARNING: the start and stop returned from this function are HIGHLY sketchy
-        #
-
-        # calculate packet frequency range
-        #packet_start = packet_freq - (self.dev_properties.FULL_BW[self._sweep_settings.rfe_mode] / 2)
-        #packet_stop = packet_freq + (self.dev_properties.FULL_BW[self._sweep_settings.rfe_mode] / 2)
-        #print "packet start/stop", packet_start, packet_stop
-
-        #trim the FFT data, note decimation is 1, fshift is 0
-        self.log("===> trim_to_usable_fstart_fstop()", "pow_data", usable_bins, packet_start, packet_stop)
-        trimmed_spectrum, edge_data, usable_start, usable_stop = trim_to_usable_fstart_fstop(pow_data,
-                                                                                 usable_bins,
-                                                                                 packet_start,
-                                                                                 packet_stop)
-        self.log("<--- trim_to_usable_fstart_fstop", usable_start, usable_stop, "trimmed_spectrum", edge_data)
-
-        # copy the data
-        self._copy_data(usable_start, usable_stop, trimmed_spectrum, self._sweep_settings.bandstart, self._sweep_settings.bandstop, self.spectral_data);
-
-        # if there's no more packets, emit result
-        if self.packet_count == self._sweep_settings.step_count:
-            return self._emit_data()
-
-        # all done
-        return
+        # place the data in the result array
+        place = self._bin_placement(packet_freq, spec_inv, len(pow_data), dd)
+        self.log("spectral_data[%s] = pow_data[%s]" % (place.dst, place.src))
+        if place.flip:
+            self.spectral_data[place.dst] = pow_data[place.src][::-1]
+        else:
+            self.spectral_data[place.dst] = pow_data[place.src]
 
 
     def _emit_data(self):
 
         # note that we finished this sweep
         self._last_finished = True
+        self.sweep_time = (self._sweep_start_time, self._sweep_stop_time)
+
+        spectral_data = self.spectral_data
+        if self.detector is not None:
+            spectral_data = self.detector.add(spectral_data)
+        if self.continuous:
+            # switch buffers for the next pass of the sweep list, each
+            # pass writes the same bins so there is no need to clear it
+            self._spectral_buffers.reverse()
+            self.spectral_data = self._spectral_buffers[0]
+            self.packet_count = 0
 
         # if async callback is available, emit the data
         if self.async_callback:
 
-            self.async_callback(self._sweep_settings.bandstart, self._sweep_settings.bandstop, self.spectral_data)
+            self.async_callback(self._sweep_settings.bandstart, self._sweep_settings.bandstop, spectral_data)
             return
         # return the values if using blocking sockets
         else:
-            return (self._sweep_settings.bandstart, self._sweep_settings.bandstop, self.spectral_data)
-
-
-    def _copy_data(self, src_fstart, src_fstop, src_psd, dst_fstart, dst_fstop, dst_psd):
-        self.log("_copy_data(%d, %d, src_psd, %d, %d, dst_psd)" % (src_fstart, src_fstop, dst_fstart, dst_fstop))
-
-        # calc src len and dst len
-        srclen = len(src_psd)
-        dstlen = len(dst_psd)
-        self.log("len -- src = %d, dst = %d" % (srclen, dstlen))
-
-        # calc src and dest rbw
-        srcrbw = float(src_fstop - src_fstart) / srclen
-        dstrbw = float(dst_fstop - dst_fstart) / dstlen
-        self.log("rbw = %f, %f, %f" % (srcrbw, dstrbw, self._sweep_settings.rbw))
-
-        # check if packet start is before sweep start.  shouldn't happen, but check anyway
-        self.log("boundary(start) = %f / %f" % (src_fstart, dst_fstart))
-        if src_fstart < dst_fstart:
-            self.log("foo")
-            src_start_bin = int(float(dst_fstart - src_fstart) / srcrbw)
-        else:
-            self.log("bar")
-            src_start_bin = 0
-
-        # check if packet stop is after sweep stop.  this means we don't need the whole packet
-        self.log("boundary(stop) = %f / %f" % (src_fstop, dst_fstop))
-        if src_fstop > dst_fstop:
-            self.log("foo")
-            src_stop_bin = srclen - int(float(src_fstop - dst_fstop) / srcrbw)
-        else:
-            self.log("bar")
-            src_stop_bin = srclen
-
-        # how many values are we copying?
-        tocopy = src_stop_bin - src_start_bin
-
-        # calculate dest start index
-        if src_fstart < dst_fstart:
-            dst_start_bin = 0
-        else:
-            dst_start_bin = int(round(float(src_fstart - dst_fstart) / dstrbw))
-
-        # calculate dest stop index
-        dst_stop_bin = dst_start_bin + tocopy
-        if dst_stop_bin > dstlen:
-            dst_stop_bin = dstlen
-
-            # adjust tocopy
-            tocopy = dst_stop_bin - dst_start_bin
-
-            # adjust src stop bin because we adjusted tocopy
-            src_stop_bin = src_start_bin + tocopy
-
-        # copy the data, if there's data that needs copying
-        if ((dst_stop_bin - dst_start_bin) > 0) and ((src_stop_bin - src_start_bin) > 0):
-            self.log("dst_psd[%d:%d] = src_psd[%d:%d]" % (dst_start_bin, dst_stop_bin, src_start_bin, src_stop_bin))
-            dst_psd[dst_start_bin:dst_stop_bin] = src_psd[src_start_bin:src_stop_bin]
+            return (self._sweep_settings.bandstart, self._sweep_settings.bandstop, spectral_data)
+
+
+    def _bin_placement(self, freq, spec_inv, nbins, dd):
+        key = (None if dd else freq, bool(spec_inv), nbins)
+        place = self._placements.get(key)
+        if place is None:
+            # a frequency the plan didn't expect, keep a few of them
+            place = plan_bin_placement(self.dev_properties,
+                self._sweep_settings, freq, spec_inv, nbins, dd)
+            if len(self._placements) < 4 * (self._sweep_settings.step_count + 1):
+                self._placements[key] = place
+        return place
@@ -0,0 +1,35 @@
+import json
+import unittest
+
+from pyrf.benchmark import (run_benchmarks, compare_results, measure,
+    BenchmarkError)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_measure(self):
+        calls = []
+        number, seconds = measure(lambda: calls.append(1), 0.001, 2)
+        self.assertTrue(number >= 1)
+        self.assertTrue(len(calls) >= number * 2)
+        self.assertTrue(seconds > 0)
+
+    def test_run_and_compare(self):
+        report = run_benchmarks(['vrt_packet_reader'], 0.001, 1)
+        report = json.loads(json.dumps(report))
+        self.assertEqual(report['version'], 1)
+        results = report['results']
+        self.assertEqual(len(results), 8)
+        self.assertEqual(results[0]['params'],
+            {'stream_id': '0x90000003', 'spp': 1024})
+        self.assertEqual(results[0]['unit'], 'packets/s')
+
+        old = json.loads(json.dumps(report))
+        for result in old['results']:
+            result['rate'] /= 2
+        old['results'].pop()
+        comparison = compare_results(old, report)
+        self.assertEqual(len(comparison), 7)
+        self.assertAlmostEqual(comparison[0][1], 2)
+
+    def test_unknown_benchmark(self):
+        self.assertRaises(BenchmarkError, run_benchmarks, ['fastest'])
@@ -0,0 +1,303 @@
+import socket
+import threading
+import unittest
+
+import numpy as np
+
+from twisted.internet.task import Clock
+try:
+    from twisted.internet.testing import StringTransport
+except ImportError:
+    from twisted.test.proto_helpers import StringTransport
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from pyrf.connectors.base import ChunkBuffer
+from pyrf.connectors.blocking import PlainSocketConnector, socketread_into
+from pyrf.connectors.twisted_async import (SCPIClient, TwistedConnector,
+    VRTClient)
+from pyrf.stats import ConnectionStats
+from pyrf.vrt import (vrt_packet_reader, generate_data_packet,
+    VRT_IFDATA_I14)
+
+
+class TestPlainSocketConnector(unittest.TestCase):
+    def setUp(self):
+        self.connector = PlainSocketConnector()
+        self.connector._sock_scpi, self.device = socket.socketpair()
+        self.received = b''
+
+    def tearDown(self):
+        self.connector._sock_scpi.close()
+        self.device.close()
+
+    def answer(self, queries):
+        """
+        read *queries* lines on the device side, then answer each with
+        its line number
+        """
+        while self.received.count(b'\n') < queries:
+            self.received += self.device.recv(65536)
+        self.device.sendall(b''.join(b'%d\n' % n for n in range(queries)))
+
+    def test_scpiget_many(self):
+        queries = 20000
+        device = threading.Thread(target=self.answer, args=(queries,))
+        device.start()
+        responses = self.connector.scpiget_many(
+            [':SENSE:FREQ:CENTER?'] * queries)
+        device.join()
+        self.assertEqual(self.received,
+            b':SENSE:FREQ:CENTER?\n' * queries)
+        self.assertEqual(responses,
+            [b'%d\n' % n for n in range(queries)])
+
+    def test_scpiset(self):
+        self.connector.scpiset('*RST')
+        self.assertEqual(self.device.recv(100), b'*RST\n')
+
+
+class ChunkedSocket(object):
+    """
+    A socket that receives *data* at most *chunk* bytes at a time
+    """
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+        self.calls = 0
+
+    def recv_into(self, view, count, flags=0):
+        self.calls += 1
+        n = min(count, self.chunk, len(self.data))
+        view[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+class TestRecvBuffer(unittest.TestCase):
+    def setUp(self):
+        self.connector = PlainSocketConnector(recv_buffer_size=10)
+        self.connector._sock_vrt, self.device = socket.socketpair()
+
+    def tearDown(self):
+        self.connector._sock_vrt.close()
+        self.device.close()
+
+    def test_partial_reads(self):
+        sock = ChunkedSocket(b'0123456789', 3)
+        view = memoryview(bytearray(10))
+        self.assertTrue(socketread_into(sock, view, 8))
+        self.assertEqual(view[:8].tobytes(), b'01234567')
+        self.assertEqual(sock.calls, 3)
+        self.assertFalse(socketread_into(sock, view, 8))
+
+    def test_views_and_wrap(self):
+        self.device.sendall(b'aaaabbbbccccdddddddddddd')
+        first = self.connector.raw_read(4)
+        second = self.connector.raw_read(4)
+        self.assertTrue(isinstance(first, memoryview))
+        self.assertEqual((first.tobytes(), second.tobytes()),
+            (b'aaaa', b'bbbb'))
+        # the buffer wraps, overwriting the first view
+        third = self.connector.raw_read(4)
+        self.assertEqual(third.tobytes(), b'cccc')
+        self.assertEqual(first.tobytes(), b'cccc')
+        self.assertEqual(second.tobytes(), b'bbbb')
+        # larger than the buffer, read into new bytes
+        self.assertEqual(self.connector.raw_read(12), b'd' * 12)
+
+    def test_packets(self):
+        connector = PlainSocketConnector(recv_buffer_size=1000)
+        connector._sock_vrt = self.connector._sock_vrt
+        samples = [np.arange(n * 100, n * 100 + 100) for n in range(5)]
+        data = b''.join(generate_data_packet(VRT_IFDATA_I14, s, n)[0]
+            for n, s in enumerate(samples))
+        sender = threading.Thread(target=self.send_slowly, args=(data, 7))
+        sender.start()
+        for n, s in enumerate(samples):
+            packet = connector.sync_async(vrt_packet_reader(
+                connector.raw_read, connector.stats))
+            self.assertEqual(packet.count, n)
+            np.testing.assert_array_equal(packet.data.numpy_array(), s)
+        sender.join()
+        self.assertEqual(connector.stats.data_packets, 5)
+
+    def send_slowly(self, data, chunk):
+        for i in range(0, len(data), chunk):
+            self.device.sendall(data[i:i + chunk])
+
+    def test_closed_mid_packet(self):
+        self.device.sendall(b'abc')
+        self.device.close()
+        self.assertEqual(self.connector.raw_read(6), False)
+
+
+class TestChunkBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buf = ChunkBuffer()
+        for chunk in (b'abc', b'', b'defg', b'h', b'ijkl'):
+            self.buf.append(chunk)
+
+    def test_partial_availability(self):
+        self.assertEqual(len(self.buf), 12)
+        self.assertEqual(self.buf.consume(13), None)
+        self.assertEqual(len(self.buf), 12)
+        self.assertEqual(self.buf.consume(0).tobytes(), b'')
+
+    def test_within_chunk(self):
+        self.assertEqual(self.buf.consume(2).tobytes(), b'ab')
+        self.assertEqual(self.buf.consume(1).tobytes(), b'c')
+        self.assertEqual(self.buf.consume(4).tobytes(), b'defg')
+        self.assertEqual(len(self.buf), 5)
+
+    def test_spanning_chunks(self):
+        self.assertEqual(self.buf.consume(1).tobytes(), b'a')
+        self.assertEqual(self.buf.consume(8).tobytes(), b'bcdefghi')
+        self.assertEqual(self.buf.consume(4), None)
+        self.assertEqual(self.buf.consume(3).tobytes(), b'jkl')
+        self.assertEqual(len(self.buf), 0)
+        self.assertEqual(self.buf.consume(1), None)
+
+    def test_consumed_chunks_released(self):
+        self.buf.consume(7)
+        self.assertEqual(list(self.buf._chunks), [b'h', b'ijkl'])
+        self.buf.consume(2)
+        self.assertEqual(list(self.buf._chunks), [b'ijkl'])
+        self.assertEqual(self.buf._offset, 1)
+        self.buf.consume(3)
+        self.assertEqual(len(self.buf._chunks), 0)
+        self.assertEqual(self.buf._offset, 0)
+        self.buf.append(b'mn')
+        self.assertEqual(self.buf.consume(2).tobytes(), b'mn')
+
+
+class TestVRTClient(unittest.TestCase):
+    def setUp(self):
+        self.samples = [np.arange(n * 300, n * 300 + 300) for n in range(4)]
+        self.data = b''.join(generate_data_packet(VRT_IFDATA_I14, s, n)[0]
+            for n, s in enumerate(self.samples))
+        self.packets = []
+        self.stats = ConnectionStats()
+        self.client = VRTClient(self.packets.append, self.stats)
+        self.client.makeConnection(TCPStringTransport())
+
+    def check_packets(self):
+        self.assertEqual(len(self.packets), len(self.samples))
+        for n, (packet, s) in enumerate(zip(self.packets, self.samples)):
+            self.assertEqual(packet.count, n % 4)
+            np.testing.assert_array_equal(packet.data.numpy_array(), s)
+        self.assertEqual(self.stats.data_packets, len(self.samples))
+        self.assertEqual(self.client._bufLength(), 0)
+
+    def test_one_byte_at_a_time(self):
+        for i in range(len(self.data)):
+            self.client.dataReceived(self.data[i:i + 1])
+        self.check_packets()
+
+    def test_large_slabs(self):
+        self.client.dataReceived(self.data[:1000])
+        self.client.dataReceived(self.data[1000:])
+        self.check_packets()
+
+    def test_slabs_across_packets(self):
+        # each slab ends part way into a packet header
+        self.samples = self.samples * 2
+        data = self.data * 2
+        self.client.dataReceived(data[:len(self.data) + 10])
+        self.assertEqual(len(self.packets), 4)
+        self.client.dataReceived(data[len(self.data) + 10:])
+        self.check_packets()
+
+
+class TCPStringTransport(StringTransport):
+    def setTcpNoDelay(self, enabled):
+        pass
+
+
+class TestSCPIClient(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.client = SCPIClient(2)
+        self.client.callLater = self.clock.callLater
+        self.transport = TCPStringTransport()
+        self.client.makeConnection(self.transport)
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_pipelined_responses(self):
+        first = self.results(self.client.scpiget(b'A?\n'))
+        second = self.results(self.client.scpiget(b'B?\n'))
+        self.assertEqual(self.transport.value(), b'A?\nB?\n')
+        self.client.dataReceived(b'1\n2')
+        self.client.dataReceived(b'\n')
+        self.assertEqual((first, second), ([b'1\n'], [b'2\n']))
+
+    def test_timeout_fails_all_queries(self):
+        results = [self.results(self.client.scpiget(cmd))
+            for cmd in (b'A?\n', b'B?\n', b'C?\n')]
+        self.clock.advance(3)
+        for result in results:
+            self.assertTrue(result[0].check(IOError))
+        self.assertTrue(self.transport.disconnecting)
+        # late responses aren't matched to later queries
+        self.client.dataReceived(b'1\n')
+        later = self.results(self.client.scpiget(b'D?\n'))
+        self.assertTrue(later[0].check(IOError))
+        self.assertEqual(self.transport.value(), b'A?\nB?\nC?\n')
+
+    def test_connector_commands(self):
+        connector = TwistedConnector(None)
+        connector._scpi = self.client
+        connector.scpiset(':*RST')
+        responses = self.results(connector.scpiget_many(['A?', 'B?']))
+        response = self.results(connector.scpiget(':*IDN?'))
+        self.assertEqual(self.transport.value(),
+            b':*RST\nA?\nB?\n:*IDN?\n')
+        self.client.dataReceived(b'1\n2\nThinkRF\n')
+        self.assertEqual(responses, [[b'1\n', b'2\n']])
+        self.assertEqual(response, [b'ThinkRF\n'])
+
+
+@unittest.skipIf(asyncio is None, "asyncio not available")
+class TestSCPIProtocol(unittest.TestCase):
+    def setUp(self):
+        from pyrf.connectors.asyncio_async import SCPIProtocol
+        self.loop = asyncio.new_event_loop()
+        self.protocol = SCPIProtocol(self.loop, 2)
+        self.written = []
+        self.closed = []
+        transport = type('Transport', (object,), {
+            'write': lambda transport, data: self.written.append(data),
+            'close': lambda transport: self.closed.append(True)})
+        self.protocol.connection_made(transport())
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_responses_are_bytes(self):
+        first = self.protocol.scpiget('A?\n')
+        second = self.protocol.scpiget('B?\n')
+        self.assertEqual(self.written, [b'A?\n', b'B?\n'])
+        self.protocol.data_received(b'1\n#15abcde\n')
+        self.assertEqual(first.result(), b'1\n')
+        self.assertEqual(second.result(), b'abcde')
+
+    def test_timeout_fails_all_queries(self):
+        protocol = self.protocol
+        protocol.timeout = 0.01
+        futures = [protocol.scpiget(cmd) for cmd in ('A?\n', 'B?\n')]
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        for future in futures:
+            self.assertTrue(isinstance(future.exception(), IOError))
+        self.assertEqual(self.closed, [True])
+        # late responses aren't matched to later queries
+        protocol.data_received(b'1\n')
+        later = protocol.scpiget('C?\n')
+        self.assertTrue(isinstance(later.exception(), IOError))
+        self.assertEqual(self.written, [b'A?\n', b'B?\n'])
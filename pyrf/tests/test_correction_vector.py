@@ -0,0 +1,238 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import pyrf.sweep_device
+from pyrf.devices.thinkrf import WSA
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import (SweepDevice, correction_vector,
+    RESAMPLE_CACHE_SIZE)
+
+
+def correction_buffer(frequency_index, vectors):
+    """
+    Return the RTSA correction data for a list of [freq in kHz, index]
+    pairs and a dict of vectors in dB keyed by index
+    """
+    size = len(next(iter(vectors.values())))
+    data = [struct.pack("!HHHH", 1, len(frequency_index), len(vectors),
+        size), b'\0' * 40]
+    data.extend(struct.pack("!LH", freq, index)
+        for freq, index in frequency_index)
+    for index, vector in sorted(vectors.items()):
+        data.append(struct.pack(">H", index))
+        data.append(np.round(np.asarray(vector) * 1e6).astype('>i4')
+            .tobytes())
+    return b''.join(data)
+
+
+class CorrectionConnector(SimulatorConnector):
+    """
+    A simulator connector that answers the correction data queries and
+    counts the data read queries
+    """
+    def __init__(self, simulator, correction):
+        super(CorrectionConnector, self).__init__(simulator)
+        self.correction = correction
+        self.reads = 0
+
+    def scpiget_many(self, cmds):
+        responses = []
+        for cmd in cmds:
+            if not cmd.startswith(':DATA:CORRECTION:'):
+                responses.extend(
+                    super(CorrectionConnector, self).scpiget_many([cmd]))
+                continue
+            v_type, query = cmd.split(':')[3:5]
+            data = self.correction[v_type]
+            if query == 'SIZE?':
+                responses.append('%d\n' % len(data))
+            else:
+                self.reads += 1
+                offset, length = (int(n) for n in query.split()[1].split(','))
+                responses.append(data[offset:offset + length])
+        return responses
+
+
+SIGNAL_INDEX = [[100000, 0], [2000000, 1], [8000000, 2]]
+SIGNAL_VECTORS = {
+    0: np.linspace(-1, 1, 64),
+    1: np.linspace(2, 3, 64),
+    2: np.sin(np.arange(64)),
+    }
+NOISE_INDEX = [[1000000, 0]]
+NOISE_VECTORS = {0: np.linspace(5, 6, 64)}
+
+
+class TestCorrectionCache(unittest.TestCase):
+    def setUp(self):
+        # the signal correction data is read in two chunks
+        self.correction = {
+            'SIGNAL': correction_buffer(SIGNAL_INDEX * 1000, SIGNAL_VECTORS),
+            'NOISE': correction_buffer(NOISE_INDEX, NOISE_VECTORS),
+            }
+        self.dut = WSA(CorrectionConnector(RTSASimulator(),
+            self.correction))
+        self.dut.connect('simulator')
+        self.connector = self.dut.connector
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache)
+
+    def sweep_device(self, cache=None):
+        self.connector.reads = 0
+        return SweepDevice(self.dut, correction_cache=cache or self.cache)
+
+    def check_vectors(self, sd):
+        self.assertEqual(sd.sp_corr_obj.frequency_index, SIGNAL_INDEX * 1000)
+        np.testing.assert_allclose(
+            sd.sp_corr_obj.get_correction_vector(2e9, 64), SIGNAL_VECTORS[1],
+            atol=1e-6)
+        np.testing.assert_allclose(
+            sd.nf_corr_obj.get_correction_vector(0, 64), NOISE_VECTORS[0],
+            atol=1e-6)
+
+    def test_write_then_read(self):
+        sd = self.sweep_device()
+        self.assertEqual(self.connector.reads, 3)
+        filename = sd._correction_cache_file()
+        self.assertEqual(os.listdir(self.cache),
+            [os.path.basename(filename)])
+        self.check_vectors(sd)
+
+        sd = self.sweep_device()
+        self.assertEqual(self.connector.reads, 0)
+        self.check_vectors(sd)
+
+    def test_size_changed(self):
+        self.sweep_device()
+        self.correction['NOISE'] = correction_buffer(NOISE_INDEX * 2,
+            NOISE_VECTORS)
+        sd = self.sweep_device()
+        self.assertEqual(self.connector.reads, 1)
+        self.assertEqual(sd.nf_corr_obj.frequency_index, NOISE_INDEX * 2)
+        self.check_vectors(sd)
+        self.assertEqual(self.sweep_device().nf_corr_obj.frequency_index,
+            NOISE_INDEX * 2)
+        self.assertEqual(self.connector.reads, 0)
+
+    def rewrite_cache(self, sd, **changes):
+        filename = sd._correction_cache_file()
+        with np.load(filename) as arrays:
+            arrays = dict(arrays)
+        arrays.update(changes)
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def test_version_mismatch(self):
+        sd = self.sweep_device()
+        self.rewrite_cache(sd,
+            version=pyrf.sweep_device.CORRECTION_CACHE_VERSION + 1)
+        self.check_vectors(self.sweep_device())
+        self.assertEqual(self.connector.reads, 3)
+        # the cache was rewritten
+        self.sweep_device()
+        self.assertEqual(self.connector.reads, 0)
+
+    def test_device_id_mismatch(self):
+        sd = self.sweep_device()
+        self.rewrite_cache(sd, device_id=np.array('ThinkRF,R5500,0,1'))
+        self.check_vectors(self.sweep_device())
+        self.assertEqual(self.connector.reads, 3)
+
+    def test_corrupt_cache(self):
+        sd = self.sweep_device()
+        filename = sd._correction_cache_file()
+        for data in (b'', b'PK\x03\x04 not a zip file'):
+            with open(filename, 'wb') as f:
+                f.write(data)
+            self.check_vectors(self.sweep_device())
+            self.assertEqual(self.connector.reads, 3)
+
+        # fewer vectors than indexes
+        self.sweep_device()
+        self.rewrite_cache(sd, SIGNAL_vectors=np.zeros((2, 64)))
+        self.check_vectors(self.sweep_device())
+        self.assertEqual(self.connector.reads, 3)
+
+    def test_unwritable_cache(self):
+        # a file where the cache directory should be
+        cache = os.path.join(self.cache, 'file')
+        with open(cache, 'w') as f:
+            f.write('not a directory')
+        self.check_vectors(self.sweep_device(cache))
+        self.assertEqual(self.connector.reads, 3)
+        self.check_vectors(self.sweep_device(cache))
+        self.assertEqual(self.connector.reads, 3)
+        self.assertEqual(os.listdir(self.cache), ['file'])
+
+    def test_no_device_id(self):
+        self.dut.device_id = ''
+        sd = self.sweep_device()
+        self.assertEqual(sd._correction_cache_file(), None)
+        self.assertEqual(os.listdir(self.cache), [])
+
+
+def old_correction_vector(vector, freq, number_of_points):
+    """
+    The binary search and interpolation correction_vector used before
+    frequencies were looked up with searchsorted, for comparison
+    """
+    frequency_index = vector.frequency_index
+    lo = 0
+    hi = len(frequency_index)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if frequency_index[mid][0] * 1e3 < freq:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo == len(frequency_index):
+        lo = lo - 1
+    micro_db = np.round(
+        vector.correction_vectors[frequency_index[lo][1]] * 1e6)
+    x = np.arange(0.0, vector.vector_size, 1.0)
+    z = np.linspace(0.0, vector.vector_size - 1, number_of_points)
+    return np.interp(z, x, micro_db / 1000000.0)
+
+
+class TestGetCorrectionVector(unittest.TestCase):
+    def setUp(self):
+        self.vector = correction_vector()
+        self.vector.buffer_to_vector(correction_buffer(SIGNAL_INDEX,
+            SIGNAL_VECTORS))
+
+    def test_matches_binary_search(self):
+        for freq in (0, 50e6, 100e6, 100e6 + 1, 1e9, 2e9, 2e9 - 1,
+                5e9, 8e9, 8e9 + 1, 20e9):
+            for points in (64, 10, 1000, 1):
+                np.testing.assert_allclose(
+                    self.vector.get_correction_vector(freq, points),
+                    old_correction_vector(self.vector, freq, points),
+                    rtol=0, atol=1e-12)
+
+    def test_resampled_cache(self):
+        first = self.vector.get_correction_vector(1e9, 100)
+        self.assertTrue(self.vector.get_correction_vector(2e9, 100) is first)
+        self.assertFalse(first.flags.writeable)
+        for points in range(RESAMPLE_CACHE_SIZE):
+            self.vector.get_correction_vector(8e9, points + 1)
+        self.assertEqual(len(self.vector._resampled), RESAMPLE_CACHE_SIZE)
+        # the least recently used vector was dropped
+        self.assertFalse((1, 100) in self.vector._resampled)
+        again = self.vector.get_correction_vector(1e9, 100)
+        self.assertFalse(again is first)
+        np.testing.assert_array_equal(again, first)
+
+    def test_arrays(self):
+        vector = correction_vector(np.float32)
+        vector.set_arrays(self.vector.get_arrays())
+        self.assertEqual(vector.frequency_index, SIGNAL_INDEX)
+        for freq in (0, 2e9, 20e9):
+            result = vector.get_correction_vector(freq, 100)
+            self.assertEqual(result.dtype, np.float32)
+            np.testing.assert_allclose(result,
+                old_correction_vector(self.vector, freq, 100), atol=1e-6)
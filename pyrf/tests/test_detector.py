@@ -0,0 +1,118 @@
+import unittest
+
+import numpy as np
+
+from pyrf.detector import TraceDetector, TraceDetectorError
+from pyrf.devices.thinkrf import WSA
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import SweepDevice
+from pyrf.util import capture_spectrum
+
+
+class ReusedBufferConnector(SimulatorConnector):
+    """
+    Return VRT data as slices of a small reused buffer, like
+    PlainSocketConnector with recv_buffer_size
+    """
+    def __init__(self, simulator, size=4096):
+        super(ReusedBufferConnector, self).__init__(simulator)
+        self._recv_buf = memoryview(bytearray(size))
+        self._recv_pos = 0
+
+    def raw_read(self, num):
+        data = super(ReusedBufferConnector, self).raw_read(num)
+        if self._recv_pos + num > len(self._recv_buf):
+            self._recv_pos = 0
+        view = self._recv_buf[self._recv_pos:self._recv_pos + num]
+        view[:] = data
+        self._recv_pos += num
+        return view
+
+
+class TestTraceDetector(unittest.TestCase):
+    def test_average_power(self):
+        det = TraceDetector()
+        trace = det.add(np.array([-10.0, -20.0]))
+        self.assertTrue(det.add(np.array([-20.0, -20.0])) is trace)
+        np.testing.assert_allclose(trace,
+            [10 * np.log10((0.1 + 0.01) / 2), -20])
+        self.assertEqual(det.traces, 2)
+        det.reset()
+        np.testing.assert_allclose(det.add(np.array([-30.0, -40.0])),
+            [-30, -40])
+
+    def test_exponential(self):
+        det = TraceDetector('exponential', count=2)
+        for level in (0.0, 0.0, 10.0):
+            trace = det.add(np.array([level]))
+        np.testing.assert_allclose(trace, [10 * np.log10(5.5)])
+
+    def test_hold(self):
+        spectra = [np.array([1.0, 5.0, 3.0]), np.array([4.0, 2.0, 3.0])]
+        for mode, expected in [('max_hold', [4, 5, 3]),
+                ('min_hold', [1, 2, 3])]:
+            det = TraceDetector(mode, dtype=np.float32)
+            for spectrum in spectra:
+                trace = det.add(spectrum)
+            self.assertEqual(trace.dtype, np.float32)
+            self.assertEqual(trace.tolist(), expected)
+
+    def test_new_size(self):
+        det = TraceDetector('max_hold')
+        det.add(np.zeros(4))
+        self.assertEqual(det.add(np.ones(2)).tolist(), [1, 1])
+        self.assertEqual(det.traces, 1)
+
+    def test_invalid(self):
+        self.assertRaises(TraceDetectorError, TraceDetector, 'peak')
+        self.assertRaises(TraceDetectorError, TraceDetector, 'exponential',
+            count=0)
+
+
+class TestDetectorUse(unittest.TestCase):
+    def setUp(self):
+        self.dut = self.simulator_wsa(SimulatorConnector)
+
+    def simulator_wsa(self, connector):
+        dut = WSA(connector(RTSASimulator(
+            tones=[(2450e6, -30)], noise_level=-100)))
+        dut.connect('simulator')
+        return dut
+
+    def test_sweep_device(self):
+        sd = SweepDevice(self.dut)
+        det = TraceDetector('max_hold')
+        sd.set_detector(det)
+        single = [sd.capture_power_spectrum(2300e6, 2600e6, 100e3)[2].copy()
+            for i in range(3)]
+        self.assertEqual(det.traces, 3)
+        np.testing.assert_array_equal(det.trace,
+            np.max(single, axis=0))
+
+        sd.capture_power_spectrum(2300e6, 2600e6, 100e3, continuous=True)
+        self.assertEqual(det.traces, 4)
+        sd.capture_power_spectrum(2300e6, 2600e6, 100e3, continuous=True)
+        self.assertEqual(det.traces, 5)
+        sd.capture_power_spectrum(2000e6, 2600e6, 100e3, continuous=True)
+        self.assertEqual(det.traces, 1)
+        sd.stop()
+
+    def test_capture_spectrum(self):
+        self.dut.rfe_mode('SH')
+        self.dut.freq(2440e6)
+        fstart, fstop, pow_data = capture_spectrum(self.dut, 100e3,
+            average=4)
+        self.assertAlmostEqual(pow_data.max(), -30, delta=2)
+        # the average power of noise is above its average in dB
+        floor = np.median(pow_data)
+        self.assertTrue(-101 < floor < -97, floor)
+
+    def test_capture_spectrum_reused_buffer(self):
+        results = []
+        for connector in (SimulatorConnector, ReusedBufferConnector):
+            dut = self.simulator_wsa(connector)
+            dut.rfe_mode('SH')
+            dut.freq(2440e6)
+            results.append(capture_spectrum(dut, 100e3, average=4))
+        self.assertEqual(results[0][:2], results[1][:2])
+        np.testing.assert_array_equal(results[0][2], results[1][2])
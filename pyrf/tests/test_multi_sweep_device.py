@@ -0,0 +1,128 @@
+import unittest
+
+from pyrf.devices.thinkrf import WSA
+from pyrf.multi_sweep_device import MultiSweepDevice, partition_sweep
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import SweepDeviceError
+from pyrf.units import M
+from pyrf.vrt import vrt_packet_reader
+
+
+class R5500_408(object):
+    MAX_TUNABLE = {'SH': 8000*M}
+
+class R5500_418(object):
+    MAX_TUNABLE = {'SH': 18000*M}
+
+
+class TestPartitionSweep(unittest.TestCase):
+    def test_equal_devices(self):
+        parts = partition_sweep([R5500_408] * 4, 100*M, 4100*M, 'SH')
+        self.assertEqual([i for i, start, stop in parts], [0, 1, 2, 3])
+        self.assertEqual([(start, stop) for i, start, stop in parts],
+            [(100*M, 1100*M), (1100*M, 2100*M), (2100*M, 3100*M),
+             (3100*M, 4100*M)])
+
+    def test_lower_limit_first(self):
+        parts = partition_sweep([R5500_418, R5500_408], 0, 16000*M, 'SH')
+        self.assertEqual(parts, [(1, 0, 8000*M), (0, 8000*M, 16000*M)])
+
+    def test_limited_device(self):
+        parts = partition_sweep([R5500_408, R5500_418, R5500_418],
+            0, 18000*M, 'SH')
+        self.assertEqual(parts, [(0, 0, 6000*M), (1, 6000*M, 12000*M),
+            (2, 12000*M, 18000*M)])
+        parts = partition_sweep([R5500_408, R5500_418], 6000*M, 18000*M, 'SH')
+        self.assertEqual(parts, [(0, 6000*M, 8000*M), (1, 8000*M, 18000*M)])
+
+    def test_min_span(self):
+        parts = partition_sweep([R5500_408, R5500_418, R5500_408],
+            100*M, 150*M, 'SH', min_span=40*M)
+        self.assertEqual([i for i, start, stop in parts], [2, 1])
+        parts = partition_sweep([R5500_408] * 3, 100*M, 130*M, 'SH',
+            min_span=40*M)
+        self.assertEqual(parts, [(2, 100*M, 130*M)])
+
+    def test_out_of_range(self):
+        self.assertRaises(SweepDeviceError, partition_sweep,
+            [R5500_408, R5500_408], 100*M, 9000*M, 'SH')
+
+
+class FailingConnector(SimulatorConnector):
+    """
+    A simulator connector that fails to read VRT data :attr:`failures`
+    times
+    """
+    failures = 0
+
+    def raw_read(self, num):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("connection lost")
+        return super(FailingConnector, self).raw_read(num)
+
+
+class AsyncSimulatorConnector(SimulatorConnector):
+    """
+    A simulator connector that WSA treats as async, packets are sent to
+    vrt_callback by :meth:`deliver`
+    """
+    vrt_callback = None
+
+    def add_callbacks(self, result, callback, errback):
+        callback(result)
+
+    def deliver(self, packets):
+        for n in range(packets):
+            packet = self.sync_async(vrt_packet_reader(self.raw_read))
+            if self.vrt_callback:
+                self.vrt_callback(packet)
+
+
+class TestMultiSweepDevice(unittest.TestCase):
+    def devices(self, connector):
+        devices = []
+        for n in range(2):
+            dut = WSA(connector(RTSASimulator(tones=[(2450e6, -30)],
+                noise_level=-100)))
+            dut.connect('simulator')
+            devices.append(dut)
+        return devices
+
+    def test_failing_part(self):
+        devices = self.devices(FailingConnector)
+        msd = MultiSweepDevice(devices)
+        devices[1].connector.failures = 1
+        self.assertRaises(IOError, msd.capture_power_spectrum,
+            2300*M, 2600*M, 100e3)
+        fstart, fstop, data, parts = msd.capture_power_spectrum(
+            2300*M, 2600*M, 100e3)
+        self.assertEqual((fstart, fstop), (2300*M, 2600*M))
+        self.assertEqual([part.device for part in parts], [0, 1])
+        self.assertAlmostEqual(data.max(), -30, delta=2)
+
+    def test_failing_async_part(self):
+        devices = self.devices(AsyncSimulatorConnector)
+        results = []
+        msd = MultiSweepDevice(devices,
+            lambda *result: results.append(result))
+
+        msd.capture_power_spectrum(2300*M, 2600*M, 100e3)
+        devices[0].connector.deliver(1)
+        msd.sweep_devices[1]._vrt_receive = self.fail_receive
+        self.assertRaises(SweepDeviceError, devices[1].connector.deliver, 1)
+        del msd.sweep_devices[1]._vrt_receive
+
+        # the next sweep starts, ignoring the packets of the failed one
+        msd.capture_power_spectrum(2300*M, 2600*M, 100e3)
+        for n in range(100):
+            if results:
+                break
+            for dut in devices:
+                dut.connector.deliver(1)
+        [(fstart, fstop, data, parts)] = results
+        self.assertEqual((fstart, fstop), (2300*M, 2600*M))
+        self.assertAlmostEqual(data.max(), -30, delta=2)
+
+    def fail_receive(self, packet):
+        raise SweepDeviceError("bad packet")
@@ -0,0 +1,378 @@
+import unittest
+
+import numpy as np
+pi = np.pi
+
+from pyrf.vrt import (vrt_packet_reader, generate_data_packet,
+    VRT_IFDATA_I14Q14, VRT_IFDATA_I14)
+import pyrf.numpy_util
+from pyrf.numpy_util import (compute_fft, compute_fft_batch, imageAttenuation,
+    get_window, set_fft_backend, get_fft_backend, WINDOW_CACHE_SIZE)
+
+SPEC_INV = (1 << 26) | (1 << 14)
+
+
+class FakeProperties(object):
+    REFLEVEL_ERROR = 0.5
+
+class FakeDevice(object):
+    properties = FakeProperties()
+
+def read_packet(buf):
+    pos = [0]
+    def raw_read(num):
+        data = buf[pos[0]:pos[0] + num]
+        pos[0] += num
+        return data
+    reader = vrt_packet_reader(raw_read)
+    data = next(reader)
+    while True:
+        result = reader.send(data)
+        if not isinstance(result, bytes):
+            return result
+        data = result
+
+def tone_packets(stream_id, count, spp, trailers=()):
+    rng = np.random.RandomState(1234)
+    t = np.arange(spp)
+    packets = []
+    for n in range(count):
+        i = 3000 * np.cos(0.3 * t + n) + 20 * rng.randn(spp)
+        if stream_id == VRT_IFDATA_I14Q14:
+            q = 2700 * np.sin(0.3 * t + n + 0.05) + 20 * rng.randn(spp)
+            samples = np.column_stack((i, q))
+        else:
+            samples = i
+        trailer = trailers[n] if n < len(trailers) else 0
+        buf, _ = generate_data_packet(stream_id, samples.astype(int),
+            trailer=trailer)
+        packets.append(read_packet(buf))
+    return packets
+
+
+def reference_image_attenuation(i_in, q_in, Phi_deg, iqswapedbit, iq_correction_wideband, Rx_Bw, rbw):
+    """
+    imageAttenuation before it was vectorized, kept to check the new
+    implementation against.  Ported to run on Python 3 and current numpy
+    only: filter() results are made lists, integer divisions use //,
+    list emptiness tests use len() and np.delete ignores indices out of
+    range like numpy 1.16 does.
+    """
+    Nsamp = len(i_in)
+    if iq_correction_wideband:
+        BWmax_ndx = int(np.rint(20e6/rbw))		    # max BW indices to attenuate
+        chSpacing = int(np.rint(1000e3/rbw))    # max channel spacing in case of NB signals
+    else:
+        BWmax_ndx = int(np.rint(1e6/rbw))		    # max BW indices to attenuate
+        chSpacing = int(np.rint(200e3/rbw))		# max channel spacing in case of WB signals
+    BWmin_ndx = int(np.rint(300e3/rbw))		    # min BW indices to attenuate
+    BW_ht_ndx = int(np.rint(100e3/rbw))		    # head and tail indices of BW to attenuate
+    Nstep = max(1, np.rint(300e3/rbw))
+
+    iq = i_in + 1j * q_in
+    iq = iq * np.hanning(len(i_in))
+    ampl_spectrum = np.fft.fftshift(np.fft.fft(iq))/Nsamp
+
+    ampl_spectrum_mag = np.abs(ampl_spectrum)
+
+    p, x = np.histogram(ampl_spectrum_mag, bins=int(len(ampl_spectrum_mag)/Nstep))
+    x = x[:-1] + (x[1] - x[0])/2
+    N_ndx = max(enumerate(p),key=lambda x: x[1])[0]
+    N = x[N_ndx]
+
+    ToNoise_thresh = 5 * N;  			        # Relative-to-Noise threshold
+    if abs(Phi_deg) > 30.0:				        # Relative-to-Signal threshold
+        ToMax_thresh = 0.005 * np.max(ampl_spectrum_mag);
+    else:
+        ToMax_thresh = 0.05 * np.max(ampl_spectrum_mag)
+
+    if np.max(ampl_spectrum_mag) > 10 * N:  # To ensure signal presence (3.16=>10dB, 5.6=>15dB, 10=>20dB, 20=>26dB)
+        maxNdx = np.argmax(ampl_spectrum_mag)
+        ind = [i for i,v in enumerate(ampl_spectrum_mag) if v > ToNoise_thresh and v > ToMax_thresh and maxNdx-BWmax_ndx < i < maxNdx+BWmax_ndx]
+
+
+        #Removing values beyond channel spacing
+        j1 = 0; j2 = len(ind)-1
+        for i in range(np.argmax(ampl_spectrum_mag[ind]), 0, -1):
+            if abs(ind[i] - ind[i-1]) < chSpacing:  j1 = i
+            else:   break
+        for i in range(np.argmax(ampl_spectrum_mag[ind]), len(ind)-1):
+            if abs(ind[i] - ind[i+1]) < chSpacing:  j2 = i
+            else:   break
+        ind = ind[j1-1:j2]
+
+
+        if len(ind):
+            head = min(ind) - max(3, BW_ht_ndx)
+            tail = max(ind) + max(3, BW_ht_ndx)
+            ind = list(filter(lambda x: 0 <= x <= Nsamp, range(head, tail+1)))
+            midNdx = ind[len(ind)//2]
+
+            if Nsamp//2 in ind:
+                if Nsamp//2 in range(midNdx - max(5, BWmin_ndx), midNdx + max(5, BWmin_ndx)):
+                    ind = []; att_ind = []
+                else:
+                    if midNdx > Nsamp//2:
+                        ind_mirror = list(range(Nsamp-1-max(ind), min(ind)))
+                    else:
+                        ind_mirror = list(range(min(Nsamp-1,max(ind)), Nsamp-1-min(ind)))
+                    # ind_mirror = filter(lambda x: x not in ind, ind_mirror)   # Too slow
+            else:
+                ind_mirror = np.subtract(Nsamp-1,ind)
+            if len(ind):
+                allIndices = np.concatenate([ind,ind_mirror])
+                if abs(Phi_deg) > 10:   # added as the zero degree doesn't fall exactly on the center frequency
+                    if iqswapedbit == 0:
+                        if Phi_deg > 0:
+                            att_ind = list(filter(lambda x: x < Nsamp//2, allIndices))
+                        else:
+                            att_ind = list(filter(lambda x: x > Nsamp//2, allIndices))
+                    if iqswapedbit == 1:
+                        if Phi_deg < 0:
+                            att_ind = list(filter(lambda x: x < Nsamp//2, allIndices))
+                        else:
+                            att_ind = list(filter(lambda x: x > Nsamp//2, allIndices))
+                else:
+                    att_ind = ind_mirror
+
+                if len(att_ind):
+                    if np.max(att_ind) > Nsamp-1 or np.min(att_ind) <  0:   # the if statement can be removed if it'll be faster
+                        att_ind = list(range(max(0, min(att_ind)), min(max(att_ind), Nsamp)))
+
+                    tmparray = np.delete(ampl_spectrum_mag, [x for x in allIndices if 0 <= x < Nsamp])
+                    p, x = np.histogram(tmparray, bins=int(len(tmparray)/Nstep))
+                    N_ndx = max(enumerate(p),key=lambda x: x[1])[0]
+                    N = np.sqrt(2) * x[N_ndx]
+
+                    Natt = np.random.normal(0, N, len(att_ind)) + 1j * np.random.normal(0, N, len(att_ind))
+                    ampl_spectrum[att_ind] = (ampl_spectrum[att_ind]/np.abs(ampl_spectrum[att_ind])) * Natt
+                    iq = np.fft.ifft(np.fft.fftshift(ampl_spectrum*Nsamp))
+                    i_data = np.real(iq); q_data = np.imag(iq)
+                else:
+                    i_data = i_in; q_data = q_in
+            else:
+                i_data = i_in; q_data = q_in
+        else:
+            i_data = i_in; q_data = q_in
+    else:
+        i_data = i_in; q_data = q_in
+    i_data = i_data - np.mean(i_data)
+    q_data = q_data - np.mean(q_data)
+
+    return i_data, q_data
+
+def tones_iq(bins, amplitudes, nsamp=4096, noise=1e-4, seed=1):
+    """
+    I and Q data of complex tones at FFT *bins* counted from the centre
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(nsamp)
+    iq = noise * (rng.randn(nsamp) + 1j * rng.randn(nsamp))
+    for b, a in zip(bins, amplitudes):
+        iq += a * np.exp(2j * pi * b * t / nsamp)
+    # a small gain and phase imbalance to create the image
+    return np.real(iq), 0.95 * np.imag(iq * np.exp(0.02j))
+
+
+class TestComputeFFTBatch(unittest.TestCase):
+    def setUp(self):
+        self.dut = FakeDevice()
+        self.context = {'reflevel': -10.0, 'bandwidth': 100e6}
+
+    def per_packet(self, packets, **kwargs):
+        return np.array([compute_fft(self.dut, pkt, dict(self.context),
+            **kwargs) for pkt in packets])
+
+    def test_iq_matches_compute_fft(self):
+        packets = tone_packets(VRT_IFDATA_I14Q14, 4, 1024,
+            trailers=(0, SPEC_INV))
+        for decimation in (1, 4):
+            np.random.seed(7)
+            expected = self.per_packet(packets, decimation=decimation)
+            np.random.seed(7)
+            result = compute_fft_batch(self.dut, packets,
+                dict(self.context), decimation=decimation)
+            self.assertEqual(result.shape, expected.shape)
+            self.assertTrue(np.array_equal(result, expected))
+
+    def test_iq_without_corrections(self):
+        packets = tone_packets(VRT_IFDATA_I14Q14, 3, 512)
+        expected = self.per_packet(packets, correct_phase=False,
+            hide_differential_dc_offset=False, convert_to_dbm=False)
+        result = compute_fft_batch(self.dut, packets, dict(self.context),
+            correct_phase=False, hide_differential_dc_offset=False,
+            convert_to_dbm=False)
+        self.assertTrue(np.array_equal(result, expected))
+
+    def test_i_only_matches_compute_fft(self):
+        packets = tone_packets(VRT_IFDATA_I14, 3, 2048,
+            trailers=(SPEC_INV,))
+        expected = self.per_packet(packets)
+        result = compute_fft_batch(self.dut, packets, dict(self.context))
+        self.assertTrue(np.array_equal(result, expected))
+
+    def test_mixed_sizes(self):
+        packets = (tone_packets(VRT_IFDATA_I14, 1, 1024)
+            + tone_packets(VRT_IFDATA_I14, 1, 512))
+        self.assertRaises(ValueError, compute_fft_batch, self.dut, packets,
+            dict(self.context))
+
+
+class TestGetWindow(unittest.TestCase):
+    def test_matches_hanning(self):
+        for length in (1, 2, 7, 1024):
+            window = get_window(length)
+            self.assertTrue(np.array_equal(window, np.hanning(length)))
+            self.assertFalse(window.flags.writeable)
+            self.assertTrue(get_window(length) is window)
+        window = get_window(1024, np.float32)
+        self.assertEqual(window.dtype, np.float32)
+        self.assertTrue(np.array_equal(window,
+            np.hanning(1024).astype(np.float32)))
+
+    def test_cache_size(self):
+        first = get_window(3)
+        for length in range(10000, 10000 + WINDOW_CACHE_SIZE * 2):
+            get_window(length)
+            self.assertTrue(len(pyrf.numpy_util._window_cache)
+                <= WINDOW_CACHE_SIZE)
+        # the least recently used windows were dropped
+        self.assertFalse(get_window(3) is first)
+
+
+class TestFFTBackend(unittest.TestCase):
+    def setUp(self):
+        self.dut = FakeDevice()
+        self.context = {'reflevel': -10.0, 'bandwidth': 100e6}
+        self.addCleanup(set_fft_backend, 'numpy')
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, set_fft_backend, 'fftpack')
+        self.assertEqual(get_fft_backend(), 'numpy')
+
+    def test_unavailable_backend(self):
+        for backend in ('scipy', 'pyfftw'):
+            module = backend + '_fft' if backend == 'scipy' else backend
+            saved = getattr(pyrf.numpy_util, module)
+            setattr(pyrf.numpy_util, module, None)
+            try:
+                self.assertRaises(ValueError, set_fft_backend, backend)
+            finally:
+                setattr(pyrf.numpy_util, module, saved)
+        self.assertEqual(get_fft_backend(), 'numpy')
+
+    @unittest.skipIf(pyrf.numpy_util.scipy_fft is None,
+        "scipy.fft not installed")
+    def test_scipy_spectrum(self):
+        for stream_id in (VRT_IFDATA_I14Q14, VRT_IFDATA_I14):
+            packets = tone_packets(stream_id, 2, 1024)
+            np.random.seed(5)
+            expected = compute_fft_batch(self.dut, packets,
+                dict(self.context))
+            set_fft_backend('scipy')
+            self.assertEqual(get_fft_backend(), 'scipy')
+            np.random.seed(5)
+            result = compute_fft_batch(self.dut, packets,
+                dict(self.context))
+            set_fft_backend('numpy')
+            np.testing.assert_allclose(result, expected, atol=1e-9)
+
+
+class TestSinglePrecision(unittest.TestCase):
+    def setUp(self):
+        self.dut = FakeDevice()
+        self.context = {'reflevel': -10.0, 'bandwidth': 100e6}
+
+    def check(self, stream_id, spp, **kwargs):
+        packets = tone_packets(stream_id, 2, spp)
+        np.random.seed(3)
+        expected = compute_fft(self.dut, packets[0], dict(self.context),
+            **kwargs)
+        np.random.seed(3)
+        result = compute_fft(self.dut, packets[0], dict(self.context),
+            precision='single', **kwargs)
+        self.assertEqual(result.dtype, np.float32)
+        error = np.abs(result - expected)
+        # deep noise bins lose the most, signal bins are much closer
+        self.assertLess(error.max(), 0.1)
+        strong = expected > expected.max() - 60
+        self.assertLess(error[strong].max(), 0.001)
+
+        np.random.seed(3)
+        batch = compute_fft_batch(self.dut, packets, dict(self.context),
+            precision='single', **kwargs)
+        self.assertEqual(batch.dtype, np.float32)
+        self.assertTrue(np.array_equal(batch[0], result))
+
+    def test_iq(self):
+        for spp in (1024, 32768):
+            self.check(VRT_IFDATA_I14Q14, spp, correct_phase=False)
+            self.check(VRT_IFDATA_I14Q14, spp, decimation=4)
+
+    def test_iq_image_attenuation(self):
+        self.check(VRT_IFDATA_I14Q14, 4096)
+
+    def test_i_only(self):
+        for spp in (1024, 32768):
+            self.check(VRT_IFDATA_I14, spp)
+
+    def test_unknown_precision(self):
+        packets = tone_packets(VRT_IFDATA_I14, 1, 256)
+        self.assertRaises(ValueError, compute_fft, self.dut, packets[0],
+            dict(self.context), precision='half')
+
+class TestImageAttenuation(unittest.TestCase):
+    rx_bw = 100e6
+    nsamp = 4096
+
+    def check(self, bins, amplitudes, Phi_deg, iqswapedbit=0,
+            wideband=True, nsamp=4096):
+        i_in, q_in = tones_iq(bins, amplitudes, nsamp)
+        args = (Phi_deg, iqswapedbit, wideband, self.rx_bw,
+            self.rx_bw / nsamp)
+        np.random.seed(42)
+        expected = reference_image_attenuation(i_in, q_in, *args)
+        np.random.seed(42)
+        result = imageAttenuation(i_in, q_in, *args)
+        self.assertTrue(np.array_equal(result[0], expected[0]))
+        self.assertTrue(np.array_equal(result[1], expected[1]))
+        return result
+
+    def test_single_tone(self):
+        for Phi_deg in (-40, -20, 5, 20, 40):
+            for iqswapedbit in (0, 1):
+                self.check([600], [1.0], Phi_deg, iqswapedbit)
+                self.check([-900], [1.0], Phi_deg, iqswapedbit)
+
+    def test_narrowband(self):
+        for Phi_deg in (-20, 5, 20):
+            self.check([300], [1.0], Phi_deg, wideband=False)
+            self.check([300, 310, 330], [1.0, 0.5, 0.2], Phi_deg,
+                wideband=False)
+
+    def test_channel_spacing(self):
+        # tones further apart than the channel spacing are dropped
+        for Phi_deg in (-20, 5, 20):
+            self.check([500, 520, 800], [1.0, 0.6, 0.8], Phi_deg)
+            self.check([500, 530, 560, 590], [0.2, 0.4, 1.0, 0.3], Phi_deg)
+
+    def test_near_center(self):
+        for Phi_deg in (-20, 5, 20):
+            self.check([3], [1.0], Phi_deg)
+            self.check([20], [1.0], Phi_deg)
+            self.check(range(-10, 200, 20), [1.0] * 11, Phi_deg)
+            self.check(range(-200, 10, 20), [1.0] * 11, Phi_deg)
+
+    def test_near_edges(self):
+        for Phi_deg in (-20, 5, 20):
+            self.check([2046], [1.0], Phi_deg)
+            self.check([-2047], [1.0], Phi_deg)
+
+    def test_no_signal(self):
+        i_in, q_in = tones_iq([], [])
+        result = self.check([], [], 20)
+        self.assertTrue(np.allclose(result[0], i_in - np.mean(i_in)))
+
+    def test_packet_sizes(self):
+        for nsamp in (1024, 32768):
+            self.check([nsamp // 8], [1.0], 20, nsamp=nsamp)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pyrf.vrt import (generate_speca_packet, generate_data_packet,
+    generate_context_packet, VRT_IFDATA_I14Q14)
+from pyrf.devices.playback import Playback, PlaybackError
+
+DEVICE_ID = 'ThinkRF,R5500-408 v1,0,1.0'
+
+
+def data_packet(n, tsi=0):
+    return generate_data_packet(VRT_IFDATA_I14Q14,
+        np.array([(n, -n)] * 16), count=n, tsi=tsi)[0]
+
+
+class TestPlayback(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'recording.vrt')
+        with open(self.filename, 'wb') as f:
+            f.write(generate_speca_packet({'device_class': 'thinkrf.WSA',
+                'device_identifier': DEVICE_ID, 'center': 2400})[0])
+            f.write(generate_context_packet('sweepid', 7)[0])
+            f.write(data_packet(1))
+            f.write(data_packet(2))
+            f.write(generate_speca_packet({'center': 2500})[0])
+            f.write(data_packet(3))
+            # a partial packet at the end of the recording
+            f.write(data_packet(4)[:20])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_properties_from_state(self):
+        dut = Playback(filename=self.filename)
+        self.assertEqual(dut.device_id, DEVICE_ID)
+        self.assertEqual(dut.properties.model, 'R5500-408')
+        self.assertEqual(len(dut), 6)
+        dut.close()
+
+    def test_read(self):
+        dut = Playback(filename=self.filename)
+        dut.sweep_start(42)
+        packet = dut.read()
+        self.assertEqual(packet.fields['sweepid'], 42)
+        self.assertEqual(dut.state['center'], 2400)
+
+        samples = [dut.read().data.numpy_array()[0].tolist()
+            for i in range(3)]
+        self.assertEqual(samples, [[1, -1], [2, -2], [3, -3]])
+        self.assertEqual(dut.state, {'center': 2500})
+        self.assertTrue(dut.eof())
+        self.assertRaises(PlaybackError, dut.read)
+        self.assertEqual(dut.stats.data_packets, 3)
+
+        dut.rewind()
+        dut.sweep_stop()
+        self.assertEqual(dut.read().fields['sweepid'], 7)
+        dut.close()
+
+    def test_device_identifier_required(self):
+        with open(self.filename, 'wb') as f:
+            f.write(data_packet(1))
+        self.assertRaises(PlaybackError, Playback, filename=self.filename)
+        dut = Playback('thinkrf.WSA', DEVICE_ID, self.filename)
+        self.assertEqual(len(dut), 1)
+        dut.close()
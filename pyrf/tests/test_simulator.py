@@ -0,0 +1,135 @@
+import socket
+import sys
+import unittest
+
+import numpy as np
+
+from pyrf.simulator import (RTSASimulator, SimulatorConnector,
+    DEFAULT_DEVICE_ID)
+from pyrf.devices.thinkrf import WSA
+from pyrf.capture_device import CaptureDevice
+from pyrf.vrt import vrt_packet_index, VRT_IFDATA_I14Q14, VRT_IFDATA_I14
+from pyrf.numpy_util import compute_fft
+from pyrf.devices.thinkrf_properties import wsa_properties
+
+
+class FakeDevice(object):
+    properties = wsa_properties(DEFAULT_DEVICE_ID)
+
+
+class TestSimulatorCommands(unittest.TestCase):
+    def test_queries(self):
+        sim = RTSASimulator()
+        self.assertEqual(sim.scpi(':*idn?'), DEFAULT_DEVICE_ID)
+        self.assertEqual(sim.scpi(':SYSTEM:LOCK:REQUEST? ACQ'), '1')
+        self.assertEqual(sim.scpi(':DATA:CORRECTION:SIGNAL:SIZE?'), '0')
+        sim.scpi(':FREQ:CENTER 2450000000')
+        self.assertEqual(sim.scpi('FREQ:CENT?'), '2450000000')
+        sim.scpi(':INPUT:ATTENUATOR:VAR 10.00')
+        self.assertEqual(sim.scpi('INP:ATT:VAR?'), '10.00')
+
+    def test_errors(self):
+        sim = RTSASimulator()
+        sim.scpi(':TRACE:SPP many')
+        self.assertEqual(sim.scpi(':SYSTEM:ERROR?'),
+            '-224,"Illegal parameter value"')
+        self.assertEqual(sim.scpi(':SYSTEM:ERROR?'), '0,"No error"')
+
+    def test_sweep_entries(self):
+        sim = RTSASimulator()
+        for cmd in [':sweep:entry:new', ':sweep:entry:spp 1024',
+                ':sweep:entry:mode SH', ':sweep:entry:freq:center 100, 400',
+                ':sweep:entry:freq:step 100', ':sweep:entry:save',
+                ':sweep:entry:freq:center 450, 450', ':sweep:entry:save']:
+            sim.scpi(cmd)
+        self.assertEqual([e.frequencies() for e in sim.entries],
+            [[100, 200, 300, 400], [450]])
+        sim.scpi(':sweep:entry:delete all')
+        self.assertEqual(sim.entries, [])
+
+
+class TestSimulatorServer(unittest.TestCase):
+    def setUp(self):
+        self.sim = RTSASimulator(tones=[(2450e6, -30)], noise_level=-100,
+            scpi_port=0, vrt_port=0)
+        self.sim.start()
+        self.scpi = socket.create_connection(('127.0.0.1', self.sim.scpi_port))
+        self.vrt = socket.create_connection(('127.0.0.1', self.sim.vrt_port))
+        self.vrt.settimeout(5)
+
+    def tearDown(self):
+        self.scpi.close()
+        self.vrt.close()
+        self.sim.stop()
+
+    def _capture(self, mode, packets):
+        self.scpi.sendall((':INPUT:MODE %s\n:FREQ:CENTER 2440000000\n'
+            ':TRACE:SPP 1024\n:TRACE:BLOCK:PACKETS %d\n'
+            ':TRACE:BLOCK:DATA?\n' % (mode, packets)).encode('ascii'))
+        buf = b''
+        while True:
+            buf += self.vrt.recv(65536)
+            index = vrt_packet_index(buf)
+            if len(index.data_packets()) == packets:
+                return index
+
+    def test_idn(self):
+        self.scpi.sendall(b':*idn?\n')
+        self.assertEqual(self.scpi.recv(1024),
+            (DEFAULT_DEVICE_ID + '\n').encode('ascii'))
+
+    def test_block_capture(self):
+        for mode, stream_id in [('ZIF', VRT_IFDATA_I14Q14),
+                ('SH', VRT_IFDATA_I14)]:
+            index = self._capture(mode, 3)
+            context = {}
+            for packet in index:
+                if packet.is_context_packet():
+                    context.update(packet.fields)
+            self.assertEqual(context['rffreq'], 2440000000)
+            data = index.data_packets()
+            self.assertEqual(list(data['stream_id']), [stream_id] * 3)
+            self.assertEqual(list(data['count']), [0, 1, 2])
+
+            packet = index[len(index) - 1]
+            pow_data = compute_fft(FakeDevice, packet, context)
+            self.assertAlmostEqual(pow_data.max(), -30, delta=2)
+
+
+@unittest.skipIf(sys.version_info[0] > 2,
+    "WSA parses SCPI responses received from sockets with Python 2 only")
+class TestSimulatorWSA(unittest.TestCase):
+    def setUp(self):
+        self.sim = RTSASimulator(tones=[(2450e6, -30)])
+        try:
+            # WSA connects to the standard ports
+            self.sim.start()
+        except socket.error as err:
+            self.skipTest("SCPI and VRT ports not available: %s" % err)
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def test_capture(self):
+        dut = WSA()
+        dut.connect('127.0.0.1')
+        try:
+            self.assertEqual(dut.device_id.strip(), DEFAULT_DEVICE_ID)
+            cd = CaptureDevice(dut)
+            fstart, fstop, data = cd.capture_time_domain('SH', 2450e6, 1e3)
+            self.assertEqual(len(data['data_pkt'].data), 4 * cd.points)
+            self.assertEqual(dut.stats.data_packets, 4)
+        finally:
+            dut.disconnect()
+
+
+class TestSimulatorConnector(unittest.TestCase):
+    def test_capture(self):
+        dut = WSA(SimulatorConnector(RTSASimulator(tones=[(2450e6, -30)])))
+        dut.connect('simulator')
+        self.assertEqual(dut.device_id.strip(), DEFAULT_DEVICE_ID)
+        cd = CaptureDevice(dut)
+        fstart, fstop, data = cd.capture_time_domain('SH', 2450e6, 1e3)
+        self.assertEqual(cd.packets_per_block, 4)
+        self.assertEqual(len(data['data_pkt'].data), 4 * cd.points)
+        self.assertEqual(dut.stats.data_packets, 4)
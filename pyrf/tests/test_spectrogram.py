@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from pyrf.spectrogram import Spectrogram, SpectrogramError
+
+
+class TestSpectrogram(unittest.TestCase):
+    def test_ring(self):
+        sg = Spectrogram(3)
+        self.assertEqual(sg.rows().shape, (0, 0))
+        for n in range(5):
+            sg.add(100, 200, np.arange(4) + n * 10, timestamp=n)
+        self.assertEqual(len(sg), 3)
+        self.assertEqual(sg.count, 5)
+        self.assertEqual(sg.rows().tolist(),
+            [[20, 21, 22, 23], [30, 31, 32, 33], [40, 41, 42, 43]])
+        self.assertEqual(sg.rows(1).tolist(), [[40, 41, 42, 43]])
+        self.assertEqual(sg.timestamps().tolist(), [2, 3, 4])
+        self.assertEqual(sg.frequencies().tolist(), [112.5, 137.5, 162.5,
+            187.5])
+        self.assertRaises(SpectrogramError, sg.rows, 4)
+
+    def test_views_share_memory(self):
+        sg = Spectrogram(4, width=2, fstart=0, fstop=2)
+        for n in range(6):
+            sg.add(0, 2, [n, n])
+            rows = sg.rows()
+            self.assertTrue(rows.flags['C_CONTIGUOUS'])
+            self.assertTrue(np.may_share_memory(rows, sg.rows(1)))
+        self.assertEqual(rows[:, 0].tolist(), [2, 3, 4, 5])
+
+    def test_downsample(self):
+        data = np.array([0, 5, 1, 2, 9, 3, 4, 4], dtype=float)
+        sg = Spectrogram(2, width=4, fstart=0, fstop=80)
+        sg.add(0, 80, data)
+        self.assertEqual(sg.rows(1).tolist(), [[5, 2, 9, 4]])
+        sg = Spectrogram(2, width=4, fstart=0, fstop=80, resample='mean')
+        sg.add(0, 80, data)
+        self.assertEqual(sg.rows(1).tolist(), [[2.5, 1.5, 6, 4]])
+
+    def test_upsample_and_partial_coverage(self):
+        sg = Spectrogram(2, width=8, fstart=0, fstop=80)
+        sg.add(20, 60, [0, 4])
+        row = sg.rows(1)[0]
+        self.assertTrue(np.isnan(row[[0, 1, 6, 7]]).all())
+        self.assertEqual(row[2:6].tolist(), [0, 1, 3, 4])
+        sg.add(100, 200, [1, 2])
+        self.assertTrue(np.isnan(sg.rows(1)).all())
+
+    def test_invalid(self):
+        self.assertRaises(SpectrogramError, Spectrogram, 0)
+        self.assertRaises(SpectrogramError, Spectrogram, 4, resample='min')
@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from pyrf.vrt import (vrt_packet_reader, generate_data_packet,
+    VRT_IFDATA_I14Q14)
+from pyrf.stats import ConnectionStats, TimeHistogram
+
+VALID = (1 << 30) | (1 << 18) | (1 << 29) | (1 << 17)
+OVER_RANGE = (1 << 25) | (1 << 13)
+SAMPLE_LOSS = (1 << 24) | (1 << 12)
+
+
+def read_packets(stats, counts, trailers=()):
+    for n, count in enumerate(counts):
+        trailer = trailers[n] if n < len(trailers) else VALID
+        buf, next_count = generate_data_packet(VRT_IFDATA_I14Q14,
+            np.zeros((16, 2)), count=count, trailer=trailer)
+        pos = [0]
+        def raw_read(num):
+            data = buf[pos[0]:pos[0] + num]
+            pos[0] += num
+            return data
+        reader = vrt_packet_reader(raw_read, stats)
+        data = next(reader)
+        while isinstance(data, bytes):
+            data = reader.send(data)
+
+
+class TestConnectionStats(unittest.TestCase):
+    def test_counts(self):
+        stats = ConnectionStats()
+        read_packets(stats, [0, 1, 2])
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['packets'], 3)
+        self.assertEqual(snapshot['data_packets'], 3)
+        self.assertEqual(snapshot['bytes'], 3 * (6 * 4 + 64))
+        self.assertEqual(snapshot['lost_packets'], 0)
+        self.assertEqual(snapshot['parse_time']['count'], 3)
+
+    def test_lost_packets(self):
+        stats = ConnectionStats()
+        read_packets(stats, [14, 15, 2, 3, 5])
+        self.assertEqual(stats.lost_packets, 3)
+
+    def test_trailer_indicators(self):
+        stats = ConnectionStats()
+        read_packets(stats, [0, 1, 2, 3],
+            [VALID | OVER_RANGE, VALID | SAMPLE_LOSS, (1 << 30) | (1 << 29),
+            VALID])
+        self.assertEqual(stats.over_range, 1)
+        self.assertEqual(stats.sample_loss, 1)
+        self.assertEqual(stats.invalid_data, 1)
+        self.assertEqual(stats.reference_unlocked, 1)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()['over_range'], 0)
+
+    def test_indicators_not_enabled(self):
+        stats = ConnectionStats()
+        # enable bits clear, with and without the indicators set
+        read_packets(stats, [0, 1, 2],
+            [0, (1 << 18) | (1 << 17), OVER_RANGE])
+        self.assertEqual(stats.invalid_data, 0)
+        self.assertEqual(stats.reference_unlocked, 0)
+        # each indicator enabled and clear on its own
+        read_packets(stats, [3, 4], [1 << 30, 1 << 29])
+        self.assertEqual(stats.invalid_data, 1)
+        self.assertEqual(stats.reference_unlocked, 1)
+
+
+class TestTimeHistogram(unittest.TestCase):
+    def test_buckets(self):
+        hist = TimeHistogram()
+        self.assertEqual(hist.percentile(50), None)
+        for seconds in [0.5e-6, 3e-6, 3e-6, 100e-6, 100.0]:
+            hist.record(seconds)
+        self.assertEqual(hist.buckets[:8], [1, 0, 2, 0, 0, 0, 0, 1])
+        self.assertEqual(hist.buckets[-1], 1)
+        self.assertEqual(hist.percentile(50), 4e-6)
+        self.assertEqual(hist.max, 100.0)
@@ -0,0 +1,111 @@
+import unittest
+
+import numpy as np
+
+from pyrf.vrt import generate_data_packet, VRT_IFDATA_I14Q14
+from pyrf.stream_device import StreamDevice, StreamDeviceError
+from pyrf.tests.test_numpy_util import read_packet
+
+SAMPLE_LOSS = (1 << 24) | (1 << 12)
+
+
+class FakeConnector(object):
+    paused = False
+
+    def pause_vrt(self):
+        self.paused = True
+
+    def resume_vrt(self):
+        self.paused = False
+
+class FakeDevice(object):
+    def __init__(self, packets, is_async=False):
+        self.connector = FakeConnector()
+        self.packets = iter(packets)
+        self.is_async = is_async
+        self.callback = None
+
+    def async_connector(self):
+        return self.is_async
+
+    def set_async_callback(self, callback):
+        self.callback = callback
+
+    def stream_start(self, stream_id=None):
+        pass
+
+    def stream_stop(self):
+        pass
+
+    def read(self):
+        return next(self.packets)
+
+def stream_packets(counts, trailers=()):
+    packets = []
+    for n, count in enumerate(counts):
+        samples = np.array([(n, -n)] * 16)
+        trailer = trailers[n] if n < len(trailers) else 0
+        data, next_count = generate_data_packet(VRT_IFDATA_I14Q14, samples,
+            count=count, tsi=1000 + n, tsf=n * 10, trailer=trailer)
+        packets.append(read_packet(data))
+    return packets
+
+
+class TestStreamDevice(unittest.TestCase):
+    def _receive_all(self, capacity, overflow, count=10):
+        dut = FakeDevice(stream_packets(range(count)), is_async=True)
+        stream = StreamDevice(dut, capacity, overflow)
+        stream.start()
+        for packet in dut.packets:
+            dut.callback(packet)
+        blocks = []
+        while True:
+            block = stream.get_nowait()
+            if block is None:
+                return stream, dut, blocks
+            blocks.append(block)
+
+    def test_blocking_iteration(self):
+        dut = FakeDevice(stream_packets([0, 1, 2, 5, 6], [0, 0, 0, SAMPLE_LOSS]))
+        stream = StreamDevice(dut, capacity=2)
+        stream.start()
+        blocks = [next(stream) for i in range(5)]
+        self.assertEqual([b.tsi for b in blocks], [1000, 1001, 1002, 1003, 1004])
+        self.assertEqual([b.tsf for b in blocks], [0, 10, 20, 30, 40])
+        self.assertEqual([b.lost for b in blocks], [0, 0, 0, 2, 0])
+        self.assertEqual([b.sample_loss for b in blocks],
+            [False, False, False, True, False])
+        self.assertEqual(stream.lost_packets, 2)
+        self.assertEqual(blocks[3].data.shape, (16, 2))
+        self.assertEqual(blocks[3].data[0].tolist(), [3, -3])
+
+    def test_drop_oldest(self):
+        stream, dut, blocks = self._receive_all(3, 'drop_oldest')
+        self.assertEqual([b.tsi for b in blocks], [1007, 1008, 1009])
+        self.assertEqual([b.lost for b in blocks], [7, 0, 0])
+        self.assertEqual(stream.dropped_packets, 7)
+        self.assertEqual(blocks[0].data[0].tolist(), [7, -7])
+
+    def test_drop_newest(self):
+        stream, dut, blocks = self._receive_all(3, 'drop_newest')
+        self.assertEqual([b.tsi for b in blocks], [1000, 1001, 1002])
+        self.assertEqual(stream.dropped_packets, 7)
+
+    def test_block(self):
+        dut = FakeDevice(stream_packets(range(6)), is_async=True)
+        stream = StreamDevice(dut, 2, 'block')
+        stream.start()
+        for packet in dut.packets:
+            dut.callback(packet)
+        self.assertTrue(dut.connector.paused)
+        self.assertEqual(len(stream), 6)
+        blocks = [stream.get_nowait() for i in range(6)]
+        self.assertFalse(dut.connector.paused)
+        self.assertEqual([b.tsi for b in blocks], list(range(1000, 1006)))
+        self.assertEqual([b.data[0].tolist() for b in blocks],
+            [[n, -n] for n in range(6)])
+        self.assertEqual(stream.dropped_packets, 0)
+
+    def test_bad_policy(self):
+        self.assertRaises(StreamDeviceError, StreamDevice, FakeDevice([]),
+            overflow='drop_some')
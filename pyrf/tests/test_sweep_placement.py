@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from pyrf.sweep_device import (SweepPlanner, plan_bin_placement,
+    plan_sweep_placements)
+from pyrf.units import M
+from pyrf.vrt import I_ONLY, IQ
+
+
+class FakeProperties(object):
+    FULL_BW = {'SH': 62.5*M, 'ZIF': 125*M, 'DD': 62.5*M}
+    USABLE_BW = {'SH': 40*M, 'ZIF': 100*M, 'DD': 62.5*M}
+    MIN_TUNABLE = {'SH': 50*M, 'ZIF': 50*M}
+    MAX_TUNABLE = {'SH': 8000*M, 'ZIF': 8000*M}
+    MAX_SPP = 32768
+    PASS_BAND_CENTER = {'SH': 0.56, 'ZIF': 0.5, 'DD': 0.5}
+    DEFAULT_SAMPLE_TYPE = {'SH': I_ONLY, 'ZIF': IQ, 'DD': I_ONLY}
+
+
+class TestBinPlacement(unittest.TestCase):
+    def _plan(self, fstart, fstop, rbw, mode='SH'):
+        return SweepPlanner(FakeProperties).plan_sweep(
+            fstart, fstop, rbw, mode, {})
+
+    def _check_coverage(self, settings, spec_inv):
+        placements = plan_sweep_placements(FakeProperties, settings)
+        writes = np.zeros(settings.spectral_points, dtype=int)
+        for (freq, inv, nbins), place in placements.items():
+            if inv != spec_inv:
+                continue
+            writes[place.dst] += 1
+            self.assertEqual(place.flip, spec_inv)
+            src = np.arange(nbins)[place.src]
+            self.assertEqual(len(src), len(writes[place.dst]))
+        self.assertTrue((writes > 0).all())
+
+    def test_sweep_covers_band(self):
+        for args in [(2000*M, 2400*M, 500e3), (0, 300*M, 200e3),
+                (7900*M, 8000*M, 100e3), (100*M, 1000*M, 1*M)]:
+            settings = self._plan(*args)
+            self._check_coverage(settings, False)
+            self._check_coverage(settings, True)
+
+    def test_planned_packets(self):
+        settings = self._plan(0, 300*M, 200e3)
+        placements = plan_sweep_placements(FakeProperties, settings)
+        nbins = settings.spp // 2 + 1
+        self.assertEqual(len(placements), 2 * settings.step_count)
+        self.assertTrue((None, False, nbins) in placements)
+        self.assertTrue((int(settings.fstart), True, nbins) in placements)
+
+    def test_flip(self):
+        settings = self._plan(2000*M, 2400*M, 500e3)
+        nbins = settings.spp // 2 + 1
+        freq = int(settings.fstart)
+        ramp = np.arange(nbins, dtype=float)
+
+        place = plan_bin_placement(FakeProperties, settings, freq, False,
+            nbins)
+        self.assertFalse(place.flip)
+        self.assertTrue((np.diff(ramp[place.src]) > 0).all())
+
+        place = plan_bin_placement(FakeProperties, settings, freq, True,
+            nbins)
+        self.assertTrue(place.flip)
+        placed = ramp[place.src][::-1]
+        self.assertTrue((np.diff(placed) < 0).all())
+
+    def test_outside_of_sweep(self):
+        settings = self._plan(2000*M, 2100*M, 500e3)
+        nbins = settings.spp // 2 + 1
+        place = plan_bin_placement(FakeProperties, settings, 3000*M, False,
+            nbins)
+        self.assertEqual(np.zeros(10)[place.dst].size, 0)
+        self.assertEqual(np.zeros(nbins)[place.src].size, 0)
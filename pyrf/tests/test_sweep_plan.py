@@ -0,0 +1,154 @@
+import unittest
+
+import numpy as np
+
+from pyrf.devices.thinkrf import WSA
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import SweepDevice
+
+
+class RecordingConnector(SimulatorConnector):
+    """
+    A simulator connector that keeps the scpiset commands sent
+    """
+    def __init__(self, simulator):
+        super(RecordingConnector, self).__init__(simulator)
+        self.commands = []
+
+    def scpiset(self, cmd):
+        self.commands.extend(cmd.split('\n'))
+        super(RecordingConnector, self).scpiset(cmd)
+
+
+class TestSweepPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.dut = WSA(RecordingConnector(RTSASimulator(
+            tones=[(2350e6, -30)], noise_level=-100)))
+        self.dut.connect('simulator')
+        self.sd = SweepDevice(self.dut)
+        self.commands = self.dut.connector.commands
+
+    def sweep(self, *args, **kwargs):
+        del self.commands[:]
+        self.sd.capture_power_spectrum(2300e6, 2400e6, 100e3,
+            *args, **kwargs)
+        return [c for c in self.commands if c.startswith(':sweep')]
+
+    def test_repeated_sweep(self):
+        first = self.sweep()
+        self.assertTrue(':sweep:entry:delete all' in first)
+        self.assertTrue(':sweep:entry:save' in first)
+        plan = self.sd._sweep_settings
+        # only the sweep is started again
+        self.assertEqual(self.sweep(), [':sweep:list:start %d'
+            % self.sd._next_sweep_id])
+        self.assertTrue(self.sd._sweep_settings is plan)
+
+    def test_sweep_list_changed(self):
+        first = self.sweep()
+        for change in (self.dut.sweep_clear, self.dut.reset):
+            change()
+            self.assertEqual(self.sweep(), first[:-1]
+                + [':sweep:list:start %d' % self.sd._next_sweep_id])
+
+    def test_iterations_changed(self):
+        self.sweep()
+        commands = self.sweep(continuous=True)
+        self.assertEqual(commands, [':sweep:list:iterations 0',
+            ':sweep:list:start %d' % self.sd._next_sweep_id])
+        self.sd.stop()
+        commands = self.sweep()
+        self.assertEqual(commands[-2:], [':sweep:list:iterations 1',
+            ':sweep:list:start %d' % self.sd._next_sweep_id])
+        self.assertFalse(':sweep:entry:save' in commands)
+
+    def test_generation(self):
+        generation = self.dut.sweep_list_generation()
+        self.dut.sweep_iterations(1)
+        self.assertNotEqual(self.dut.sweep_list_generation(), generation)
+        generation = self.dut.sweep_list_generation()
+        self.dut.freq(2400e6)
+        self.assertEqual(self.dut.sweep_list_generation(), generation)
+
+    def test_unhashable_settings(self):
+        settings = {'attenuation': 0,
+            'trigger': {'type': 'NONE', 'fstart': 2300e6, 'fstop': 2400e6,
+                'amplitude': -100}}
+        for i in range(2):
+            fstart, fstop, data = self.sd.capture_power_spectrum(2300e6,
+                2400e6, 100e3, settings)
+        self.assertEqual(len(self.sd._plan_cache), 1)
+        self.assertAlmostEqual(data.max(), -30, delta=2)
+
+        # settings that can't be frozen are swept without caching the plan
+        settings['ref'] = np.array([0.0])
+        first = self.sweep(settings)
+        self.assertEqual(self.sweep(settings), first[:-1]
+            + [':sweep:list:start %d' % self.sd._next_sweep_id])
+        self.assertEqual(len(self.sd._plan_cache), 1)
+
+
+class TestContinuousSweep(unittest.TestCase):
+    def setUp(self):
+        self.dut = WSA(RecordingConnector(RTSASimulator(
+            tones=[(2350e6, -30)], noise_level=-100)))
+        self.dut.connect('simulator')
+        self.sd = SweepDevice(self.dut)
+        self.commands = self.dut.connector.commands
+
+    def sweep(self, fstart=2300e6, fstop=2400e6, continuous=True):
+        del self.commands[:]
+        return self.sd.capture_power_spectrum(fstart, fstop, 100e3,
+            continuous=continuous)
+
+    def test_buffers_alternate(self):
+        fstart, fstop, first = self.sweep()
+        self.assertAlmostEqual(first.max(), -30, delta=2)
+        first[:] = -999
+        second = self.sweep()[2]
+        # the next sweep went to the other buffer and nothing was sent
+        self.assertFalse(second is first)
+        self.assertEqual(self.commands, [])
+        self.assertTrue((first == -999).all())
+        self.assertAlmostEqual(second.max(), -30, delta=2)
+        # the sweep after that reuses and rewrites the first buffer
+        third = self.sweep()[2]
+        self.assertTrue(third is first)
+        self.assertFalse((third == -999).any())
+        np.testing.assert_array_equal(third, second)
+
+    def test_stop_mid_sweep(self):
+        self.sweep()
+        sweep_id = self.sd._next_sweep_id
+        # part of the next pass is received before stopping
+        for i in range(3):
+            self.assertEqual(self.sd._vrt_receive(self.dut.read()), None)
+        del self.commands[:]
+        self.sd.stop()
+        self.assertFalse(self.sd.continuous)
+        self.assertEqual(self.commands, [':sweep:list:stop'])
+        self.assertEqual(self.sd._stale_sweep_id, sweep_id)
+        # stopping again does nothing
+        self.sd.stop()
+        self.assertEqual(self.commands, [':sweep:list:stop'])
+
+        fstart, fstop, data = self.sweep(continuous=False)
+        self.assertEqual(self.sd._next_sweep_id, sweep_id + 1)
+        self.assertAlmostEqual(data.max(), -30, delta=2)
+        self.assertTrue(self.sd._last_finished)
+
+    def test_restart_different_parameters(self):
+        fstart, fstop, first = self.sweep()
+        fstart, fstop, data = self.sweep(2200e6, 2500e6)
+        self.assertEqual(self.commands[0], ':sweep:list:stop')
+        self.assertTrue(':sweep:entry:save' in self.commands)
+        self.assertTrue(fstart <= 2200e6 and fstop >= 2500e6)
+        self.assertTrue(len(data) > len(first))
+        self.assertAlmostEqual(data.max(), -30, delta=2)
+        self.assertTrue(self.sd.continuous)
+
+        # the new sweep continues without being programmed again
+        fstart, fstop, again = self.sweep(2200e6, 2500e6)
+        self.assertEqual(self.commands, [])
+        self.assertFalse(again is data)
+        self.assertEqual(len(again), len(data))
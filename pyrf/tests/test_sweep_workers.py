@@ -0,0 +1,35 @@
+import unittest
+
+import numpy as np
+
+from pyrf.devices.thinkrf import WSA
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import SweepDevice
+
+
+class TestSweepWorkers(unittest.TestCase):
+    def _sweeps(self, workers, mode, continuous=False):
+        dut = WSA(SimulatorConnector(RTSASimulator(
+            tones=[(2450e6, -30), (5800e6, -50)], noise_level=-100)))
+        dut.connect('simulator')
+        sd = SweepDevice(dut, workers=workers)
+        try:
+            return [sd.capture_power_spectrum(100e6, 8000e6, 100e3,
+                mode=mode, continuous=continuous)[2].copy()
+                for i in range(3)]
+        finally:
+            sd.close()
+
+    def test_same_as_inline(self):
+        for mode in ('SH', 'SHN'):
+            inline = self._sweeps(0, mode)
+            pooled = self._sweeps(2, mode)
+            for a, b in zip(inline, pooled):
+                np.testing.assert_array_equal(a, b)
+            self.assertAlmostEqual(pooled[0].max(), -30, delta=2)
+
+    def test_continuous(self):
+        inline = self._sweeps(0, 'SH', continuous=True)
+        pooled = self._sweeps(3, 'SH', continuous=True)
+        for a, b in zip(inline, pooled):
+            np.testing.assert_array_equal(a, b)
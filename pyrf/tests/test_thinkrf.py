@@ -0,0 +1,75 @@
+import unittest
+
+from pyrf.devices.thinkrf import WSA
+from pyrf.simulator import RTSASimulator, SimulatorConnector
+from pyrf.sweep_device import SweepPlanner
+
+
+class WriteRecordingConnector(SimulatorConnector):
+    """
+    A simulator connector that keeps each scpiset write and query sent
+    """
+    def __init__(self, simulator):
+        super(WriteRecordingConnector, self).__init__(simulator)
+        self.sent = []
+
+    def scpiset(self, cmd):
+        self.sent.append(('set', cmd))
+        super(WriteRecordingConnector, self).scpiset(cmd)
+
+    def scpiget_many(self, cmds):
+        self.sent.extend(('get', cmd) for cmd in cmds)
+        return super(WriteRecordingConnector, self).scpiget_many(cmds)
+
+    def raw_read(self, num):
+        self.sent.append(('read', num))
+        return super(WriteRecordingConnector, self).raw_read(num)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dut = WSA(WriteRecordingConnector(RTSASimulator()))
+        self.dut.connect('simulator')
+        self.sent = self.dut.connector.sent
+        del self.sent[:]
+
+    def test_single_write(self):
+        with self.dut.batch():
+            self.dut.scpiset(':FREQ:CENT 2400000000')
+            with self.dut.batch():
+                self.dut.scpiset(':INPUT:MODE SH')
+            self.dut.scpiset(':TRACE:SPP 1024')
+            self.assertEqual(self.sent, [])
+        self.assertEqual(self.sent, [('set', ':FREQ:CENT 2400000000\n'
+            ':INPUT:MODE SH\n:TRACE:SPP 1024')])
+        self.assertEqual(self.dut.freq(), 2400000000)
+
+    def test_query_flushes(self):
+        with self.dut.batch():
+            self.dut.scpiset(':FREQ:CENT 2400000000')
+            self.assertEqual(self.dut.freq(), 2400000000)
+            self.dut.scpiset(':TRACE:SPP 1024')
+            self.dut.scpiset(':TRACE:BLOCK:PACKETS 1')
+            self.dut.scpiset(':TRACE:BLOCK:DATA?')
+            self.dut.read()
+        self.assertEqual([kind for kind, cmd in self.sent[:3]],
+            ['set', 'get', 'set'])
+        self.assertEqual(self.sent[2], ('set', ':TRACE:SPP 1024\n'
+            ':TRACE:BLOCK:PACKETS 1\n:TRACE:BLOCK:DATA?'))
+        self.assertEqual(self.sent[3][0], 'read')
+
+    def test_exception_discards(self):
+        entry = SweepPlanner(self.dut.properties).plan_sweep(2300e6, 2400e6,
+            100e3, 'SH', {})
+        del entry.spp
+        try:
+            with self.dut.batch():
+                self.dut.sweep_clear()
+                self.dut.sweep_add(entry)
+        except AttributeError:
+            pass
+        else:
+            self.fail("sweep_add didn't fail")
+        self.assertEqual(self.sent, [])
+        self.dut.scpiset(':TRACE:SPP 1024')
+        self.assertEqual(self.sent, [('set', ':TRACE:SPP 1024')])
@@ -0,0 +1,183 @@
+import pickle
+import struct
+import unittest
+
+import numpy as np
+
+from pyrf.vrt import (vrt_packet_reader, vrt_packet_index, InvalidDataReceived,
+    BlockAssembler,
+    VRTDATA, VRTCONTEXT, VRTCUSTOMCONTEXT, VRTRECEIVER, VRTCUSTOM,
+    VRT_IFDATA_I14Q14, VRT_IFDATA_I14, CTX_RFFREQ, CTX_SWEEPID)
+
+
+def data_packet(stream_id, samples, count=0, tsi=0, tsf=0, trailer=0):
+    payload = np.asarray(samples, dtype='>i2').tobytes()
+    size = 6 + len(payload) // 4
+    return struct.pack('>IIIQ', (VRTDATA << 28) | (1 << 20)
+        | ((count & 0x0f) << 16) | size, stream_id, tsi, tsf
+        ) + payload + struct.pack('>I', trailer)
+
+def context_packet(ptype, stream_id, indicators, body, count=0, tsi=0, tsf=0):
+    size = 6 + len(body) // 4
+    return struct.pack('>IIIQI', (ptype << 28) | (1 << 20)
+        | ((count & 0x0f) << 16) | size, stream_id, tsi, tsf, indicators
+        ) + body
+
+def read_all(buf):
+    """
+    reference: parse buf packet by packet with vrt_packet_reader
+    """
+    pos = [0]
+    def raw_read(num):
+        data = buf[pos[0]:pos[0] + num]
+        pos[0] += num
+        return data
+    packets = []
+    while pos[0] < len(buf):
+        reader = vrt_packet_reader(raw_read)
+        data = next(reader)
+        while True:
+            result = reader.send(data)
+            if not isinstance(result, bytes):
+                break
+            data = result
+        packets.append(result)
+    return packets
+
+
+class TestVRTPacketIndex(unittest.TestCase):
+    def setUp(self):
+        self.last = data_packet(VRT_IFDATA_I14, range(32), count=3, tsi=13,
+            trailer=(1 << 26) | (1 << 14) | (1 << 24) | (1 << 12))
+        self.stream = b''.join([
+            context_packet(VRTCUSTOMCONTEXT, VRTCUSTOM, CTX_SWEEPID,
+                struct.pack('>I', 7), count=0, tsi=10, tsf=20),
+            context_packet(VRTCONTEXT, VRTRECEIVER, CTX_RFFREQ,
+                struct.pack('>Q', 2400 * 2 ** 20), count=1, tsi=11),
+            data_packet(VRT_IFDATA_I14Q14, range(-64, 64), count=2,
+                tsi=12, tsf=3 << 40, trailer=(1 << 30) | (1 << 18)),
+            self.last,
+            ])
+
+    def test_fields_match_packet_reader(self):
+        index = vrt_packet_index(self.stream)
+        expected = read_all(self.stream)
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual(index.consumed, len(self.stream))
+        for record, pkt in zip(index.packets, expected):
+            self.assertEqual(record['count'], pkt.count)
+            self.assertEqual(record['size'], pkt.size)
+            self.assertEqual(record['stream_id'], pkt.stream_id)
+            self.assertEqual(record['tsi'], pkt.tsi)
+            self.assertEqual(record['tsf'], pkt.tsf)
+            if pkt.is_data_packet():
+                for flag in ('valid_data', 'reference_lock', 'spec_inv',
+                        'over_range', 'sample_loss'):
+                    self.assertEqual(record[flag], getattr(pkt, flag))
+
+    def test_lazy_packets(self):
+        index = vrt_packet_index(self.stream)
+        expected = read_all(self.stream)
+        for pkt, ref in zip(index, expected):
+            self.assertEqual(pkt.is_data_packet(), ref.is_data_packet())
+            if pkt.is_data_packet():
+                np.testing.assert_array_equal(pkt.data.numpy_array(),
+                    ref.data.numpy_array())
+                self.assertEqual(pkt.spec_inv, ref.spec_inv)
+            else:
+                self.assertEqual(pkt.fields, ref.fields)
+        self.assertEqual(len(index.data_packets()), 2)
+        self.assertEqual(len(index.context_packets()), 2)
+
+    def test_pickle_data_packet(self):
+        index = vrt_packet_index(self.stream)
+        for n in (2, 3):
+            pkt = pickle.loads(pickle.dumps(index[n]))
+            ref = index[n]
+            np.testing.assert_array_equal(pkt.data.numpy_array(),
+                ref.data.numpy_array())
+            self.assertEqual((pkt.stream_id, pkt.count, pkt.tsi, pkt.tsf,
+                pkt.spec_inv, pkt.sample_loss), (ref.stream_id, ref.count,
+                ref.tsi, ref.tsf, ref.spec_inv, ref.sample_loss))
+
+    def test_partial_packet(self):
+        index = vrt_packet_index(self.stream[:-10])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.consumed, len(self.stream) - len(self.last))
+        rest = vrt_packet_index(self.stream, index.consumed)
+        self.assertEqual(len(rest), 1)
+        self.assertEqual(rest.packets[0]['offset'], index.consumed)
+
+    def test_invalid_packet_type(self):
+        self.assertRaises(InvalidDataReceived, vrt_packet_index,
+            struct.pack('>II', (7 << 28) | 2, 0))
+
+
+class TestBlockAssembler(unittest.TestCase):
+    def packets(self, stream_id, sizes, columns=None):
+        packets = []
+        start = 0
+        for n, size in enumerate(sizes):
+            shape = (size, columns) if columns else (size,)
+            samples = np.arange(start, start + np.prod(shape)).reshape(shape)
+            start += samples.size
+            packets.extend(read_all(data_packet(stream_id, samples.ravel(),
+                count=n, tsi=n)))
+        return packets
+
+    def test_iq_block(self):
+        packets = self.packets(VRT_IFDATA_I14Q14, [64, 64, 64], 2)
+        block = BlockAssembler(3)
+        self.assertEqual(block.add(packets[0]), None)
+        self.assertEqual(block.add(packets[1]), None)
+        result = block.add(packets[2])
+        expected = np.concatenate([p.data.numpy_array() for p in packets])
+        np.testing.assert_array_equal(result.data.numpy_array(), expected)
+        self.assertEqual(len(result.data), 192)
+        self.assertEqual(result.tsi, 0)
+        self.assertEqual(result.stream_id, VRT_IFDATA_I14Q14)
+        # the first packet is left unchanged
+        self.assertEqual(len(packets[0].data.numpy_array()), 64)
+
+    def test_reuse(self):
+        packets = self.packets(VRT_IFDATA_I14, [32] * 4)
+        block = BlockAssembler(2)
+        block.add(packets[0])
+        first = block.add(packets[1])
+        block.add(packets[2])
+        second = block.add(packets[3])
+        np.testing.assert_array_equal(first.data.numpy_array(),
+            np.arange(64))
+        np.testing.assert_array_equal(second.data.numpy_array(),
+            np.arange(64, 128))
+
+    def test_different_size(self):
+        packets = self.packets(VRT_IFDATA_I14, [32, 16, 32])
+        block = BlockAssembler(3)
+        block.add(packets[0])
+        block.add(packets[1])
+        result = block.add(packets[2]).data.numpy_array()
+        np.testing.assert_array_equal(result, np.arange(80))
+
+        packets = self.packets(VRT_IFDATA_I14, [16, 32, 32])
+        block = BlockAssembler(3)
+        block.add(packets[0])
+        block.add(packets[1])
+        result = block.add(packets[2]).data.numpy_array()
+        np.testing.assert_array_equal(result, np.arange(80))
+
+    def test_skip_different_type(self):
+        packets = self.packets(VRT_IFDATA_I14Q14, [32], 2)
+        packets += self.packets(VRT_IFDATA_I14, [64])
+        packets += self.packets(VRT_IFDATA_I14Q14, [32], 2)
+        block = BlockAssembler(3)
+        block.add(packets[0])
+        block.add(packets[1])
+        result = block.add(packets[2]).data.numpy_array()
+        self.assertEqual(block.packets_skipped, 1)
+        np.testing.assert_array_equal(result, np.concatenate(
+            [packets[0].data.numpy_array(), packets[2].data.numpy_array()]))
+
+    def test_single_packet(self):
+        packets = self.packets(VRT_IFDATA_I14, [32])
+        self.assertTrue(BlockAssembler(1).add(packets[0]) is packets[0])
@@ -1,12 +1,15 @@
+import copy
 import math
 
-from pyrf.vrt import I_ONLY
+from pyrf.vrt import I_ONLY, BlockAssembler
 import itertools
 from ast import literal_eval
-from pyrf.numpy_util import  compute_fft
+from pyrf.numpy_util import  compute_fft, compute_fft_batch
+from pyrf.detector import TraceDetector
 import numpy as np
 
-def capture_spectrum(dut, rbw = None, average=1, dec=1, fshift=0):
+def capture_spectrum(dut, rbw = None, average=1, dec=1, fshift=0,
+        detector=None):
     """
     Returns the spectral data, and the usable start and stop frequencies corresponding to the
     RTSA's current configuration
@@ -15,6 +18,10 @@ def capture_spectrum(dut, rbw = None, average=1, dec=1, fshift=0):
     :param int average: number of capture iterations
     :param int dec: decimation factor applied
     :param int fshift: the fshift applied, in Hz
+    :param detector: a :class:`pyrf.detector.TraceDetector` that combines
+                     the spectra of the captures, e.g. to max-hold them,
+                     or None to average their power.  It isn't reset, so
+                     it can combine the captures of several calls.
 
     :returns: (fstart, fstop, pow_data) where pow_data is a list
     """
@@ -34,7 +41,7 @@ def capture_spectrum(dut, rbw = None, average=1, dec=1, fshift=0):
         # determine if multiple packets per block are required
         if points > dut.properties.MAX_SPP:
             samples = dut.properties.MAX_SPP
-            packets = points / dut.properties.MAX_SPP
+            packets = points // dut.properties.MAX_SPP
         else:
             samples = points
             packets = 1
@@ -52,34 +59,44 @@ def capture_spectrum(dut, rbw = None, average=1, dec=1, fshift=0):
     fstop = freq + bandwidth/ 2
     usable_bins = compute_usable_bins(dut.properties, mode, points, dec, fshift)
 
-    total_pow = []
+    captures = []
     for v in range(average):
         dut.capture(samples, packets)
         # read data
+        block = BlockAssembler(packets)
         for p in range(packets):
+            d, c = collect_data_and_context(dut)
             if p == 0:
-                data, context = collect_data_and_context(dut)
-
-            else:
-                d, c = collect_data_and_context(dut)
-                data.data.np_array = np.concatenate([data.data.np_array, d.data.np_array])
-
-        # adjust fstart and fstop based on the spectral inversion
-        usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
-            dut.properties,
-            mode,
-            points,
-            dec,
-            freq,
-            data.spec_inv,
-            usable_bins)
-        # compute fft
-        pow_data = compute_fft(dut, data, context)
-        if not len(total_pow):
-            total_pow = pow_data
-        else:
-            total_pow = np.add(total_pow, pow_data)
-    pow_data = total_pow / average
+                context = c
+            data = block.add(d)
+        if packets == 1:
+            # the packet may be in the connector's receive buffer, which
+            # the next capture may reuse, copying a DataPacket copies its
+            # payload
+            data = copy.copy(data)
+        captures.append((context, data))
+
+        if v == 0:
+            # adjust fstart and fstop based on the spectral inversion
+            usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
+                dut.properties,
+                mode,
+                points,
+                dec,
+                freq,
+                data.spec_inv,
+                usable_bins)
+
+    # compute the ffts of consecutive captures of the same size and
+    # context together
+    if detector is None:
+        detector = TraceDetector()
+    batches = itertools.groupby(captures,
+        lambda c: (c[0], c[1].stream_id, len(c[1].data)))
+    for (context, stream_id, size), batch in batches:
+        pow_batch = compute_fft_batch(dut, [d for c, d in batch], context)
+        for spectrum in pow_batch:
+            pow_data = detector.add(spectrum)
     # trim FFT
     pow_data, usable_bins, fstart, fstop = trim_to_usable_fstart_fstop(pow_data,
                                                                     usable_bins,
@@ -161,7 +178,7 @@ def compute_usable_bins(dut_prop, rfe_mode, points, decimation, fshift):
 
     if decimation == 1 and dut_prop.DEFAULT_SAMPLE_TYPE.get(rfe_mode) == I_ONLY:
         # we're getting only 1/2 the bins
-        usable_bins = [(x/2, y/2) for x, y in usable_bins]
+        usable_bins = [(x // 2, y // 2) for x, y in usable_bins]
 
     # XXX usable bins for SH + fshift aren't correct yet, so show everything
     if rfe_mode in ('SH', 'SHN') and decimation > 1:
@@ -193,7 +210,7 @@ def adjust_usable_fstart_fstop(dut_prop, rfe_mode, points, decimation,
     # XXX here we "know" that bins = samples/2
     if spec_inv and rfe_mode in ('SH', 'SHN'):
         [(start, run)] = usable_bins
-        start = points / 2 - start - run - 1
+        start = points // 2 - start - run - 1
         usable_bins = [(start, run)]
 
     return usable_bins, fstart, fstop
@@ -278,13 +295,12 @@ def capture_sweep_spectrum(dut, mode, points, dec = 1, fshift = 0, packets = 1):
     total_pow = []
     samples = int(points / packets)
     # read data
+    block = BlockAssembler(packets)
     for p in range(packets):
+        d, c = collect_data_and_context(dut)
         if p == 0:
-            data, context = collect_data_and_context(dut)
-
-        else:
-            d, c = collect_data_and_context(dut, samples)
-            data.data.np_array = np.concatenate([data.data.np_array, d.data.np_array])
+            context = c
+        data = block.add(d)
 
     # adjust fstart and fstop based on the spectral inversion
     usable_bins, fstart, fstop = adjust_usable_fstart_fstop(
@@ -336,8 +352,8 @@ def compute_spp_ppb(samples, properties):
         spp = samples
         while spp > properties.MAX_SPP:
             count += 1
-            spp = (int(spp /properties.SPP_MULTIPLE) * properties.SPP_MULTIPLE) / 2
-        ppb = samples / spp
+            spp = (int(spp /properties.SPP_MULTIPLE) * properties.SPP_MULTIPLE) // 2
+        ppb = samples // spp
         spp = valid_samples[int((float(spp) / float(properties.SPP_MULTIPLE)) - 7)]
 
     else:
@@ -3,6 +3,8 @@ import array
 import sys
 import zlib
 import json
+import copy
+from timeit import default_timer
 import numpy as np
 
 # VRT Packet Type
@@ -42,10 +44,28 @@ VRTSPECA = 0x5370eca0
 I_ONLY = 'i_only'
 IQ = 'iq'
 
+# the 4-bit packet count in the VRT header wraps at this value
+VRT_COUNT_MODULO = 16
+
 class InvalidDataReceived(Exception):
     pass
 
-def vrt_packet_reader(raw_read):
+def _frombuffer(data, dtype, count=-1, offset=0):
+    """
+    :func:`numpy.frombuffer` that also accepts memoryview slices, which
+    numpy can only wrap through the new buffer protocol on Python 2.
+    The returned array shares memory with *data*.
+    """
+    if isinstance(data, memoryview):
+        data = np.asarray(data)
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+def _tobytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+def vrt_packet_reader(raw_read, stats=None):
     """
     Read a VRT packet, parse it and return an object with its data.
 
@@ -53,6 +73,8 @@ def vrt_packet_reader(raw_read):
     *raw_read* function and accepts the value sent as its data.
 
     :param list raw_read: VRT packet of raw data (bytes)
+    :param stats: a :class:`pyrf.stats.ConnectionStats` to record the
+                  packet and the time spent decoding it in, or *None*
     """
     tmpstr = yield raw_read(4)
     if not tmpstr:
@@ -66,21 +88,31 @@ def vrt_packet_reader(raw_read):
     if packet_type in (VRTCONTEXT, VRTCUSTOMCONTEXT):
         packet_size = (size - 1) * 4
         context_data = yield raw_read(packet_size)
-        yield ContextPacket(packet_type, count, size, context_data,
-            has_timestamp)
+        start = default_timer()
+        # context packets are small, keep their own copy of the data
+        # so they never reference a reused receive buffer
+        packet = ContextPacket(packet_type, count, size,
+            _tobytes(context_data), has_timestamp)
 
     elif packet_type == VRTDATA:
         data_header = yield raw_read(16)
-        stream_id, tsi, tsf = struct.unpack(">IIQ", data_header)
         payload_size = (size - 5 - 1) * 4
         payload = yield raw_read(payload_size)
         trailer = yield raw_read(4)
+        start = default_timer()
+        stream_id, tsi, tsf = struct.unpack(">IIQ", data_header)
         trailer = struct.unpack(">I", trailer)[0]
-        yield DataPacket(count, size, stream_id, tsi, tsf, payload, trailer)
+        packet = DataPacket(count, size, stream_id, tsi, tsf, payload,
+            trailer)
 
     else:
         raise InvalidDataReceived("unknown packet type: %s" % packet_type)
 
+    if stats is not None:
+        stats.parse_time.record(default_timer() - start)
+        stats.record_packet(packet, size * 4)
+    yield packet
+
 class ContextPacket(object):
     """
     A Context Packet received from :meth:`pyrf.devices.thinkrf.WSA.read`.
@@ -318,18 +350,19 @@ class IQData(object):
     def __init__(self, binary_data):
         self._strdata = binary_data
         self._data = None
-        self.np_array = np.frombuffer(self._strdata, dtype=np.int16)
-        self.np_array = self.np_array.newbyteorder('>')
+        self.np_array = _frombuffer(self._strdata, dtype=np.int16)
+        self.np_array = self.np_array.view(
+            self.np_array.dtype.newbyteorder('>'))
         self.np_array.shape = (-1, 2)
 
     def _update_data(self):
         self._data = array.array('h')
-        self._data.fromstring(self._strdata)
+        self._data.fromstring(_tobytes(self._strdata))
         if sys.byteorder == 'little':
             self._data.byteswap()
 
     def __len__(self):
-        return len(self._strdata) / 4
+        return len(self._strdata) // 4
 
     def __getitem__(self, n):
         if not self._data:
@@ -370,12 +403,13 @@ class DataArray(object):
 
     def _init_numpy_array(self):
 
-        self.np_array = np.frombuffer(self._strdata, dtype={
+        self.np_array = _frombuffer(self._strdata, dtype={
             1: np.int8,
             2: np.int16,
             4: np.int32,}[self._bytes_per_sample])
         if self._bytes_per_sample > 1:
-            self.np_array = self.np_array.newbyteorder('>')
+            self.np_array = self.np_array.view(
+                self.np_array.dtype.newbyteorder('>'))
 
 
     def _update_data(self):
@@ -384,12 +418,12 @@ class DataArray(object):
             2: 'h',
             4: 'l' if array.array('l').itemsize == 4 else 'i',
             }[self._bytes_per_sample])
-        self._data.fromstring(self._strdata)
+        self._data.fromstring(_tobytes(self._strdata))
         if self._bytes_per_sample > 1 and sys.byteorder == 'little':
             self._data.byteswap()
 
     def __len__(self):
-        return len(self._strdata) / self._bytes_per_sample
+        return len(self._strdata) // self._bytes_per_sample
 
     def __getitem__(self, n):
         if not self._data:
@@ -439,6 +473,7 @@ class DataPacket(object):
         else:
             self.data = IQData(payload)
 
+        self.trailer = trailer
         self.valid_data = bool((trailer >> 18) & (trailer >> 30) & 1)
         self.reference_lock = bool((trailer >> 17) & (trailer >> 29) & 1)
         self.spec_inv = bool((trailer >> 14) & (trailer >> 26) & 1)
@@ -463,6 +498,310 @@ class DataPacket(object):
     def __str__(self):
         return ("Data #%02d [%d.%012d, %d samples]" % (self.count, self.tsi, self.tsf, len(self.data)))
 
+    def __reduce__(self):
+        # pickle a copy of the payload, the packet may reference a
+        # receive buffer or memory-mapped recording
+        return (DataPacket, (self.count, self.size, self.stream_id, self.tsi,
+            self.tsf, self.data.numpy_array().tobytes(), self.trailer))
+
+
+class BlockAssembler(object):
+    """
+    Join the data of the data packets in a capture block into a single
+    :class:`DataPacket`.
+
+    The buffer for the whole block is allocated when the first packet
+    arrives, sized for *packets_per_block* packets like the first one,
+    and each packet's samples are copied after the previous packet's
+    instead of concatenating arrays as every packet arrives.  The block
+    holds the samples actually received: it is grown if packets are
+    longer than the first and ends after the last sample if they are
+    shorter.
+
+    :param int packets_per_block: the number of data packets in a block
+
+    .. attribute:: packets_skipped
+
+       the number of packets left out of blocks because their type of
+       data differs from the first packet of their block
+    """
+
+    def __init__(self, packets_per_block):
+        self.packets_per_block = int(packets_per_block)
+        self.packets_read = 0
+        self.packets_skipped = 0
+        self._first = None
+        self._buf = None
+        self._samples = None
+        self._used = 0
+
+    def add(self, packet):
+        """
+        Copy the data of *packet* after the data of the previous packets
+        of the block.  Packets with a different type of data than the
+        first packet of the block, e.g. I only instead of I and Q, are
+        counted in :attr:`packets_skipped` and left out of the block.
+
+        :param packet: a data packet of the block
+        :type packet: pyrf.vrt.DataPacket
+        :returns: a :class:`DataPacket` with the header fields of the
+                  first packet and the data of the whole block once the
+                  last packet has been added, otherwise None
+        """
+        if self.packets_per_block == 1:
+            return packet
+
+        samples = packet.data.np_array
+        if self.packets_read == 0:
+            self._first = packet
+            self._allocate(samples, len(samples) * self.packets_per_block)
+
+        if (samples.dtype != self._samples.dtype
+                or samples.shape[1:] != self._samples.shape[1:]):
+            self.packets_skipped += 1
+        else:
+            end = self._used + len(samples)
+            if end > len(self._samples):
+                self._allocate(samples, end)
+            self._samples[self._used:end] = samples
+            self._used = end
+        self.packets_read += 1
+
+        if self.packets_read < self.packets_per_block:
+            return None
+        return self._finish()
+
+    def _allocate(self, samples, length):
+        """
+        Allocate the block buffer for *length* samples like *samples*,
+        keeping the samples already copied
+        """
+        row = samples.itemsize * int(np.prod(samples.shape[1:]))
+        buf = bytearray(row * length)
+        array = _frombuffer(buf, samples.dtype)
+        array.shape = (-1,) + samples.shape[1:]
+        if self._used:
+            array[:self._used] = self._samples[:self._used]
+        self._buf = buf
+        self._samples = array
+
+    def _finish(self):
+        block = copy.copy(self._first)
+        data = block.data
+        buf = memoryview(self._buf)[:self._samples[:self._used].nbytes]
+        if isinstance(data, IQData):
+            block.data = IQData(buf)
+        else:
+            block.data = DataArray(buf, data._bytes_per_sample)
+        self.packets_read = 0
+        self._used = 0
+        self._first = self._buf = self._samples = None
+        return block
+
+# one record per packet found by vrt_packet_index(), offsets are in bytes
+VRT_INDEX_DTYPE = np.dtype([
+    ('offset', np.uint64),
+    ('ptype', np.uint8),
+    ('count', np.uint8),
+    ('size', np.uint16),
+    ('has_timestamp', np.bool_),
+    ('stream_id', np.uint32),
+    ('tsi', np.uint32),
+    ('tsf', np.uint64),
+    ('payload_offset', np.uint64),
+    ('payload_size', np.uint32),
+    ('trailer', np.uint32),
+    ('valid_data', np.bool_),
+    ('reference_lock', np.bool_),
+    ('spec_inv', np.bool_),
+    ('over_range', np.bool_),
+    ('sample_loss', np.bool_),
+    ])
+
+_HEADER_WORD = struct.Struct(">I")
+
+def vrt_packet_index(buf, offset=0):
+    """
+    Parse every complete VRT packet in a pre-buffered byte stream in
+    one pass and return a :class:`VRTPacketIndex` describing them.
+
+    Only the header word of each packet is read in Python to find the
+    packet boundaries, all other header, timestamp, stream id and
+    trailer fields are decoded with vectorized numpy operations.
+    A partial packet at the end of *buf* is left unparsed, see
+    :attr:`VRTPacketIndex.consumed`.
+
+    :param buf: bytes, bytearray, memoryview or mmap holding raw VRT data
+    :param int offset: byte offset in *buf* of the first packet header
+    :returns: a :class:`VRTPacketIndex`
+    """
+    end = len(buf)
+    unpack_header = _HEADER_WORD.unpack_from
+    starts = []
+    pos = offset
+    while pos + 4 <= end:
+        (word,) = unpack_header(buf, pos)
+        size = word & 0xffff
+        if not size:
+            raise InvalidDataReceived("zero length packet at offset %d" % pos)
+        if pos + size * 4 > end:
+            break
+        starts.append(pos)
+        pos += size * 4
+
+    packets = np.zeros(len(starts), dtype=VRT_INDEX_DTYPE)
+    if not starts:
+        return VRTPacketIndex(buf, packets, pos - offset)
+
+    words = _frombuffer(buf, dtype='>u4', count=(pos - offset) // 4,
+        offset=offset).astype(np.uint64)
+    starts = np.array(starts, dtype=np.uint64)
+    w = ((starts - offset) // 4).astype(np.intp)
+    last = len(words) - 1
+
+    def word(n):
+        return words[np.minimum(w + n, last)]
+
+    header = words[w]
+    ptype = (header >> 28) & 0x0f
+    size = header & 0xffff
+    has_timestamp = ((header >> 20) & 0x0f) != 0
+    is_data = ptype == VRTDATA
+    is_context = (ptype == VRTCONTEXT) | (ptype == VRTCUSTOMCONTEXT)
+
+    unknown = ~(is_data | is_context)
+    if unknown.any():
+        raise InvalidDataReceived("unknown packet type: %s"
+            % ptype[np.argmax(unknown)])
+    if (is_data & (size < 6)).any() or (size < 2).any():
+        raise InvalidDataReceived("truncated packet at offset %d"
+            % starts[np.argmax((is_data & (size < 6)) | (size < 2))])
+
+    # data packets always carry a timestamp (see vrt_packet_reader)
+    timestamped = is_data | (has_timestamp & (size >= 5))
+    trailer = np.where(is_data, words[w + size.astype(np.intp) - 1], 0)
+
+    packets['offset'] = starts
+    packets['ptype'] = ptype
+    packets['count'] = (header >> 16) & 0x0f
+    packets['size'] = size
+    packets['has_timestamp'] = has_timestamp
+    packets['stream_id'] = words[w + 1]
+    packets['tsi'] = np.where(timestamped, word(2), 0)
+    packets['tsf'] = np.where(timestamped, (word(3) << 32) | word(4), 0)
+    packets['payload_offset'] = np.where(is_data, starts + 20, starts + 4)
+    packets['payload_size'] = np.where(is_data, (size - 6) * 4,
+        (size - 1) * 4)
+    packets['trailer'] = trailer
+    packets['valid_data'] = (trailer >> 18) & (trailer >> 30) & 1
+    packets['reference_lock'] = (trailer >> 17) & (trailer >> 29) & 1
+    packets['spec_inv'] = (trailer >> 14) & (trailer >> 26) & 1
+    packets['over_range'] = (trailer >> 13) & (trailer >> 25) & 1
+    packets['sample_loss'] = (trailer >> 12) & (trailer >> 24) & 1
+
+    return VRTPacketIndex(buf, packets, pos - offset)
+
+
+class VRTPacketIndex(object):
+    """
+    The result of :func:`vrt_packet_index`: a table of the VRT packets
+    found in a buffer.  :class:`DataPacket` and :class:`ContextPacket`
+    objects are only built when a packet is requested with indexing or
+    iteration, and data packets reference the payload bytes in the
+    buffer without copying them.
+
+    .. attribute:: packets
+
+       numpy structured array with one :data:`VRT_INDEX_DTYPE` record
+       per packet
+
+    .. attribute:: consumed
+
+       number of bytes parsed; bytes past this point belong to an
+       incomplete packet
+    """
+
+    def __init__(self, buf, packets, consumed):
+        self.buffer = buf
+        self.packets = packets
+        self.consumed = consumed
+        try:
+            self._view = memoryview(buf)
+        except TypeError:
+            # Python 2 mmap objects only have the old buffer interface
+            self._view = memoryview(np.frombuffer(buf, dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.packets)
+
+    def __getitem__(self, n):
+        return self._build_packet(self.packets[n])
+
+    def __iter__(self):
+        for record in self.packets:
+            yield self._build_packet(record)
+
+    def data_packets(self):
+        """
+        :returns: the records of the data packets only
+        """
+        return self.packets[self.packets['ptype'] == VRTDATA]
+
+    def context_packets(self):
+        """
+        :returns: the records of the context packets only
+        """
+        return self.packets[self.packets['ptype'] != VRTDATA]
+
+    def payload(self, record):
+        """
+        :param record: a record from :attr:`packets`
+        :returns: a memoryview of the packet payload (sample data for
+                  data packets, everything after the header word for
+                  context packets)
+        """
+        start = int(record['payload_offset'])
+        return self._view[start:start + int(record['payload_size'])]
+
+    def _build_packet(self, record):
+        payload = self.payload(record)
+        if record['ptype'] == VRTDATA:
+            return DataPacket(int(record['count']), int(record['size']),
+                int(record['stream_id']), int(record['tsi']),
+                int(record['tsf']), payload, int(record['trailer']))
+        return ContextPacket(int(record['ptype']), int(record['count']),
+            int(record['size']), payload.tobytes(),
+            bool(record['has_timestamp']))
+
+
+# (stream id, indicator, struct format, scale) of the context fields
+# generate_context_packet() can write
+_CONTEXT_FIELDS = {
+    'rffreq': (VRTRECEIVER, CTX_RFFREQ, '>Q', 2 ** 20),
+    'bandwidth': (VRTDIGITIZER, CTX_BANDWIDTH, '>Q', 2 ** 20),
+    'reflevel': (VRTDIGITIZER, CTX_REFERENCELEVEL, '>xxh', 2 ** 7),
+    'sweepid': (VRTCUSTOM, CTX_SWEEPID, '>I', 1),
+    'streamid': (VRTCUSTOM, CTX_STREAMID, '>I', 1),
+    }
+
+def generate_context_packet(field, value, count=0, tsi=0, tsf=0):
+    """
+    :param str field: the context field to send, one of 'rffreq',
+                      'bandwidth', 'reflevel', 'sweepid' or 'streamid'
+    :param value: the field's value, as :class:`ContextPacket` reports it
+    :param int count: count for the header of this packet
+    :param int tsi: integer seconds timestamp
+    :param int tsf: fractional seconds timestamp
+
+    :returns: (vrt packet bytes, next count int)
+    """
+    stream_id, indicator, fmt, scale = _CONTEXT_FIELDS[field]
+    payload = struct.pack(fmt, int(round(value * scale)))
+    size = 6 + len(payload) // 4
+    header = struct.pack('>IIIQI',
+        (VRTCONTEXT << 28) | (1 << 20) | ((count & 0x0f) << 16) | size,
+        stream_id, tsi, tsf, indicator)
+    return header + payload, (count + 1) & 0x0f
 
 def generate_speca_packet(data, count=0):
     """
@@ -471,12 +810,41 @@ def generate_speca_packet(data, count=0):
 
     :returns: (vrt packet bytes, next count int)
     """
-    payload = zlib.compress(json.dumps(data, separators=(',', ':')))
-    padding = '\0' * ((-len(payload)) % 4)
-    size = 2 + (len(payload) + len(padding)) / 4
+    payload = zlib.compress(json.dumps(data, separators=(',', ':')
+        ).encode('utf-8'))
+    padding = b'\0' * ((-len(payload)) % 4)
+    size = 2 + (len(payload) + len(padding)) // 4
     assert size < 2 ** 16, 'speca data is too large: %s' % data
     header = struct.pack('>II',
         (VRTCUSTOMCONTEXT << 28) | ((count & 0x0f) << 16) | size,
         VRTSPECA,
         )
-    return ''.join((header, payload, padding)), (count + 1) & 0x0f
+    return b''.join((header, payload, padding)), (count + 1) & 0x0f
+
+def generate_data_packet(stream_id, samples, count=0, tsi=0, tsf=0,
+        trailer=0):
+    """
+    :param int stream_id: data stream id, e.g. :data:`VRT_IFDATA_I14Q14`
+    :param samples: integer sample values, an (N, 2) array of I, Q pairs
+                    for :data:`VRT_IFDATA_I14Q14` data
+    :param int count: count for the header of this packet
+    :param int tsi: integer seconds timestamp
+    :param int tsf: fractional seconds timestamp
+    :param int trailer: trailer word, see :class:`DataPacket` for the
+                        indicator bits
+
+    :returns: (vrt packet bytes, next count int)
+    """
+    dtype = {
+        VRT_IFDATA_I24: '>i4',
+        VRT_IFDATA_PSD8: 'i1',
+        }.get(stream_id, '>i2')
+    payload = np.asarray(samples).astype(dtype).tobytes()
+    payload += b'\0' * ((-len(payload)) % 4)
+    size = 6 + len(payload) // 4
+    assert size < 2 ** 16, 'too many samples for one packet: %d' % size
+    header = struct.pack('>IIIQ',
+        (VRTDATA << 28) | (1 << 20) | ((count & 0x0f) << 16) | size,
+        stream_id, tsi, tsf)
+    return (b''.join((header, payload, struct.pack('>I', trailer))),
+        (count + 1) & 0x0f)